@@ -0,0 +1,73 @@
+"""
+Compare two benchmark results written by benchmarks.run, stage by stage.
+
+    python -m benchmarks.compare before.json after.json --fail-above 10
+
+Exits with status 1 if --fail-above is given and any stage got slower by more
+than that many percent.
+"""
+
+import argparse
+import io
+import json
+import sys
+
+from .scale import format_scale
+
+
+def load(path):
+    with io.open(path, encoding='utf-8') as fp:
+        results = json.load(fp)
+    return results, dict(((run['db'], run['rows']), run) for run in results['runs'])
+
+
+def change(old, new):
+    if not old or new is None:
+        return None
+    return 100.0 * (new - old) / old
+
+
+def format_change(value):
+    return '-' if value is None else '{:+.1f}%'.format(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--fail-above', type=float, default=None, metavar='PERCENT',
+                        help="Fail if a stage's wall time grew by more than this.")
+    args = parser.parse_args(argv)
+
+    before, before_runs = load(args.before)
+    after, after_runs = load(args.after)
+    print("{} -> {}".format((before['commit'] or '?')[:12], (after['commit'] or '?')[:12]))
+
+    regressions = []
+    for key, run in sorted(after_runs.items()):
+        old_run = before_runs.get(key)
+        if old_run is None:
+            continue
+        print("{}, {} rows:".format(key[0], format_scale(key[1])))
+        print("  {:<12} {:>10} {:>10} {:>9} {:>10} {:>10} {:>9}".format(
+            'stage', 'seconds', 'before', 'change', 'peak MB', 'before', 'change'))
+        for stage, stats in run['stages'].items():
+            old = old_run['stages'].get(stage)
+            if old is None:
+                continue
+            time_change = change(old['wall_time'], stats['wall_time'])
+            print("  {:<12} {:>10.2f} {:>10.2f} {:>9} {:>10} {:>10} {:>9}".format(
+                stage, stats['wall_time'], old['wall_time'], format_change(time_change),
+                (stats['peak_rss'] or 0) // (1024 * 1024), (old['peak_rss'] or 0) // (1024 * 1024),
+                format_change(change(old['peak_rss'], stats['peak_rss']))))
+            if args.fail_above is not None and time_change is not None and time_change > args.fail_above:
+                regressions.append((key, stage, time_change))
+
+    for (db, rows), stage, time_change in regressions:
+        print("Regression: {} on {} with {} rows is {:.1f}% slower".format(
+            stage, db, format_scale(rows), time_change))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
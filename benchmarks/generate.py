@@ -0,0 +1,225 @@
+"""
+Generate synthetic GeoNames data files for benchmarking the import.
+
+The files have the columns of the real ones and hang together the way the
+real ones do: cities and postal codes belong to the generated countries and
+regions, districts are linked to cities in the hierarchy, and alternative
+names belong to generated places. The same number of rows and seed always
+give the same files.
+
+    python -m benchmarks.generate --rows 1M benchmarks/work/data-1M
+"""
+
+import argparse
+import io
+import os
+import random
+from itertools import product
+from string import ascii_uppercase
+
+from .scale import format_scale, parse_scale
+
+
+# The names of the files in the data directory, by CITIES_FILES key
+filenames = {
+    'country': 'countryInfo.txt',
+    'region': 'admin1CodesASCII.txt',
+    'subregion': 'admin2Codes.txt',
+    'city': 'cities.txt',
+    'hierarchy': 'hierarchy.txt',
+    'alt_name': 'alternateNames.txt',
+    'postal_code': 'allCountries.txt',
+}
+
+continents = ['AF', 'AS', 'EU', 'NA', 'OC', 'SA', 'AN']
+
+# Of the places in the cities file
+district_share = 0.1
+other_share = 0.05
+city_kinds = ['PPL', 'PPL', 'PPL', 'PPLA', 'PPLA2', 'PPLA3', 'PPLC']
+other_kinds = ['STM', 'HLL', 'LK']
+
+alt_name_languages = ['en', 'und', 'en', 'de', 'fr', 'ru', 'link', 'abbr', 'post']
+
+# The first geonameid of each kind of place
+country_id_base = 1
+region_id_base = 1000000
+subregion_id_base = 2000000
+city_id_base = 10000000
+
+syllables = ['ka', 'lo', 'mi', 'ra', 'to', 'ne', 'su', 'vi', 'da', 'ber', 'gen', 'hol', 'stad', 'burg']
+
+
+class Generator(object):
+    def __init__(self, rows, seed=0):
+        self.rows = rows
+        self.random = random.Random(seed)
+
+        num_countries = min(max(rows // 1000, 10), 250)
+        codes = [a + b for a, b in product(ascii_uppercase, repeat=2) if a + b not in ('AN', 'CS')]
+        self.countries = [{
+            'code': code,
+            'id': country_id_base + i,
+            'continent': continents[i % len(continents)],
+            'latitude': self.random.uniform(-60, 60),
+            'longitude': self.random.uniform(-170, 170),
+        } for i, code in enumerate(codes[:num_countries])]
+
+        num_regions = min(max(rows // 200, num_countries), 4000)
+        self.regions = []
+        for i in range(num_regions):
+            country = self.countries[i % num_countries]
+            self.regions.append({
+                'country': country,
+                'code': '{:02d}'.format(i // num_countries + 1),
+                'id': region_id_base + i,
+                'name': self.name(i, 'Province'),
+            })
+
+        num_subregions = min(max(rows // 20, num_regions), 50000)
+        self.subregions = []
+        for i in range(num_subregions):
+            region = self.regions[i % num_regions]
+            self.subregions.append({
+                'region': region,
+                'code': str(i // num_regions + 1),
+                'id': subregion_id_base + i,
+                'name': self.name(i, 'County'),
+            })
+
+        self.subregions_by_country = {}
+        for subregion in self.subregions:
+            self.subregions_by_country.setdefault(subregion['region']['country']['code'], []).append(subregion)
+
+    def name(self, i, suffix=''):
+        parts = []
+        while True:
+            parts.append(syllables[i % len(syllables)])
+            i //= len(syllables)
+            if not i:
+                break
+        name = ''.join(parts).capitalize()
+        return '{} {}'.format(name, suffix) if suffix else name
+
+    def place(self, country):
+        return (round(country['latitude'] + self.random.uniform(-5, 5), 5),
+                round(country['longitude'] + self.random.uniform(-5, 5), 5))
+
+    def write(self, directory):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for key, filename in sorted(filenames.items()):
+            with io.open(os.path.join(directory, filename), 'w', encoding='utf-8', newline='\n') as fp:
+                for row in getattr(self, 'generate_' + key)():
+                    fp.write('\t'.join(str(value) for value in row))
+                    fp.write('\n')
+
+    def generate_country(self):
+        yield ['#ISO', 'ISO3', 'ISO-Numeric', 'fips', 'Country', 'Capital', 'Area(in sq km)',
+               'Population', 'Continent', 'tld', 'CurrencyCode', 'CurrencyName', 'Phone',
+               'Postal Code Format', 'Postal Code Regex', 'Languages', 'geonameid',
+               'neighbours', 'EquivalentFipsCode']
+        codes = [country['code'] for country in self.countries]
+        for i, country in enumerate(self.countries):
+            neighbours = ','.join(codes[j % len(codes)] for j in (i - 1, i + 1))
+            yield [country['code'], country['code'] + 'X', i, country['code'], self.name(i, 'Land'),
+                   self.name(i), self.random.randint(100, 10000000), self.random.randint(1000, 100000000),
+                   country['continent'], '.' + country['code'].lower(), 'EUR', 'Euro', i,
+                   '#####', r'^(\d{5})$', 'en', country['id'], neighbours, '']
+
+    def generate_region(self):
+        for region in self.regions:
+            yield ['{}.{}'.format(region['country']['code'], region['code']),
+                   region['name'], region['name'], region['id']]
+
+    def generate_subregion(self):
+        for subregion in self.subregions:
+            region = subregion['region']
+            yield ['{}.{}.{}'.format(region['country']['code'], region['code'], subregion['code']),
+                   subregion['name'], subregion['name'], subregion['id']]
+
+    def kind(self, i):
+        """The feature code of the ``i``th row of the cities file."""
+        share = (i * 0.618034) % 1
+        if share < district_share:
+            return 'PPLX'
+        if share < district_share + other_share:
+            return other_kinds[i % len(other_kinds)]
+        return city_kinds[i % len(city_kinds)]
+
+    def generate_city(self):
+        for i in range(self.rows):
+            subregion = self.subregions[i % len(self.subregions)]
+            region = subregion['region']
+            country = region['country']
+            kind = self.kind(i)
+            latitude, longitude = self.place(country)
+            name = self.name(i)
+            yield [city_id_base + i, name, name, '', latitude, longitude,
+                   'H' if kind in other_kinds else 'P', kind, country['code'], '',
+                   region['code'], subregion['code'], '', '',
+                   int(self.random.paretovariate(1.2) * 1000), self.random.randint(0, 2000), '',
+                   'Europe/Andorra', '2020-01-01']
+
+    def generate_hierarchy(self):
+        # Cities belong to their subregion, and districts to the last city
+        # before them in the same subregion. Districts without one are left
+        # out, like the districts the real file misses
+        last_city_ids = {}
+        for i in range(self.rows):
+            kind = self.kind(i)
+            subregion = self.subregions[i % len(self.subregions)]
+            if kind == 'PPLX':
+                if subregion['id'] in last_city_ids:
+                    yield [last_city_ids[subregion['id']], city_id_base + i, 'ADM']
+            elif kind in city_kinds:
+                yield [subregion['id'], city_id_base + i, 'ADM']
+                last_city_ids[subregion['id']] = city_id_base + i
+
+    def generate_alt_name(self):
+        place_ids = ([country['id'] for country in self.countries] +
+                     [region['id'] for region in self.regions] +
+                     [subregion['id'] for subregion in self.subregions])
+        for i in range(self.rows):
+            if i % 4 == 0:
+                geonameid = place_ids[i // 4 % len(place_ids)]
+            else:
+                geonameid = city_id_base + self.random.randrange(self.rows)
+            language = alt_name_languages[i % len(alt_name_languages)]
+            yield [i + 1, geonameid, language, self.name(i * 7 + 3),
+                   1 if i % 10 == 0 else '', 1 if i % 17 == 0 else '', '', 1 if i % 29 == 0 else '']
+
+    def generate_postal_code(self):
+        # The real file is sorted by country
+        per_country = max(self.rows // len(self.countries), 1)
+        for country in self.countries:
+            subregions = self.subregions_by_country.get(country['code']) or [None]
+            for i in range(per_country):
+                subregion = subregions[i % len(subregions)]
+                region = subregion['region'] if subregion else None
+                latitude, longitude = self.place(country)
+                yield [country['code'], '{:05d}'.format(i), self.name(i, 'Post'),
+                       region['name'] if region else '', region['code'] if region else '',
+                       subregion['name'] if subregion else '', subregion['code'] if subregion else '',
+                       '', '', latitude, longitude, 4]
+
+
+def generate(directory, rows, seed=0):
+    """Write the data files for ``rows`` rows per large file to ``directory``."""
+    Generator(rows, seed).write(directory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('directory')
+    parser.add_argument('--rows', type=parse_scale, default='10k',
+                        help="Rows in each of the large files, e.g. 10k, 1M or 10M.")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    generate(args.directory, args.rows, args.seed)
+    print("Generated {} rows per file in {}".format(format_scale(args.rows), args.directory))
+
+
+if __name__ == '__main__':
+    main()
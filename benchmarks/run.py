@@ -0,0 +1,152 @@
+"""
+Benchmark the import stages of the cities command on synthetic GeoNames data.
+
+Every stage runs in its own process, with --stats-file, so each stage's time
+and peak memory are measured on their own. The results are written as JSON
+with the commit they were measured at, for benchmarks.compare.
+
+    python -m benchmarks.run --rows 10k --rows 1M --db spatialite --db postgis \\
+        --output benchmarks/work/results.json
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+from .generate import generate
+from .scale import format_scale, parse_scale
+
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+stages = ['country', 'region', 'subregion', 'city', 'district', 'alt_name', 'postal_code']
+
+# The stage statistics that are kept in the results
+stat_keys = ['wall_time', 'rows_read', 'rows_skipped', 'rows_created', 'rows_updated',
+             'rows_unchanged', 'rows_per_second', 'queries', 'query_time', 'peak_rss', 'files']
+
+
+def git(*args):
+    try:
+        return subprocess.check_output(('git',) + args, cwd=root_dir).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_data_dir(work_dir, rows, seed):
+    data_dir = os.path.join(work_dir, 'data-{}-{}'.format(format_scale(rows), seed))
+    marker = os.path.join(data_dir, '.complete')
+    if not os.path.exists(marker):
+        print("Generating {} rows in {}".format(format_scale(rows), data_dir))
+        generate(data_dir, rows, seed)
+        io.open(marker, 'w').close()
+    return data_dir
+
+
+class Runner(object):
+    def __init__(self, db, data_dir, work_dir, command_args):
+        self.db = db
+        self.command_args = command_args
+        self.env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE='benchmarks.settings',
+            CITIES_BENCHMARK_DB=db,
+            CITIES_BENCHMARK_DATA_DIR=data_dir,
+            CITIES_BENCHMARK_SPATIALITE=os.path.join(work_dir, 'benchmark.sqlite3'),
+            PYTHONPATH=os.pathsep.join(filter(None, [root_dir, os.environ.get('PYTHONPATH')])),
+        )
+        self.spatialite_path = self.env['CITIES_BENCHMARK_SPATIALITE']
+
+    def django_admin(self, *args):
+        subprocess.check_call((sys.executable, '-m', 'django') + args, env=self.env)
+
+    def reset_database(self):
+        if self.db == 'spatialite':
+            if os.path.exists(self.spatialite_path):
+                os.remove(self.spatialite_path)
+        else:
+            self.django_admin('migrate', 'cities', 'zero', '--noinput', '-v', '0')
+        self.django_admin('migrate', '--noinput', '-v', '0')
+
+    def run_stage(self, stage):
+        fd, stats_file = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            self.django_admin('cities', '--import', stage, '--quiet', '--stats-file', stats_file,
+                              *self.command_args)
+            with io.open(stats_file, encoding='utf-8') as fp:
+                stats = json.load(fp)
+        finally:
+            os.remove(stats_file)
+
+        stage_stats, = stats['stages']
+        return dict((key, stage_stats.get(key)) for key in stat_keys)
+
+
+def print_run(run):
+    print("{db}, {rows} rows:".format(db=run['db'], rows=format_scale(run['rows'])))
+    print("  {:<12} {:>10} {:>12} {:>10} {:>10}".format('stage', 'seconds', 'rows/s', 'queries', 'peak MB'))
+    for stage, stats in run['stages'].items():
+        print("  {:<12} {:>10.2f} {:>12} {:>10} {:>10}".format(
+            stage, stats['wall_time'], stats['rows_per_second'], stats['queries'],
+            stats['peak_rss'] // (1024 * 1024) if stats['peak_rss'] else '-'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--rows', action='append', type=parse_scale,
+                        help="Rows in each of the large files, e.g. 10k, 1M or 10M. "
+                             "May be given more than once. Defaults to 10k.")
+    parser.add_argument('--db', action='append', choices=['spatialite', 'postgis'],
+                        help="Database to import into. May be given more than once. "
+                             "Defaults to spatialite.")
+    parser.add_argument('--stage', action='append', choices=stages,
+                        help="Only run these stages, and the ones before them.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', default=os.path.join(root_dir, 'benchmarks', 'work'),
+                        help="Where the generated data and the SpatiaLite database are kept.")
+    parser.add_argument('--output', default=None,
+                        help="JSON file to write the results to.")
+    parser.add_argument('command_args', nargs='*',
+                        help="Extra options for the cities command, after --, "
+                             "e.g. -- --loader=copy --batch-size=5000")
+    args = parser.parse_args(argv)
+
+    selected = stages
+    if args.stage:
+        # Every stage needs the data of the stages before it
+        selected = stages[:max(stages.index(stage) for stage in args.stage) + 1]
+
+    results = {
+        'commit': git('rev-parse', 'HEAD'),
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'date': datetime.datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'command_args': args.command_args,
+        'runs': [],
+    }
+
+    for rows in args.rows or [parse_scale('10k')]:
+        data_dir = get_data_dir(args.work_dir, rows, args.seed)
+        for db in args.db or ['spatialite']:
+            runner = Runner(db, data_dir, args.work_dir, args.command_args)
+            runner.reset_database()
+            run = {'db': db, 'rows': rows, 'stages': {}}
+            for stage in selected:
+                run['stages'][stage] = runner.run_stage(stage)
+            results['runs'].append(run)
+            print_run(run)
+
+    if args.output:
+        with io.open(args.output, 'w', encoding='utf-8') as fp:
+            fp.write(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,17 @@
+suffixes = [('M', 1000000), ('k', 1000)]
+
+
+def parse_scale(value):
+    """Parse a number of rows such as '10k', '1M' or '2500'."""
+    value = str(value).strip()
+    for suffix, factor in suffixes:
+        if value.upper().endswith(suffix.upper()):
+            return int(float(value[:-1]) * factor)
+    return int(value)
+
+
+def format_scale(rows):
+    for suffix, factor in suffixes:
+        if rows >= factor and rows % factor == 0:
+            return '{}{}'.format(rows // factor, suffix)
+    return str(rows)
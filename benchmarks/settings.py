@@ -0,0 +1,70 @@
+"""
+Django settings for the import benchmarks, which `benchmarks.run` runs the
+cities command with.
+
+CITIES_BENCHMARK_DB selects the database: 'spatialite' (a file in the work
+directory) or 'postgis' (the local django_cities_benchmark database, with
+the POSTGRES_* environment variables of the test project).
+"""
+
+import os
+
+from .generate import filenames
+
+
+SECRET_KEY = 'benchmarks'
+DEBUG = False
+USE_TZ = True
+
+INSTALLED_APPS = (
+    'django.contrib.contenttypes',
+    'django.contrib.auth',
+    'cities',
+    'model_utils',
+)
+
+if os.environ.get('CITIES_BENCHMARK_DB', 'spatialite') == 'postgis':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.contrib.gis.db.backends.postgis',
+            'NAME': os.environ.get('POSTGRES_DB', 'django_cities_benchmark'),
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', '127.0.0.1'),
+            'PORT': int(os.environ.get('POSTGRES_PORT', 5432)),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.contrib.gis.db.backends.spatialite',
+            'NAME': os.environ.get('CITIES_BENCHMARK_SPATIALITE', 'benchmark.sqlite3'),
+        }
+    }
+    if os.environ.get('SPATIALITE_LIBRARY_PATH'):
+        SPATIALITE_LIBRARY_PATH = os.environ['SPATIALITE_LIBRARY_PATH']
+
+# The generated files are already in the data directory: without URLs the
+# command reads them from there without downloading anything
+CITIES_DATA_DIR = os.environ.get('CITIES_BENCHMARK_DATA_DIR', 'data')
+CITIES_FILES = dict((key, {'filename': filename, 'urls': []})
+                    for key, filename in filenames.items())
+
+CITIES_LOCALES = ['en', 'und', 'de', 'fr', 'link', 'abbr']
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': True,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'cities': {
+            'level': os.environ.get('CITIES_BENCHMARK_LOG_LEVEL', 'WARNING'),
+            'handlers': ['console'],
+            'propagate': False,
+        },
+    },
+}
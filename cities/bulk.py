@@ -0,0 +1,326 @@
+"""
+Helpers for writing imported GeoNames data to the database in batches.
+"""
+
+import hashlib
+from collections import OrderedDict
+
+from django import VERSION as django_version
+from django.contrib.gis.geos import GEOSGeometry
+from django.core.exceptions import ValidationError
+from django.db import connections, router
+
+from .models import SlugModel, slugify_func
+
+
+def fingerprint(fields, values):
+    """
+    A compact hash of the values of ``fields``, to tell whether a row has
+    changed without comparing, or keeping, all of its values.
+
+    Values are normalized the way the fields would store them, so a value
+    read from the database and the same value from a data file match.
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for field, value in zip(fields, values):
+        try:
+            value = field.to_python(value)
+        except ValidationError:
+            pass
+        if isinstance(value, GEOSGeometry):
+            value = (value.srid or getattr(field, 'srid', None), bytes(value.wkb))
+        digest.update(repr(value).encode('utf-8'))
+        digest.update(b'\x1f')
+    return digest.digest()
+
+
+def obj_fingerprint(obj, fields):
+    """The fingerprint of the current values of the named ``fields`` of ``obj``."""
+    fields = [obj._meta.get_field(name) for name in fields]
+    return fingerprint(fields, [getattr(obj, field.attname) for field in fields])
+
+
+class BulkUpserter(object):
+    """
+    Buffer model instances and insert or update them in batches.
+
+    Every instance must have its primary key set. Instances are queued with
+    the names of the fields that should be written; when a row with the same
+    primary key already exists only those fields are overwritten, just like
+    ``update_or_create(id=..., defaults=...)`` does. Existing rows whose
+    fields already have the queued values are not written at all, which
+    spares the database the dead rows and index updates of a re-import that
+    changes little.
+
+    Where the database supports it the batch is written with a single
+    ``INSERT ... ON CONFLICT DO UPDATE`` (``bulk_create(update_conflicts=True)``),
+    otherwise the batch is partitioned into new and existing rows and written
+    with ``bulk_create`` and ``bulk_update``.
+
+    ``on_flush(objs)`` is called with the instances of every batch as soon as
+    it has been written, to write rows that depend on them, then
+    ``on_save(obj, item, created)`` is called for every instance,
+    ``on_batch(objs, items)`` once for the batch, and finally
+    ``on_done(count, created, unchanged)`` is called with the size of the
+    batch, the number of new rows in it and the number of rows that were
+    left as they were. The callbacks get every instance of the batch, whether
+    it was written or not.
+    """
+
+    def __init__(self, model, batch_size=1000, on_save=None, on_flush=None, on_batch=None,
+                 on_done=None):
+        self.model = model
+        self.batch_size = max(int(batch_size), 1)
+        self.on_save = on_save
+        self.on_flush = on_flush
+        self.on_batch = on_batch
+        self.on_done = on_done
+        self.using = router.db_for_write(model)
+        self.pending = OrderedDict()
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    @property
+    def manager(self):
+        # The base manager, so custom managers that hide rows (such as
+        # AlternativeNameManager) do not make existing rows look new
+        return self.model._base_manager.using(self.using)
+
+    @property
+    def supports_upsert(self):
+        return django_version >= (4, 1) and \
+            getattr(self.connection.features, 'supports_update_conflicts', False)
+
+    def add(self, obj, fields, item=None):
+        # Do the work Place.save() and SlugModel.save() would have done,
+        # since bulk writes bypass save()
+        if hasattr(obj, 'clean'):
+            obj.clean()
+        fields = list(fields)
+        if isinstance(obj, SlugModel):
+            obj.slug = slugify_func(obj, obj.slugify())
+            if 'slug' not in fields:
+                fields.append('slug')
+
+        # A later row for the same id replaces an earlier one, as it would
+        # have when rows were saved one at a time
+        self.pending.pop(obj.pk, None)
+        self.pending[obj.pk] = (obj, tuple(fields), item)
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        pending = list(self.pending.values())
+        self.pending = OrderedDict()
+
+        existing = self.existing_rows(OrderedDict((obj.pk, fields) for obj, fields, _ in pending))
+
+        # Rows that set different fields can't share a statement
+        groups = OrderedDict()
+        unchanged = 0
+        for obj, fields, _ in pending:
+            if existing.get(obj.pk) == obj_fingerprint(obj, fields):
+                unchanged += 1
+                obj._state.adding = False
+                obj._state.db = self.using
+                continue
+            groups.setdefault(fields, []).append(obj)
+
+        for fields, objs in groups.items():
+            self.write(objs, fields, existing)
+
+        if self.on_flush is not None:
+            self.on_flush([obj for obj, _, _ in pending])
+
+        if self.on_save is not None:
+            for obj, _, item in pending:
+                self.on_save(obj, item, obj.pk not in existing)
+
+        if self.on_batch is not None:
+            self.on_batch([obj for obj, _, _ in pending], [item for _, _, item in pending])
+
+        if self.on_done is not None:
+            self.on_done(len(pending), len(pending) - len(existing), unchanged)
+
+    def existing_rows(self, fields_by_pk):
+        """
+        Map the primary keys in ``fields_by_pk`` whose rows already exist to
+        the fingerprint of their stored values of the fields queued for them.
+        """
+        names = sorted(set(name for fields in fields_by_pk.values() for name in fields))
+        attnames = [self.model._meta.get_field(name).attname for name in names]
+
+        # Keep the IN clause under the backend's query parameter limit
+        pks = list(fields_by_pk)
+        chunk_size = self.connection.ops.bulk_batch_size(['pk'], pks) or len(pks)
+        existing = {}
+        for i in range(0, len(pks), chunk_size):
+            rows = self.manager.filter(pk__in=pks[i:i + chunk_size]).values_list('pk', *attnames)
+            for row in rows:
+                values = dict(zip(names, row[1:]))
+                fields = fields_by_pk[row[0]]
+                existing[row[0]] = fingerprint([self.model._meta.get_field(name) for name in fields],
+                                               [values[name] for name in fields])
+        return existing
+
+    def write(self, objs, fields, existing):
+        if self.supports_upsert:
+            kwargs = {
+                'update_conflicts': True,
+                'update_fields': list(fields),
+            }
+            if self.connection.features.supports_update_conflicts_with_target:
+                kwargs['unique_fields'] = [self.model._meta.pk.name]
+            self.manager.bulk_create(objs, batch_size=self.batch_size, **kwargs)
+            return
+
+        new_objs = [obj for obj in objs if obj.pk not in existing]
+        old_objs = [obj for obj in objs if obj.pk in existing]
+        if new_objs:
+            self.manager.bulk_create(new_objs, batch_size=self.batch_size)
+        if old_objs:
+            self.manager.bulk_update(old_objs, list(fields), batch_size=self.batch_size)
+            for obj in old_objs:
+                obj._state.adding = False
+                obj._state.db = self.using
+
+
+def copy_escape(value):
+    """Format a value for PostgreSQL's ``COPY ... FROM STDIN`` text format."""
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t')\
+                     .replace('\n', '\\n').replace('\r', '\\r')
+
+
+class CopyFile(object):
+    """
+    Read-only file-like object that yields rows in ``COPY`` text format, so
+    psycopg2's ``copy_expert()`` can stream them without buffering the data.
+    """
+
+    def __init__(self, rows):
+        self.lines = ('\t'.join(copy_escape(value) for value in row).encode('utf-8') + b'\n'
+                      for row in rows)
+        self.buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.lines)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+    readline = read
+
+
+class CopyLoader(object):
+    """
+    Load rows into PostgreSQL through UNLOGGED staging tables and ``COPY``.
+
+    Use as a context manager: on entry the session is tuned for bulk loading,
+    on exit the staging tables are dropped and the settings are reset.
+    """
+
+    session_settings = (
+        ('synchronous_commit', 'off'),
+        ('work_mem', '256MB'),
+        ('maintenance_work_mem', '512MB'),
+    )
+
+    def __init__(self, using='default'):
+        self.using = using
+        self.tables = []
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    def quote(self, name):
+        return self.connection.ops.quote_name(name)
+
+    def __enter__(self):
+        for name, value in self.session_settings:
+            self.execute('SET {} = %s'.format(name), [value])
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Leave a failed transaction alone: it will be rolled back anyway
+        if exc_type is not None:
+            return
+        for table in reversed(self.tables):
+            self.execute('DROP TABLE IF EXISTS {}'.format(self.quote(table)))
+        for name, _ in self.session_settings:
+            self.execute('RESET {}'.format(name))
+
+    def execute(self, sql, params=None):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            if cursor.description:
+                return cursor.fetchall()
+            return cursor.rowcount
+
+    def create_staging_table(self, table, columns):
+        """Create an empty UNLOGGED table from a list of (name, SQL type) pairs."""
+        self.execute('DROP TABLE IF EXISTS {}'.format(self.quote(table)))
+        self.execute('CREATE UNLOGGED TABLE {} ({})'.format(
+            self.quote(table),
+            ', '.join('{} {}'.format(self.quote(name), type_) for name, type_ in columns)))
+        self.tables.append(table)
+
+    def copy(self, table, columns, rows):
+        """Stream an iterable of row tuples into ``table`` with ``COPY FROM STDIN``."""
+        sql = 'COPY {} ({}) FROM STDIN'.format(
+            self.quote(table), ', '.join(self.quote(name) for name in columns))
+        with self.connection.cursor() as cursor:
+            raw_cursor = cursor.cursor
+            if hasattr(raw_cursor, 'copy_expert'):
+                # psycopg2
+                raw_cursor.copy_expert(sql, CopyFile(rows))
+            else:
+                # psycopg 3
+                with raw_cursor.copy(sql) as copy:
+                    for row in rows:
+                        copy.write_row(row)
+
+    def update_slugs(self, model, fields, batch_size=10000):
+        """
+        Fill in the slugs of rows inserted without one, for models whose slug
+        contains a database-assigned id, with one UPDATE per batch.
+        """
+        table = model._meta.db_table
+        staging_table = '{}_slug_staging'.format(table)
+        self.create_staging_table(staging_table, [('id', 'bigint'), ('slug', 'text')])
+
+        pk_column = model._meta.pk.column
+        slug_column = model._meta.get_field('slug').column
+        names = [model._meta.pk.attname] + list(fields)
+        rows = model._base_manager.using(self.using).filter(slug__isnull=True)\
+                                  .values_list(*names)
+        batch = []
+        for values in rows.iterator():
+            obj = model(**dict(zip(names, values)))
+            batch.append((obj.pk, slugify_func(obj, obj.slugify())))
+            if len(batch) >= batch_size:
+                self._write_slugs(table, staging_table, pk_column, slug_column, batch)
+                batch = []
+        if batch:
+            self._write_slugs(table, staging_table, pk_column, slug_column, batch)
+
+    def _write_slugs(self, table, staging_table, pk_column, slug_column, batch):
+        self.execute('TRUNCATE {}'.format(self.quote(staging_table)))
+        self.copy(staging_table, ['id', 'slug'], batch)
+        self.execute('UPDATE {table} SET {slug} = s.slug FROM {staging} s '
+                     'WHERE {table}.{pk} = s.id'.format(
+                         table=self.quote(table), staging=self.quote(staging_table),
+                         slug=self.quote(slug_column), pk=self.quote(pk_column)))
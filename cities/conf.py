@@ -141,6 +141,38 @@ files = {
     }
 }
 
+# GeoNames' daily update files. The geoname table has the same columns as the
+# city files, and the alternate names table the same as alternateNames.zip
+files['modifications'] = {
+    'filename': 'modifications-{date}.txt',
+    'urls': [url_bases['geonames']['dump'] + '{filename}', ],
+    'fields': files['city']['fields'],
+}
+files['deletes'] = {
+    'filename': 'deletes-{date}.txt',
+    'urls': [url_bases['geonames']['dump'] + '{filename}', ],
+    'fields': [
+        'geonameid',
+        'name',
+        'comment',
+    ]
+}
+
+files['alt_name_modifications'] = {
+    'filename': 'alternateNamesModifications-{date}.txt',
+    'urls': [url_bases['geonames']['dump'] + '{filename}', ],
+    'fields': files['alt_name']['fields'],
+}
+files['alt_name_deletes'] = {
+    'filename': 'alternateNamesDeletes-{date}.txt',
+    'urls': [url_bases['geonames']['dump'] + '{filename}', ],
+    'fields': [
+        'nameid',
+        'geonameid',
+        'comment',
+    ]
+}
+
 country_codes = [
     'AD', 'AE', 'AF', 'AG', 'AI', 'AL', 'AM', 'AO', 'AQ', 'AR', 'AS', 'AT', 'AU', 'AW', 'AX', 'AZ',
     'BA', 'BB', 'BD', 'BE', 'BF', 'BG', 'BH', 'BI', 'BJ', 'BL', 'BM', 'BN', 'BO', 'BQ', 'BR', 'BS', 'BT', 'BV', 'BW', 'BY', 'BZ',
@@ -278,6 +310,14 @@ plugin_hooks = [
     'district_pre',    'district_post',  # noqa: E241
     'alt_name_pre',    'alt_name_post',  # noqa: E241
     'postal_code_pre', 'postal_code_post',  # noqa: E241
+    # Batch hooks get a whole batch of items (and objects) at once
+    'country_pre_batch',     'country_post_batch',  # noqa: E241
+    'region_pre_batch',      'region_post_batch',  # noqa: E241
+    'subregion_pre_batch',   'subregion_post_batch',  # noqa: E241
+    'city_pre_batch',        'city_post_batch',  # noqa: E241
+    'district_pre_batch',    'district_post_batch',  # noqa: E241
+    'alt_name_pre_batch',    'alt_name_post_batch',  # noqa: E241
+    'postal_code_pre_batch', 'postal_code_post_batch',  # noqa: E241
 ]
 
 
@@ -314,6 +354,11 @@ def create_settings():
     if hasattr(django_settings, "CITIES_DATA_DIR"):
         res.data_dir = django_settings.CITIES_DATA_DIR
 
+    if hasattr(django_settings, "CITIES_COUNTRIES"):
+        res.countries = set([e.upper() for e in django_settings.CITIES_COUNTRIES])
+    else:
+        res.countries = set(['ALL'])
+
     if hasattr(django_settings, "CITIES_POSTAL_CODES"):
         res.postal_codes = set([e.upper() for e in django_settings.CITIES_POSTAL_CODES])
     else:
@@ -16,45 +16,55 @@ http://download.geonames.org/export/zip/
 
 from __future__ import print_function
 
+import datetime
+import gc
+import hashlib
 import io
 import json
 import logging
 import math
 import os
 import re
+import shutil
 import sys
+import tempfile
+import threading
+import time
 import zipfile
 
 try:
-    from urllib.request import urlopen
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
 except ImportError:
-    from urllib import urlopen
+    from urllib2 import HTTPError, Request, urlopen
 
-from itertools import chain
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, closing
+from itertools import chain, islice
+from multiprocessing import Pool
 from optparse import make_option
 from swapper import load_model
 from tqdm import tqdm
 
 from django import VERSION as django_version
-from django.contrib.gis.gdal.envelope import Envelope
 from django.contrib.gis.geos import Point
-from django.contrib.gis.measure import D
-try:
-    from django.contrib.gis.db.models.functions import Distance
-except ImportError:
-    pass
-from django.core.management.base import BaseCommand
-from django.db import transaction
-from django.db.models import Q
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+from django.db.models import F
 from django.db.models import CharField, ForeignKey
+from django.utils import timezone
 
+from ...bulk import BulkUpserter, CopyLoader, obj_fingerprint
 from ...conf import (city_types, district_types, import_opts, import_opts_all,
                      HookException, settings, CURRENCY_SYMBOLS,
                      INCLUDE_AIRPORT_CODES, INCLUDE_NUMERIC_ALTERNATIVE_NAMES,
                      NO_LONGER_EXISTENT_COUNTRY_CODES,
                      SKIP_CITIES_WITH_EMPTY_REGIONS, VALIDATE_POSTAL_CODES)
-from ...models import (Region, Subregion, District, PostalCode, AlternativeName)
-from ...util import geo_distance
+from ...models import (Region, Subregion, District, PostalCode, AlternativeName,
+                       ImportState, ImportRun, slugify_func)
+from ...records import Record, RecordParser, country_filter
+from ...util import IdMap, IdSet, NearestIndex, get_rss
 
 
 # Interpret all files as utf-8
@@ -68,6 +78,30 @@ Country = load_model('cities', 'Country')
 City = load_model('cities', 'City')
 
 
+def column(model, field_name):
+    return model._meta.get_field(field_name).column
+
+
+def changed_condition(quote, model, field_names, left, right):
+    """
+    SQL that is true when the ``left`` and ``right`` rows of ``model`` differ
+    in any of ``field_names``. Geometries are compared exactly, as binary.
+    """
+    def value(table, field_name):
+        field = model._meta.get_field(field_name)
+        sql = '{}.{}'.format(table, quote(field.column))
+        return 'ST_AsEWKB({})'.format(sql) if hasattr(field, 'geom_type') else sql
+
+    return '({}) IS DISTINCT FROM ({})'.format(
+        ', '.join(value(left, name) for name in field_names),
+        ', '.join(value(right, name) for name in field_names))
+
+
+def as_item(item):
+    # Plugins get rows as dicts, never as records
+    return item.as_dict() if isinstance(item, Record) else item
+
+
 # Only log errors during Travis tests
 LOGGER_NAME = os.environ.get('TRAVIS_LOGGER_NAME', 'cities')
 
@@ -77,6 +111,66 @@ LOGGER_NAME = os.environ.get('TRAVIS_LOGGER_NAME', 'cities')
 #              transaction.atomic)
 
 
+# The files each import type reads
+download_filekeys = {
+    'country': ['country'],
+    'region': ['region'],
+    'subregion': ['subregion'],
+    'city': ['city'],
+    'district': ['city', 'hierarchy'],
+    'alt_name': ['alt_name'],
+    'postal_code': ['postal_code'],
+}
+
+# The fields of their data files that the import stages read
+import_fields = {
+    'city': ['geonameid', 'name', 'asciiName', 'latitude', 'longitude', 'featureCode',
+             'countryCode', 'admin1Code', 'admin2Code', 'population', 'elevation', 'timezone'],
+    'district': ['geonameid', 'name', 'asciiName', 'latitude', 'longitude', 'featureCode',
+                 'admin3Code', 'population'],
+    'hierarchy': ['parent', 'child'],
+    'alt_name': ['nameid', 'geonameid', 'language', 'name', 'isPreferred', 'isShort', 'isHistoric'],
+    'postal_code': ['countryCode', 'postalCode', 'placeName', 'admin1Name', 'admin1Code',
+                    'admin2Name', 'admin2Code', 'admin3Name', 'admin3Code', 'latitude', 'longitude'],
+}
+# Modified places are imported as cities and districts
+import_fields['modifications'] = import_fields['city'] + ['admin3Code']
+
+# The column with the country code of each row, in the data files that have
+# one. Region and subregion codes start with it
+country_fields = {
+    'country': 'code',
+    'region': 'code',
+    'subregion': 'code',
+    'city': 'countryCode',
+    'postal_code': 'countryCode',
+    'modifications': 'countryCode',
+}
+
+# Import types whose rows are independent of each other, so an interrupted
+# import can continue in the middle of the stage
+resumable_imports = ['city', 'alt_name', 'postal_code']
+
+CHECKPOINT_PREFIX = 'checkpoint.'
+
+# The caches that the stages build, and the import types that use them. When
+# memory runs short the caches that the current stage doesn't use are
+# dropped: they are built again when they are needed
+cache_imports = {
+    'country_index': ['region', 'subregion', 'city', 'district', 'postal_code'],
+    'region_index': ['subregion', 'city', 'district'],
+    # Built along with the region index
+    'subregion_name_index': ['subregion', 'city', 'district'],
+    'subregion_name_std_index': ['subregion', 'city', 'district'],
+    'hierarchy': ['district'],
+    'postal_code_regex_index': ['postal_code'],
+}
+
+# The fields an import sets on existing postal codes: unless one of them
+# changes, the postal code isn't written
+postal_code_value_fields = ['region', 'subregion', 'district', 'city', 'location']
+
+
 class Command(BaseCommand):
     if hasattr(settings, 'data_dir'):
         data_dir = settings.data_dir
@@ -84,6 +178,20 @@ class Command(BaseCommand):
         app_dir = os.path.normpath(os.path.dirname(os.path.realpath(__file__)) + '/../..')
         data_dir = os.path.join(app_dir, 'data')
     logger = logging.getLogger(LOGGER_NAME)
+    download_chunk_size = 1024 * 1024
+    # Districts missing from the hierarchy belong to the nearest city of at
+    # least this population, within 1000 km
+    district_city_population_min = 100000
+    # Downloads run in threads, which share the manifest
+    manifest_lock = threading.RLock()
+    # The country codes to import, or None for all countries
+    countries = None
+    # Memory is checked every time a batch is written, and every this many
+    # rows read
+    memory_check_rows = 65536
+    current_import = None
+    memory_peak = 0
+    memory_after_free = 0
 
     if django_version < (1, 8):
         option_list = getattr(BaseCommand, 'option_list', ()) + (
@@ -106,6 +214,14 @@ class Command(BaseCommand):
         )
 
     def add_arguments(self, parser):
+        parser.add_argument(
+            'action',
+            nargs='?',
+            choices=['import', 'status'],
+            default='import',
+            help="'status' shows the checkpoints of the last import instead of "
+                 "importing anything."
+        )
         parser.add_argument(
             '--force',
             action='store_true',
@@ -135,96 +251,1000 @@ class Command(BaseCommand):
             dest="quiet",
             help="Do not show the progress bar."
         )
+        parser.add_argument(
+            '--batch-size',
+            metavar="ROWS",
+            type=int,
+            default=1000,
+            dest="batch_size",
+            help="Number of rows to write to the database at once."
+        )
+        parser.add_argument(
+            '--loader',
+            choices=['orm', 'copy'],
+            default='orm',
+            dest="loader",
+            help="How to load cities and postal codes. 'copy' streams them "
+                 "into PostgreSQL with COPY and merges them with SQL."
+        )
+        parser.add_argument(
+            '--workers',
+            metavar="N",
+            type=int,
+            default=1,
+            dest="workers",
+            help="Import postal codes in N processes, one country at a time. "
+                 "Each country is committed separately. Not supported on SQLite."
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            default=False,
+            dest="incremental",
+            help="Apply GeoNames' daily modifications and deletes files for every "
+                 "day since the last applied day, instead of importing full files."
+        )
+        parser.add_argument(
+            '--since',
+            metavar="YYYY-MM-DD",
+            default=None,
+            dest="since",
+            help="With --incremental, the first day to apply. Defaults to the day "
+                 "after the last applied day, or yesterday on the first run."
+        )
+        parser.add_argument(
+            '--download-workers',
+            metavar="N",
+            type=int,
+            default=4,
+            dest="download_workers",
+            help="Number of files to download at the same time. Every file the "
+                 "import needs is requested up front, and each stage starts as "
+                 "soon as its own files are complete."
+        )
+        parser.add_argument(
+            '--commit-every',
+            metavar="N",
+            type=int,
+            default=0,
+            dest="commit_every",
+            help="Commit after every N rows written, rounded up to whole batches, "
+                 "and at the end of every stage. 0, the default, imports "
+                 "everything in a single transaction."
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            default=False,
+            dest="resume",
+            help="Continue an import that was interrupted: skip the stages it "
+                 "finished, and the rows it committed in the stage it was in."
+        )
+        parser.add_argument(
+            '--countries',
+            metavar="CODES",
+            default=None,
+            dest="countries",
+            help="Only import data for these countries. Comma separated list of "
+                 "ISO country codes, or ALL. Defaults to the CITIES_COUNTRIES setting."
+        )
+        parser.add_argument(
+            '--max-memory',
+            metavar="MB",
+            type=int,
+            default=0,
+            dest="max_memory",
+            help="When the import uses more memory than this, drop the caches "
+                 "the current stage doesn't need and collect garbage. 0, the "
+                 "default, means no limit. The peak memory of every stage is "
+                 "logged either way."
+        )
+        parser.add_argument(
+            '--query-log',
+            metavar="N",
+            type=int,
+            default=0,
+            dest="query_log",
+            help="Number of queries that every database connection keeps in "
+                 "connection.queries during the import, when DEBUG is on. "
+                 "Defaults to 0, which keeps none."
+        )
+        parser.add_argument(
+            '--stats-file',
+            metavar="PATH",
+            default=None,
+            dest="stats_file",
+            help="Write statistics of every stage of the import to this JSON file."
+        )
+        parser.add_argument(
+            '--record-run',
+            action='store_true',
+            default=False,
+            dest="record_run",
+            help="Save the statistics of the import in the ImportRun table."
+        )
 
-    @transaction.atomic
     def handle(self, *args, **options):
         self.download_cache = {}
         self.options = options
 
+        if self.options.get('action') == 'status':
+            return self.show_status()
+
         self.force = self.options['force']
 
+        if self.options.get('countries'):
+            countries = set(e.strip().upper() for e in self.options['countries'].split(',') if e.strip())
+        else:
+            countries = settings.countries
+        self.countries = None if 'ALL' in countries else countries
+
+        if self.options.get('loader') == 'copy':
+            for model in (City, PostalCode):
+                if connections[router.db_for_write(model)].vendor != 'postgresql':
+                    raise CommandError("--loader=copy is only supported on PostgreSQL")
+
+        # SQLite lets only one connection write at a time, so the worker
+        # processes would fail with "database is locked"
+        if (self.options.get('workers') or 1) > 1 and \
+                connections[router.db_for_write(PostalCode)].vendor == 'sqlite':
+            raise CommandError("--workers is not supported on SQLite or SpatiaLite")
+
         self.flushes = [e for e in self.options.get('flush', '').split(',') if e]
         if 'all' in self.flushes:
             self.flushes = import_opts_all
-        for flush in self.flushes:
-            func = getattr(self, "flush_" + flush)
-            func()
 
         self.imports = [e for e in self.options.get('import', '').split(',') if e]
         if 'all' in self.imports:
             self.imports = import_opts_all
         if self.flushes:
             self.imports = []
+
+        self.stats = {
+            'started': timezone.now(),
+            'imports': list(self.imports),
+            'flushes': list(self.flushes),
+            'countries': sorted(self.countries) if self.countries is not None else None,
+            'stages': [],
+        }
+        status = 'failed'
+        self.limit_query_logs()
+        try:
+            if self.options.get('incremental'):
+                self.run_stage('import_incremental')
+                status = 'finished'
+                return
+
+            self.load_checkpoints()
+            self.prefetch(self.imports)
+
+            # Stages run in one transaction, except for stages that run in
+            # worker processes: those need to see the data of the stages
+            # before them, so everything before them is committed first
+            stages = ["flush_" + flush for flush in self.flushes]
+            for import_ in self.imports:
+                if import_ in self.parallel_imports():
+                    self.run_stages(stages)
+                    stages = []
+                    self.run_stage("import_" + import_)
+                else:
+                    stages.append("import_" + import_)
+            self.run_stages(stages)
+
+            # There is nothing left to resume
+            ImportState.objects.filter(key__startswith=CHECKPOINT_PREFIX).delete()
+            status = 'finished'
+        finally:
+            self.stop_downloads()
+            self.restore_query_logs()
+            self.save_stats(status)
+
+    def run_stages(self, stages):
+        if not stages:
+            return
+
+        if not self.options.get('commit_every'):
+            with transaction.atomic():
+                for stage in stages:
+                    self.run_stage(stage)
+            return
+
+        for stage in stages:
+            self.begin_chunk()
+            try:
+                self.run_stage(stage)
+            except BaseException:
+                self.end_chunk(*sys.exc_info())
+                raise
+            else:
+                self.end_chunk()
+
+    def run_stage(self, stage):
+        import_ = stage[len('import_'):] if stage.startswith('import_') else None
+        self.current_import = import_
+        self.memory_peak = self.memory_after_free = 0
+        self.check_memory()
+        self.stage_stats = {
+            'stage': stage,
+            'rows_read': 0,
+            'rows_created': 0,
+            'rows_updated': 0,
+            'rows_unchanged': 0,
+            'queries': 0,
+            'query_time': 0.0,
+            'files': {},
+        }
+
+        # Rows of the main file of the stage are counted, so that a commit
+        # in the middle of the stage can record how far it got
+        self.checkpoint = None
+        if import_ in resumable_imports and import_ not in self.parallel_imports():
+            filekey = download_filekeys[import_][0]
+            self.checkpoint = {
+                'import': import_,
+                'filekey': filekey,
+                'source': self.get_source_fingerprint(filekey),
+                'rows': 0,
+                'skip': 0,
+                'batch': None,
+                'skip_items': 0,
+                'state': {},
+            }
+            saved = self.checkpoints.get(import_)
+            if saved and saved != 'done':
+                if saved.get('source') == self.checkpoint['source']:
+                    self.logger.info("Resuming %s import after row %d", import_, saved['rows'])
+                    self.checkpoint['skip'] = self.checkpoint['rows'] = saved['rows']
+                    self.checkpoint['skip_items'] = saved.get('items', 0)
+                    self.checkpoint['state'] = saved.get('state', {})
+                else:
+                    self.logger.warning("The %s file or the countries changed since the "
+                                        "interrupted import, importing all of it", import_)
+
+        started = time.time()
+        try:
+            with self.count_queries():
+                getattr(self, stage)()
+        finally:
+            self.finish_stage_stats(time.time() - started)
+
+        if import_ in import_opts_all:
+            self.save_checkpoint(import_, 'done')
+        self.checkpoint = None
+        self.current_import = None
+
+    def count_queries(self):
+        """
+        Count the queries of the stage on every database connection, and
+        the time they take.
+        """
+        stats = self.stage_stats
+
+        def count(execute, sql, params, many, context):
+            started = time.time()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                stats['queries'] += 1
+                stats['query_time'] += time.time() - started
+
+        stack = ExitStack()
+        for connection in connections.all():
+            if hasattr(connection, 'execute_wrapper'):
+                stack.enter_context(connection.execute_wrapper(count))
+        return stack
+
+    def count_rows(self, created=0, updated=0, unchanged=0):
+        stats = getattr(self, 'stage_stats', None)
+        if stats is not None:
+            stats['rows_created'] += created
+            stats['rows_updated'] += updated
+            stats['rows_unchanged'] += unchanged
+
+    def count_read(self, filename, rows, num_bytes):
+        stats = getattr(self, 'stage_stats', None)
+        if stats is not None:
+            stats['rows_read'] += rows
+            stats['files'][filename] = stats['files'].get(filename, 0) + num_bytes
+
+    def finish_stage_stats(self, wall_time):
+        stats, self.stage_stats = self.stage_stats, None
+        self.check_memory()
+        if self.memory_peak:
+            self.logger.info("%s: peak memory %d MB", stats['stage'], self.memory_peak // (1024 * 1024))
+        self.logger.info("%s: %d added, %d updated, %d unchanged", stats['stage'],
+                         stats['rows_created'], stats['rows_updated'], stats['rows_unchanged'])
+
+        # Rows that were read but not imported were left out by a filter, a
+        # plugin or the stage itself
+        rows_written = stats['rows_created'] + stats['rows_updated'] + stats['rows_unchanged']
+        stats.update({
+            'wall_time': round(wall_time, 3),
+            'rows_skipped': max(stats['rows_read'] - rows_written, 0),
+            'rows_per_second': round(stats['rows_read'] / wall_time, 1) if wall_time else None,
+            'query_time': round(stats['query_time'], 3),
+            'peak_rss': self.memory_peak or None,
+        })
+        self.stats['stages'].append(stats)
+
+    def save_stats(self, status):
+        """Write the statistics of the import to --stats-file and the ImportRun table."""
+        stats = dict(self.stats, status=status, finished=timezone.now())
+        report = json.dumps(dict(stats, started=stats['started'].isoformat(),
+                                 finished=stats['finished'].isoformat()),
+                            indent=2, sort_keys=True)
+
+        if self.options.get('stats_file'):
+            try:
+                with io.open(self.options['stats_file'], 'w', encoding='utf-8') as fp:
+                    fp.write(report)
+            except (IOError, OSError) as e:
+                self.logger.warning("Unable to write stats file '{}': {}".format(
+                                    self.options['stats_file'], e))
+
+        if self.options.get('record_run'):
+            ImportRun.objects.create(started=stats['started'], finished=stats['finished'],
+                                     status=status, stats=report)
+
+    def get_source_fingerprint(self, filekey):
+        # Identifies the version of the files a checkpoint's row offset is in
+        manifest = self.get_manifest()
+        source = []
+        for filename in self.get_filenames(filekey):
+            entry = manifest.get(filename, {})
+            try:
+                stat = self.get_file_stat(filename)
+            except OSError:
+                stat = {}
+            source.append([filename, stat.get('size'), entry.get('sha256') or stat.get('mtime')])
+        # Rows are only counted for the countries that are imported
+        countries = self.get_countries(filekey)
+        if countries is not None:
+            source.append(sorted(countries))
+        return hashlib.sha1(json.dumps(source).encode('utf-8')).hexdigest()[:16]
+
+    def load_checkpoints(self):
+        """
+        With --resume, load the checkpoints of the last import and drop the
+        stages it finished; otherwise forget them.
+        """
+        self.checkpoints = {}
+        states = ImportState.objects.filter(key__startswith=CHECKPOINT_PREFIX)
+        if not self.options.get('resume'):
+            states.delete()
+            return
+
+        for state in states:
+            import_ = state.key[len(CHECKPOINT_PREFIX):]
+            self.checkpoints[import_] = state.value if state.value == 'done' else json.loads(state.value)
+
         for import_ in self.imports:
-            func = getattr(self, "import_" + import_)
-            func()
+            if self.checkpoints.get(import_) == 'done':
+                self.logger.info("Skipping %s import: finished by the interrupted import", import_)
+        self.imports = [import_ for import_ in self.imports
+                        if self.checkpoints.get(import_) != 'done']
+
+    def save_checkpoint(self, import_, value):
+        if not isinstance(value, str):
+            value = json.dumps(value, sort_keys=True)
+        ImportState.objects.update_or_create(key=CHECKPOINT_PREFIX + import_,
+                                             defaults={'value': value})
+
+    def show_status(self):
+        states = {state.key: state for state in ImportState.objects.all()}
+        self.stdout.write("Import checkpoints:")
+        for import_ in import_opts_all:
+            state = states.get(CHECKPOINT_PREFIX + import_)
+            if state is None:
+                status = "nothing to resume"
+            elif state.value == 'done':
+                status = "finished at {}".format(state.updated)
+            else:
+                status = "committed up to row {} at {}".format(json.loads(state.value)['rows'], state.updated)
+            self.stdout.write("  {:<12} {}".format(import_, status))
+
+        self.stdout.write("Daily updates:")
+        for key in ('modifications', 'alternateNamesModifications'):
+            state = states.get(key)
+            self.stdout.write("  {:<28} {}".format(
+                key, "applied up to {}".format(state.value) if state else "never applied"))
+
+    def begin_chunk(self):
+        self.chunk_transaction = transaction.atomic()
+        self.chunk_transaction.__enter__()
+        self.rows_since_commit = 0
+
+    def end_chunk(self, exc_type=None, exc_value=None, traceback=None):
+        # Commits, or rolls back if there is an exception
+        chunk_transaction, self.chunk_transaction = self.chunk_transaction, None
+        if chunk_transaction is not None:
+            chunk_transaction.__exit__(exc_type, exc_value, traceback)
+
+    def limit_query_logs(self):
+        """
+        Keep only the last --query-log queries in the query log of every
+        database connection, which Django fills when DEBUG is on, until
+        restore_query_logs() is called.
+        """
+        self.query_logs = []
+        for connection in connections.all():
+            self.query_logs.append((connection, connection.queries_log))
+            connection.queries_log = deque(maxlen=self.options.get('query_log') or 0)
+
+    def restore_query_logs(self):
+        for connection, queries_log in getattr(self, 'query_logs', []):
+            connection.queries_log = queries_log
+        self.query_logs = []
+
+    def check_memory(self):
+        """
+        Record the memory use of the process for the peak of the stage, and
+        free memory if it is over --max-memory.
+        """
+        rss = get_rss()
+        if rss is None:
+            return
+        self.memory_peak = max(self.memory_peak, rss)
 
-    def call_hook(self, hook, *args, **kwargs):
+        max_memory = (self.options.get('max_memory') or 0) * 1024 * 1024
+        # Freeing memory again only helps once the stage has used more since
+        # the last time
+        if not max_memory or rss <= max_memory or rss <= self.memory_after_free * 1.1:
+            return
+
+        freed = self.free_memory()
+        self.memory_after_free = get_rss() or rss
+        self.logger.info("Memory use of %d MB is over --max-memory, freed %s: now %d MB",
+                         rss // (1024 * 1024), ', '.join(freed) or 'garbage',
+                         self.memory_after_free // (1024 * 1024))
+
+    def free_memory(self):
+        """
+        Drop the caches the current stage doesn't use and the query logs, and
+        collect garbage. Returns the names of the dropped caches.
+        """
+        freed = []
+        # Incremental imports use every cache
+        if self.current_import in import_opts_all:
+            for cache, imports in sorted(cache_imports.items()):
+                if self.current_import not in imports and hasattr(self, cache):
+                    delattr(self, cache)
+                    freed.append(cache)
+        for connection in connections.all():
+            connection.queries_log.clear()
+        gc.collect()
+        return freed
+
+    def rows_written(self, count, created=0, unchanged=0):
+        """
+        Called by the stages whenever ``count`` rows have been imported,
+        ``created`` of them new and ``unchanged`` of them left as they were.
+        With --commit-every, commits once enough rows have been imported
+        since the last commit.
+        """
+        self.count_rows(created, count - created - unchanged, unchanged)
+        self.check_memory()
+        if getattr(self, 'chunk_transaction', None) is None:
+            return
+
+        self.rows_since_commit += count
+        if self.rows_since_commit >= self.options['commit_every']:
+            checkpoint = getattr(self, 'checkpoint', None)
+            if checkpoint is not None:
+                # Rows of a batch that batch hooks read ahead aren't all
+                # imported yet: the batch is read again on resume, and the
+                # items of it that were imported are skipped
+                rows, items = checkpoint['batch'] or (checkpoint['rows'], 0)
+                self.save_checkpoint(checkpoint['import'], {
+                    'rows': rows,
+                    'items': items,
+                    'source': checkpoint['source'],
+                    'state': checkpoint['state'],
+                })
+            self.end_chunk()
+            self.logger.debug("Committed %d rows", self.rows_since_commit)
+            self.begin_chunk()
+
+    def parallel_imports(self):
+        if (self.options.get('workers') or 1) > 1 and self.options.get('loader') != 'copy':
+            return ['postal_code']
+        return []
+
+    def get_hooks(self, name):
+        """
+        Look up the plugin hooks for ``name`` ('city', 'postal_code', ...)
+        once, for a stage: a dict of the bound hook methods of each kind
+        ('pre', 'post', 'pre_batch', 'post_batch') that some plugin
+        implements. Stages without plugins get an empty dict.
+        """
+        hooks = {}
         if hasattr(settings, 'plugins'):
-            for plugin in settings.plugins[hook]:
+            for kind in ('pre', 'post', 'pre_batch', 'post_batch'):
+                hook = '{}_{}'.format(name, kind)
+                funcs = [getattr(plugin, hook) for plugin in settings.plugins[hook]]
+                if funcs:
+                    hooks[kind] = funcs
+        return hooks
+
+    def run_hooks(self, funcs, *args, **kwargs):
+        """
+        Call hook methods in turn. Returns False, after logging its message,
+        as soon as one raises HookException, and True otherwise.
+        """
+        for func in funcs:
+            try:
+                func(self, *args, **kwargs)
+            except HookException as e:
+                error = str(e)
+                if error:
+                    self.logger.error(error)
+                return False
+        return True
+
+    def call_hook(self, hook, *args, **kwargs):
+        if hasattr(settings, 'plugins') and settings.plugins[hook]:
+            args = [as_item(arg) for arg in args]
+            return self.run_hooks([getattr(plugin, hook) for plugin in settings.plugins[hook]],
+                                  *args, **kwargs)
+        return True
+
+    def apply_pre_hooks(self, name, data, hooks=None, on_skip=None):
+        """
+        Run the ``<name>_pre_batch`` and ``<name>_pre`` hooks over the rows
+        of a stage, and yield the rows they don't skip. ``data`` itself is
+        returned when no plugin implements them.
+
+        Plugins always get dicts, which they may change, so records are
+        turned into dicts first. ``on_skip(count)`` is called with the number
+        of rows every time rows are skipped.
+        """
+        if hooks is None:
+            hooks = self.get_hooks(name)
+        pre, pre_batch = hooks.get('pre'), hooks.get('pre_batch')
+        if not pre and not pre_batch:
+            return data
+        return self.iter_pre_hooks(data, pre or [], pre_batch or [], on_skip)
+
+    def iter_pre_hooks(self, data, pre, pre_batch, on_skip):
+        # Batches are read ahead of the rows that are imported, so while one
+        # is imported the checkpoint is where it starts, and how many of the
+        # items the batch hooks return have been handed out
+        checkpoint = getattr(self, 'checkpoint', None) if pre_batch else None
+        skip_items = checkpoint.pop('skip_items', 0) if checkpoint is not None else 0
+
+        def read_batch():
+            start = checkpoint['rows'] if checkpoint is not None else None
+            items = list(islice(data, batch_size))
+            if checkpoint is not None:
+                checkpoint['batch'] = [start, 0]
+            return items
+
+        if pre_batch:
+            batch_size = self.options.get('batch_size') or 1000
+            batches = iter(read_batch, [])
+        else:
+            batches = ([item] for item in data)
+
+        record_class = None
+        for items in batches:
+            num_items = len(items)
+            if items and isinstance(items[0], Record):
+                record_class = type(items[0])
+            items = [as_item(item) for item in items]
+
+            # A batch hook changes the items in place, or returns the items
+            # to import instead. Raising HookException skips the whole batch
+            for func in pre_batch:
                 try:
-                    func = getattr(plugin, hook)
-                    func(self, *args, **kwargs)
+                    result = func(self, items)
                 except HookException as e:
                     error = str(e)
                     if error:
                         self.logger.error(error)
-                    return False
-        return True
+                    items = []
+                    break
+                if result is not None:
+                    items = list(result)
+
+            # The items an interrupted import already imported
+            if skip_items:
+                skipped = min(skip_items, len(items))
+                num_items -= skipped
+                checkpoint['batch'][1] = skipped
+                items, skip_items = items[skipped:], 0
+
+            num_imported = 0
+            for item in items:
+                if checkpoint is not None:
+                    checkpoint['batch'][1] += 1
+                if pre and not self.run_hooks(pre, item):
+                    continue
+                num_imported += 1
+                # Stages get the values typed, as they do without plugins
+                yield record_class.from_dict(item) if record_class is not None else item
+
+            if num_imported < num_items and on_skip is not None:
+                on_skip(num_items - num_imported)
+
+        if checkpoint is not None:
+            checkpoint['batch'] = None
+
+    def get_upserter(self, model, name, on_flush=None, hooks=None):
+        """
+        A BulkUpserter for a stage, which calls the ``<name>_post`` hooks for
+        every object it writes and the ``<name>_post_batch`` hooks for every
+        batch.
+        """
+        if hooks is None:
+            hooks = self.get_hooks(name)
+        post, post_batch = hooks.get('post', []), hooks.get('post_batch', [])
+
+        def on_save(obj, item, created):
+            if not self.run_hooks(post, obj, as_item(item)):
+                return
+
+            self.logger.debug("%s %s: %s",
+                              "Added" if created else "Updated",
+                              model._meta.verbose_name, obj)
+
+        def on_batch(objs, items):
+            self.run_hooks(post_batch, objs, [as_item(item) for item in items])
+
+        # Without plugins, nothing is called for every object
+        return BulkUpserter(model,
+                            batch_size=self.options.get('batch_size') or 1000,
+                            on_save=on_save if post or self.logger.isEnabledFor(logging.DEBUG) else None,
+                            on_flush=on_flush,
+                            on_batch=on_batch if post_batch else None,
+                            on_done=self.rows_written)
 
-    def download(self, filekey):
+    def get_filenames(self, filekey):
         if 'filename' in settings.files[filekey]:
-            filenames = [settings.files[filekey]['filename']]
+            return [settings.files[filekey]['filename']]
+        return settings.files[filekey]['filenames']
+
+    def prefetch(self, imports):
+        """Start downloading the files of every import type in ``imports``."""
+        for import_ in imports:
+            for filekey in download_filekeys[import_]:
+                for filename in self.get_filenames(filekey):
+                    self.submit_download(filekey, filename)
+
+    def submit_download(self, filekey, filename):
+        # Every file is only downloaded once, however many stages use it
+        if filename not in self.download_cache:
+            if getattr(self, 'download_pool', None) is None:
+                self.get_manifest()
+                self.download_pool = ThreadPoolExecutor(
+                    max_workers=max(getattr(self, 'options', {}).get('download_workers') or 1, 1))
+            self.download_cache[filename] = self.download_pool.submit(
+                self.download_one, filekey, filename)
+        return self.download_cache[filename]
+
+    def download(self, filekey, filenames=None):
+        futures = [self.submit_download(filekey, filename)
+                   for filename in filenames or self.get_filenames(filekey)]
+        for future in futures:
+            future.result()
+
+    def wait_for_downloads(self):
+        for future in list(self.download_cache.values()):
+            if not future.cancelled() and future.exception() is not None:
+                self.logger.debug("Prefetch failed: %s", future.exception())
+
+    def stop_downloads(self):
+        # Downloads that are already running are left to finish, so they
+        # don't leave .part files behind needlessly
+        for future in self.download_cache.values():
+            future.cancel()
+        if getattr(self, 'download_pool', None) is not None:
+            self.download_pool.shutdown(wait=True)
+            self.download_pool = None
+
+    def download_one(self, filekey, filename):
+        urls = [e.format(filename=filename) for e in settings.files[filekey]['urls']]
+        if not urls and os.path.exists(os.path.join(self.data_dir, filename)):
+            # Files without URLs are only read from the data directory
+            return
+
+        for url in urls:
+            try:
+                self.download_file(url, filename)
+                break
+            except Exception as e:
+                self.logger.debug("Download failed: %s: %s", url, e)
+                continue
         else:
-            filenames = settings.files[filekey]['filenames']
+            self.logger.error("Web file not found: %s. Tried URLs:\n%s", filename, '\n'.join(urls))
 
-        for filename in filenames:
-            web_file = None
-            urls = [e.format(filename=filename) for e in settings.files[filekey]['urls']]
-            for url in urls:
-                try:
-                    web_file = urlopen(url)
-                    if 'html' in web_file.headers['Content-Type']:
-                        # TODO: Make this a subclass
-                        raise Exception("Content type of downloaded file was {}".format(web_file.headers['Content-Type']))
-                    self.logger.debug("Downloaded: {}".format(url))
-                    break
-                except Exception:
-                    web_file = None
-                    continue
-            else:
-                self.logger.error("Web file not found: %s. Tried URLs:\n%s", filename, '\n'.join(urls))
-
-            if web_file is not None:
-                self.logger.debug("Saving: {}/{}".format(self.data_dir, filename))
-                if not os.path.exists(self.data_dir):
-                    os.makedirs(self.data_dir)
-                file = io.open(os.path.join(self.data_dir, filename), 'wb')
-                file.write(web_file.read())
-                file.close()
-            elif not os.path.exists(os.path.join(self.data_dir, filename)):
+            if not os.path.exists(os.path.join(self.data_dir, filename)):
                 raise Exception("File not found and download failed: {} [{}]".format(filename, urls))
 
-    def get_data(self, filekey):
-        if 'filename' in settings.files[filekey]:
-            filenames = [settings.files[filekey]['filename']]
-        else:
-            filenames = settings.files[filekey]['filenames']
-
-        for filename in filenames:
-            name, ext = filename.rsplit('.', 1)
-            if (ext == 'zip'):
-                filepath = os.path.join(self.data_dir, filename)
-                zip_member = zipfile.ZipFile(filepath).open(name + '.txt', 'r')
-                file_obj = io.TextIOWrapper(zip_member, encoding='utf-8')
+    def get_file_hash(self, path):
+        sha256 = hashlib.sha256()
+        with io.open(path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(self.download_chunk_size), b''):
+                sha256.update(chunk)
+        return sha256
+
+    def is_current(self, filename):
+        """
+        Whether the local copy of ``filename`` is the file that was last
+        downloaded, going by the size and hash recorded in the manifest.
+        """
+        entry = self.get_manifest().get(filename, {})
+        filepath = os.path.join(self.data_dir, filename)
+        if 'sha256' not in entry or not os.path.exists(filepath):
+            return False
+        stat = self.get_file_stat(filename)
+        if stat['size'] != entry.get('size'):
+            return False
+        # Only hash the file if it has been touched since it was downloaded
+        return stat['mtime'] == entry.get('mtime') or \
+            self.get_file_hash(filepath).hexdigest() == entry['sha256']
+
+    def download_file(self, url, filename):
+        """
+        Download ``url`` to ``filename`` in the data directory.
+
+        The file is streamed to ``<filename>.part`` and only renamed into place
+        once its size has been checked, so an interrupted download never
+        leaves a truncated file behind; it is resumed with a Range request on
+        the next run. Unless --force is given, nothing is downloaded when the
+        server reports that the local copy is current.
+        """
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+        filepath = os.path.join(self.data_dir, filename)
+        part_path = filepath + '.part'
+        manifest = self.get_manifest()
+        with self.manifest_lock:
+            entry = dict(manifest.get(filename, {}))
+
+        headers = {}
+        if not self.force and self.is_current(filename):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        # Resume an interrupted download, as long as the server still has the
+        # same version of the file
+        partial = entry.get('partial', {})
+        validator = partial.get('etag') or partial.get('last_modified')
+        offset = 0
+        if os.path.exists(part_path) and partial.get('url') == url and validator:
+            offset = os.path.getsize(part_path)
+            headers['Range'] = 'bytes={}-'.format(offset)
+            headers['If-Range'] = validator
+
+        try:
+            response = urlopen(Request(url, headers=headers))
+        except HTTPError as e:
+            if e.code == 304:
+                self.logger.debug("Up to date: {}".format(url))
+                return
+            if e.code == 416 and offset:
+                # The partial file is useless, start over
+                os.remove(part_path)
+                with self.manifest_lock:
+                    manifest.get(filename, {}).pop('partial', None)
+                return self.download_file(url, filename)
+            raise
+
+        with closing(response):
+            content_type = response.headers.get('Content-Type', '')
+            if 'html' in content_type:
+                # TODO: Make this a subclass
+                raise Exception("Content type of downloaded file was {}".format(content_type))
+
+            if response.getcode() == 206:
+                self.logger.debug("Resuming download at byte %d: %s", offset, url)
+                sha256 = self.get_file_hash(part_path)
+                mode = 'ab'
             else:
-                file_obj = io.open(os.path.join(self.data_dir, filename),
-                                   'r', encoding='utf-8')
+                offset = 0
+                sha256 = hashlib.sha256()
+                mode = 'wb'
 
-            for row in file_obj:
-                if not row.startswith('#'):
-                    yield dict(list(zip(settings.files[filekey]['fields'],
-                                        row.rstrip('\n').split("\t"))))
+            content_length = response.headers.get('Content-Length')
+            expected_size = int(content_length) + offset if content_length else None
+
+            entry['partial'] = {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }
+            with self.manifest_lock:
+                manifest[filename] = entry
+                self.save_manifest()
+
+            self.logger.debug("Saving: {}/{}".format(self.data_dir, filename))
+            with io.open(part_path, mode) as fp:
+                for chunk in iter(lambda: response.read(self.download_chunk_size), b''):
+                    fp.write(chunk)
+                    sha256.update(chunk)
+
+        size = os.path.getsize(part_path)
+        if expected_size is not None and size != expected_size:
+            raise Exception("Download of {} is incomplete: got {} of {} bytes".format(
+                url, size, expected_size))
+
+        os.replace(part_path, filepath)
+
+        # A new entry, since the cached row count belongs to the old file
+        with self.manifest_lock:
+            manifest[filename] = dict(self.get_file_stat(filename),
+                                      url=url,
+                                      sha256=sha256.hexdigest(),
+                                      etag=entry['partial']['etag'],
+                                      last_modified=entry['partial']['last_modified'])
+            self.save_manifest()
+        self.logger.debug("Downloaded: {}".format(url))
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.data_dir, 'manifest.json')
+
+    def get_manifest(self):
+        if not hasattr(self, 'manifest'):
+            try:
+                with io.open(self.manifest_path, 'r', encoding='utf-8') as fp:
+                    self.manifest = json.load(fp)
+            except (IOError, OSError, ValueError):
+                self.manifest = {}
+        return self.manifest
+
+    def get_file_stat(self, filename):
+        stat = os.stat(os.path.join(self.data_dir, filename))
+        return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def set_row_count(self, filename, rows):
+        with self.manifest_lock:
+            entry = self.get_manifest().setdefault(filename, {})
+            stat = self.get_file_stat(filename)
+            if any(entry.get(key) != value for key, value in stat.items()):
+                # The file changed without being downloaded: forget about it
+                entry.clear()
+            entry.update(stat, rows=rows)
+            self.save_manifest()
+
+    def get_row_count(self, filename):
+        """Row count cached by an earlier run, if the file hasn't changed since."""
+        entry = self.get_manifest().get(filename, {})
+        stat = self.get_file_stat(filename)
+        if 'rows' in entry and all(entry.get(key) == value for key, value in stat.items()):
+            return entry['rows']
+        return None
+
+    def save_manifest(self):
+        tmp_path = self.manifest_path + '.tmp'
+        try:
+            with self.manifest_lock:
+                with io.open(tmp_path, 'w', encoding='utf-8') as fp:
+                    fp.write(json.dumps(self.get_manifest(), indent=2, sort_keys=True))
+                os.replace(tmp_path, self.manifest_path)
+        except (IOError, OSError) as e:
+            self.logger.warning("Unable to write manifest file '{}': {}".format(
+                                self.manifest_path, e))
+
+    def open_data_file(self, filename):
+        """
+        Open a data file, or the text file inside a zip file, for binary
+        reading. Returns the file object and its uncompressed size in bytes.
+        """
+        filepath = os.path.join(self.data_dir, filename)
+        name, ext = filename.rsplit('.', 1)
+        if (ext == 'zip'):
+            zip_file = zipfile.ZipFile(filepath)
+            member = name + '.txt'
+            return zip_file.open(member, 'r'), zip_file.getinfo(member).file_size
+        return io.open(filepath, 'rb'), os.path.getsize(filepath)
+
+    def get_countries(self, filekey):
+        """The country codes to read rows of ``filekey`` for, or None for all."""
+        countries = self.countries
+        if filekey == 'postal_code' and 'ALL' not in settings.postal_codes:
+            if countries is None:
+                countries = settings.postal_codes
+            else:
+                countries = countries & settings.postal_codes
+        return countries
+
+    def get_data(self, filekey, desc=None, filenames=None, fields=None, accept=None,
+                 whole_rows=False):
+        """
+        Yield every row of the data files for ``filekey`` (or of
+        ``filenames``, read with the fields of ``filekey``) as a dict.
+
+        If ``fields`` is given, rows are yielded as records of only those
+        fields instead, with numbers already converted and repeated strings
+        interned (see ``cities.records``). With ``whole_rows`` the records
+        keep their lines too, which plugins get as dicts.
+
+        Rows of other countries than the imported ones are left out, as are
+        rows for which ``accept``, if given, returns false. Both test the raw
+        line, before it is decoded.
+
+        If ``desc`` is given a progress bar is shown. It counts rows when the
+        row counts of all of the files are known from an earlier run, and
+        bytes otherwise, so files never have to be read twice.
+        """
+        # The main file of a stage counts the rows it hands out, and skips
+        # the rows an interrupted import committed
+        checkpoint = getattr(self, 'checkpoint', None)
+        if checkpoint is None or filenames is not None or checkpoint['filekey'] != filekey:
+            checkpoint = None
+        skip = checkpoint.pop('skip', 0) if checkpoint is not None else 0
+
+        filenames = filenames or self.get_filenames(filekey)
+        all_fields = settings.files[filekey]['fields']
+
+        countries = self.get_countries(filekey)
+        if countries is not None and country_fields.get(filekey) in all_fields:
+            in_countries = country_filter(all_fields, country_fields[filekey], countries)
+            if accept is None:
+                accept = in_countries
+            else:
+                # The cheaper test runs first
+                other_accept = accept
+
+                def accept(line):
+                    return in_countries(line) and other_accept(line)
+        if fields is not None:
+            parse = RecordParser(all_fields, fields, keep_line=whole_rows)
+        else:
+            def parse(line):
+                return dict(zip(all_fields, line.split("\t")))
+
+        row_counts = [self.get_row_count(filename) for filename in filenames]
+        count_rows = None not in row_counts
+        disable = self.options.get('quiet') or desc is None
+        if count_rows:
+            progress = tqdm(disable=disable, total=sum(row_counts), desc=desc)
+        else:
+            progress = tqdm(disable=disable, total=0, desc=desc,
+                            unit='B', unit_scale=True, unit_divisor=1024)
+
+        try:
+            for filename in filenames:
+                file_obj, size = self.open_data_file(filename)
+                if not count_rows:
+                    progress.total += size
+                    progress.refresh()
+
+                rows = 0
+                num_bytes = 0
+                try:
+                    with file_obj:
+                        for line in file_obj:
+                            num_bytes += len(line)
+                            if not count_rows:
+                                progress.update(len(line))
+                            if line.startswith(b'#'):
+                                continue
+
+                            rows += 1
+                            if count_rows:
+                                progress.update(1)
+                            if not rows % self.memory_check_rows:
+                                self.check_memory()
+                            if skip:
+                                skip -= 1
+                                continue
+                            if checkpoint is not None:
+                                checkpoint['rows'] += 1
+                            if accept is not None and not accept(line):
+                                continue
+                            yield parse(line.decode('utf-8').rstrip('\r\n'))
+                finally:
+                    self.count_read(filename, rows, num_bytes)
+
+                # Only cache the count once the whole file has been read
+                self.set_row_count(filename, rows)
+        finally:
+            progress.close()
 
     def parse(self, data):
         for line in data:
@@ -235,11 +1255,7 @@ class Command(BaseCommand):
 
     def import_country(self):
         self.download('country')
-        data = self.get_data('country')
-
-        total = sum(1 for _ in data) - len(NO_LONGER_EXISTENT_COUNTRY_CODES)
-
-        data = self.get_data('country')
+        data = self.get_data('country', desc="Importing countries")
 
         neighbours = {}
         countries = {}
@@ -251,13 +1267,10 @@ class Command(BaseCommand):
         # they are still the CharField(max_length=2) and import them the old way
         import_continents_as_fks = type(Country._meta.get_field('continent')) == ForeignKey
 
-        for item in tqdm([d for d in data if d['code'] not in NO_LONGER_EXISTENT_COUNTRY_CODES],
-                         disable=self.options.get('quiet'),
-                         total=total,
-                         desc="Importing countries"):
-            if not self.call_hook('country_pre', item):
-                continue
+        upserter = self.get_upserter(Country, 'country')
 
+        data = (item for item in data if item['code'] not in NO_LONGER_EXISTENT_COUNTRY_CODES)
+        for item in self.apply_pre_hooks('country', data):
             try:
                 country_id = int(item['geonameid'])
             except KeyError:
@@ -296,17 +1309,13 @@ class Command(BaseCommand):
                 pass
 
             # Make importing countries idempotent
-            country, created = Country.objects.update_or_create(id=country_id, defaults=defaults)
-
-            self.logger.debug("%s country '%s'",
-                              "Added" if created else "Updated",
-                              defaults['name'])
+            country = Country(id=country_id, **defaults)
+            upserter.add(country, defaults.keys(), item)
 
             neighbours[country] = item['neighbours'].split(",")
             countries[country.code] = country
 
-            if not self.call_hook('country_post', country, item):
-                continue
+        upserter.flush()
 
         for country, neighbour_codes in tqdm(list(neighbours.items()),
                                              disable=self.options.get('quiet'),
@@ -326,21 +1335,17 @@ class Command(BaseCommand):
                         desc="Building country index"):
             self.country_index[obj.code] = obj
 
-    def import_region(self):
-        self.download('region')
-        data = self.get_data('region')
+    def import_region(self, data=None):
+        if data is None:
+            self.download('region')
+            data = self.get_data('region', desc="Importing regions")
 
         self.build_country_index()
 
-        total = sum(1 for _ in data)
-
-        data = self.get_data('region')
+        upserter = self.get_upserter(Region, 'region')
 
         countries_not_found = {}
-        for item in tqdm(data, disable=self.options.get('quiet'), total=total, desc="Importing regions"):
-            if not self.call_hook('region_pre', item):
-                continue
-
+        for item in self.apply_pre_hooks('region', data):
             try:
                 region_id = int(item['geonameid'])
             except KeyError:
@@ -366,14 +1371,9 @@ class Command(BaseCommand):
                                     defaults['name'], country_code)
                 continue
 
-            region, created = Region.objects.update_or_create(id=region_id, defaults=defaults)
-
-            if not self.call_hook('region_post', region, item):
-                continue
+            upserter.add(Region(id=region_id, **defaults), defaults.keys(), item)
 
-            self.logger.debug("%s region: %s, %s",
-                              "Added" if created else "Updated",
-                              item['code'], region)
+        upserter.flush()
 
         if countries_not_found:
             countries_not_found_file = os.path.join(self.data_dir, 'countries_not_found.json')
@@ -389,29 +1389,50 @@ class Command(BaseCommand):
             return
 
         self.region_index = {}
+        # Subregions by (region id, name) and (region id, name_std), for
+        # cities whose admin2Code is a name rather than a code
+        self.subregion_name_index = {}
+        self.subregion_name_std_index = {}
         for obj in tqdm(chain(Region.objects.all().prefetch_related('country'),
-                              Subregion.objects.all().prefetch_related('region__country')),
+                              Subregion.objects.order_by('id').prefetch_related('region__country')),
                         disable=self.options.get('quiet'),
                         total=Region.objects.all().count() + Subregion.objects.all().count(),
                         desc="Building region index"):
             self.region_index[obj.full_code()] = obj
-
-    def import_subregion(self):
-        self.download('subregion')
-        data = self.get_data('subregion')
-
-        total = sum(1 for _ in data)
-
-        data = self.get_data('subregion')
+            if isinstance(obj, Subregion):
+                self.subregion_name_index.setdefault((obj.region_id, obj.name), obj)
+                self.subregion_name_std_index.setdefault((obj.region_id, obj.name_std), obj)
+
+    def find_subregion(self, region, name):
+        """
+        Look up a subregion of ``region`` by name or standard name, with or
+        without a trailing ' (undefined)'. The subregion with the lowest id
+        wins if several match.
+        """
+        if region is None:
+            return None
+        names = [name]
+        if ' (undefined)' in name:
+            names.append(name.replace(' (undefined)', ''))
+        for index in (self.subregion_name_index, self.subregion_name_std_index):
+            for key in names:
+                subregion = index.get((region.id, key))
+                if subregion is not None:
+                    return subregion
+        return None
+
+    def import_subregion(self, data=None):
+        if data is None:
+            self.download('subregion')
+            data = self.get_data('subregion', desc="Importing subregions")
 
         self.build_country_index()
         self.build_region_index()
 
-        regions_not_found = {}
-        for item in tqdm(data, disable=self.options.get('quiet'), total=total, desc="Importing subregions"):
-            if not self.call_hook('subregion_pre', item):
-                continue
+        upserter = self.get_upserter(Subregion, 'subregion')
 
+        regions_not_found = {}
+        for item in self.apply_pre_hooks('subregion', data):
             try:
                 subregion_id = int(item['geonameid'])
             except KeyError:
@@ -438,14 +1459,9 @@ class Command(BaseCommand):
                                   item['code'], defaults['name'])
                 continue
 
-            subregion, created = Subregion.objects.update_or_create(id=subregion_id, defaults=defaults)
+            upserter.add(Subregion(id=subregion_id, **defaults), defaults.keys(), item)
 
-            if not self.call_hook('subregion_post', subregion, item):
-                continue
-
-            self.logger.debug("%s subregion: %s, %s",
-                              "Added" if created else "Updated",
-                              item['code'], subregion)
+        upserter.flush()
 
         if regions_not_found:
             regions_not_found_file = os.path.join(self.data_dir, 'regions_not_found.json')
@@ -458,46 +1474,47 @@ class Command(BaseCommand):
 
         del self.region_index
 
-    def import_city(self):
-        self.download('city')
-        data = self.get_data('city')
+    def import_city(self, data=None):
+        if data is None:
+            self.download('city')
 
-        total = sum(1 for _ in data)
+            whole_rows = bool(self.get_hooks('city'))
+            if self.options.get('loader') == 'copy':
+                return self.copy_city(self.get_data('city', desc="Copying cities",
+                                                    fields=import_fields['city'], whole_rows=whole_rows))
 
-        data = self.get_data('city')
+            data = self.get_data('city', desc="Importing cities", fields=import_fields['city'],
+                                 whole_rows=whole_rows)
 
         self.build_country_index()
         self.build_region_index()
 
-        for item in tqdm(data, disable=self.options.get('quiet'), total=total, desc="Importing cities"):
-            if not self.call_hook('city_pre', item):
-                continue
+        upserter = self.get_upserter(City, 'city')
 
+        for item in self.apply_pre_hooks('city', data):
             if item['featureCode'] not in city_types:
                 continue
 
             try:
-                city_id = int(item['geonameid'])
+                city_id = item['geonameid']
             except KeyError:
                 self.logger.warning("City has no geonameid: {} -- skipping".format(item))
                 continue
-            except ValueError:
-                self.logger.warning("City has non-numeric geonameid: {} -- skipping".format(item['geonameid']))
+            if not isinstance(city_id, int):
+                self.logger.warning("City has non-numeric geonameid: {} -- skipping".format(city_id))
                 continue
 
             defaults = {
                 'name': item['name'],
                 'kind': item['featureCode'],
                 'name_std': item['asciiName'],
-                'location': Point(float(item['longitude']), float(item['latitude'])),
-                'population': int(item['population']),
+                'location': Point(item['longitude'], item['latitude']),
+                'population': item['population'],
                 'timezone': item['timezone'],
             }
 
-            try:
-                defaults['elevation'] = int(item['elevation'])
-            except (KeyError, ValueError):
-                pass
+            if isinstance(item.get('elevation'), int):
+                defaults['elevation'] = item['elevation']
 
             country_code = item['countryCode']
             try:
@@ -527,88 +1544,215 @@ class Command(BaseCommand):
                 subregion = self.region_index[country_code + "." + region_code + "." + subregion_code]
                 defaults['subregion'] = subregion
             except KeyError:
-                try:
-                    with transaction.atomic():
-                        defaults['subregion'] = Subregion.objects.get(
-                            Q(name=subregion_code) |
-                            Q(name=subregion_code.replace(' (undefined)', '')),
-                            region=defaults['region'])
-                except Subregion.DoesNotExist:
-                    try:
-                        with transaction.atomic():
-                            defaults['subregion'] = Subregion.objects.get(
-                                Q(name_std=subregion_code) |
-                                Q(name_std=subregion_code.replace(' (undefined)', '')),
-                                region=defaults['region'])
-                    except Subregion.DoesNotExist:
-                        if subregion_code:
-                            self.logger.debug("%s: %s: Cannot find subregion: '%s'",
-                                              country_code, item['name'], subregion_code)
-                        defaults['subregion'] = None
-
-            city, created = City.objects.update_or_create(id=city_id, defaults=defaults)
-
-            if not self.call_hook('city_post', city, item):
-                continue
+                defaults['subregion'] = self.find_subregion(defaults['region'], subregion_code)
+                if defaults['subregion'] is None and subregion_code:
+                    self.logger.debug("%s: %s: Cannot find subregion: '%s'",
+                                      country_code, item['name'], subregion_code)
 
-            self.logger.debug("%s city: %s",
-                              "Added" if created else "Updated", city)
+            upserter.add(City(id=city_id, **defaults), defaults.keys(), item)
 
-    def build_hierarchy(self):
-        if hasattr(self, 'hierarchy') and self.hierarchy:
-            return
+        upserter.flush()
 
-        self.download('hierarchy')
-        data = self.get_data('hierarchy')
+    def warn_post_hooks_skipped(self, name):
+        hooks = self.get_hooks(name)
+        for kind in ('post', 'post_batch'):
+            if kind in hooks:
+                self.logger.warning("'%s_%s' plugin hooks are not called with --loader=copy", name, kind)
 
-        total = sum(1 for _ in data)
+    def copy_city(self, data):
+        self.warn_post_hooks_skipped('city')
 
-        data = self.get_data('hierarchy')
+        def rows():
+            for row_id, item in enumerate(self.apply_pre_hooks('city', data)):
+                if item['featureCode'] not in city_types:
+                    continue
 
-        self.hierarchy = {}
-        for item in tqdm(data, disable=self.options.get('quiet'), total=total, desc="Building hierarchy index"):
-            parent_id = int(item['parent'])
-            child_id = int(item['child'])
-            self.hierarchy[child_id] = parent_id
+                city_id = item.get('geonameid')
+                if not isinstance(city_id, int):
+                    self.logger.warning("City has no valid geonameid: {} -- skipping".format(item))
+                    continue
 
-    def import_district(self):
-        self.download('city')
-        data = self.get_data('city')
+                elevation = item.get('elevation')
+                if not isinstance(elevation, int):
+                    elevation = None
+
+                city = City(id=city_id, name=item['name'])
+
+                yield (
+                    row_id,
+                    city_id,
+                    item['name'],
+                    item['asciiName'],
+                    item['featureCode'],
+                    item['countryCode'],
+                    item['admin1Code'],
+                    item['admin2Code'],
+                    item['longitude'],
+                    item['latitude'],
+                    item['population'],
+                    elevation,
+                    item['timezone'],
+                    slugify_func(city, city.slugify()),
+                )
 
-        total = sum(1 for _ in data)
+        columns = [
+            ('row_id', 'bigint'),
+            ('id', 'integer'),
+            ('name', 'text'),
+            ('name_std', 'text'),
+            ('kind', 'text'),
+            ('country_code', 'text'),
+            ('region_code', 'text'),
+            ('subregion_code', 'text'),
+            ('longitude', 'double precision'),
+            ('latitude', 'double precision'),
+            ('population', 'integer'),
+            ('elevation', 'integer'),
+            ('timezone', 'text'),
+            ('slug', 'text'),
+        ]
+
+        city_opts = City._meta
+        staging_table = '{}_staging'.format(city_opts.db_table)
+
+        with CopyLoader(router.db_for_write(City)) as loader:
+            quote = loader.quote
+            loader.create_staging_table(staging_table, columns)
+            loader.copy(staging_table, [name for name, _ in columns], rows())
+
+            target_columns = ['id', 'name', 'name_std', 'kind', 'country', 'region',
+                              'subregion', 'location', 'population', 'elevation',
+                              'timezone', 'slug']
+            update_columns = [c for c in target_columns if c != 'id']
+            merged = loader.execute("""
+                WITH src AS (
+                    SELECT DISTINCT ON (s.id)
+                           s.id, s.name, s.name_std, s.kind, c.{pk} AS country, r.{pk} AS region,
+                           COALESCE(sr.{pk}, srn.{pk}) AS subregion,
+                           ST_SetSRID(ST_MakePoint(s.longitude, s.latitude), {srid}) AS location,
+                           s.population, s.elevation, s.timezone, s.slug
+                    FROM {staging} s
+                    JOIN {country} c ON c.{country_code} = s.country_code
+                    LEFT JOIN {region} r ON r.{region_country} = c.{pk}
+                                        AND r.{region_code} = s.region_code
+                    LEFT JOIN {subregion} sr ON sr.{subregion_region} = r.{pk}
+                                            AND sr.{subregion_code} = s.subregion_code
+                    LEFT JOIN LATERAL (
+                        SELECT x.{pk} FROM {subregion} x
+                        WHERE x.{subregion_region} = r.{pk}
+                          AND (x.{subregion_name} IN (s.subregion_code, replace(s.subregion_code, ' (undefined)', ''))
+                               OR x.{subregion_name_std} IN (s.subregion_code, replace(s.subregion_code, ' (undefined)', '')))
+                        ORDER BY x.{subregion_name} IN (s.subregion_code, replace(s.subregion_code, ' (undefined)', '')) DESC,
+                                 x.{pk}
+                        LIMIT 1
+                    ) srn ON sr.{pk} IS NULL
+                    {where}
+                    ORDER BY s.id, s.row_id DESC
+                ), merged AS (
+                    INSERT INTO {city} AS t ({target_columns})
+                    SELECT * FROM src
+                    ON CONFLICT ({pk}) DO UPDATE SET {updates}
+                    WHERE {changed}
+                    RETURNING (xmax = 0) AS inserted
+                )
+                SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted),
+                       (SELECT count(*) FROM src) - count(*)
+                FROM merged
+            """.format(
+                city=quote(city_opts.db_table),
+                staging=quote(staging_table),
+                country=quote(Country._meta.db_table),
+                region=quote(Region._meta.db_table),
+                subregion=quote(Subregion._meta.db_table),
+                pk=quote('id'),
+                srid=int(city_opts.get_field('location').srid),
+                country_code=quote(column(Country, 'code')),
+                region_country=quote(column(Region, 'country')),
+                region_code=quote(column(Region, 'code')),
+                subregion_region=quote(column(Subregion, 'region')),
+                subregion_code=quote(column(Subregion, 'code')),
+                subregion_name=quote(column(Subregion, 'name')),
+                subregion_name_std=quote(column(Subregion, 'name_std')),
+                target_columns=', '.join(quote(column(City, c)) for c in target_columns),
+                updates=', '.join('{0} = EXCLUDED.{0}'.format(quote(column(City, c)))
+                                  for c in update_columns),
+                changed=changed_condition(quote, City, update_columns, 't', 'EXCLUDED'),
+                where='WHERE r.{} IS NOT NULL'.format(quote('id')) if SKIP_CITIES_WITH_EMPTY_REGIONS else '',
+            ))
+
+        self.count_rows(*merged[0])
+        self.logger.info("Copied cities: %d added, %d updated, %d unchanged", *merged[0])
+
+    def build_hierarchy(self, child_ids=None):
+        """
+        Index the parent of every place in the hierarchy file, or only of the
+        places in ``child_ids``.
+        """
+        if child_ids is None and hasattr(self, 'hierarchy') and self.hierarchy:
+            return
+
+        self.download('hierarchy')
+        data = self.get_data('hierarchy', desc="Building hierarchy index",
+                             fields=import_fields['hierarchy'])
+
+        pairs = ((item['child'], item['parent']) for item in data)
+        if child_ids is not None:
+            pairs = ((child_id, parent_id) for child_id, parent_id in pairs
+                     if child_id in child_ids)
+        self.hierarchy = IdMap(pairs)
+
+    def import_district(self, data=None):
+        if data is None:
+            self.download('city')
+            data = self.get_data('city', desc="Importing districts", fields=import_fields['district'],
+                                 whole_rows=bool(self.get_hooks('district')))
+
+        # Districts are a small part of the file: collect them first, so only
+        # their part of the hierarchy has to be kept in memory
+        items = []
+        for item in self.apply_pre_hooks('district', data):
+            if item['featureCode'] not in district_types:
+                continue
 
-        data = self.get_data('city')
+            items.append(item)
 
         self.build_country_index()
         self.build_region_index()
-        self.build_hierarchy()
+        self.build_hierarchy(child_ids=IdSet(item['geonameid'] for item in items))
+
+        cities = City.objects.all()
+        if self.countries is not None:
+            cities = cities.filter(country__code__in=self.countries)
 
         city_index = {}
-        for obj in tqdm(City.objects.all(),
+        # Cities that districts missing from the hierarchy can belong to
+        nearest_city_index = NearestIndex(max_distance=1000)
+        for obj in tqdm(cities,
                         disable=self.options.get('quiet'),
-                        total=City.objects.all().count(),
+                        total=cities.count(),
                         desc="Building city index"):
             city_index[obj.id] = obj
+            if obj.population > self.district_city_population_min:
+                nearest_city_index.add(obj.location, obj)
 
-        for item in tqdm(data, disable=self.options.get('quiet'), total=total, desc="Importing districts"):
-            if not self.call_hook('district_pre', item):
-                continue
+        # Existing districts keep their id even if it isn't their geonameid
+        district_ids = {(city_id, name): district_id for district_id, city_id, name in
+                        District.objects.values_list('id', 'city_id', 'name')}
 
-            _type = item['featureCode']
-            if _type not in district_types:
-                continue
+        upserter = self.get_upserter(District, 'district')
 
+        for item in items:
             defaults = {
                 'name': item['name'],
                 'name_std': item['asciiName'],
-                'location': Point(float(item['longitude']), float(item['latitude'])),
-                'population': int(item['population']),
+                'location': Point(item['longitude'], item['latitude']),
+                'population': item['population'],
             }
 
             if hasattr(District, 'code'):
-                defaults['code'] = item['admin3Code'],
+                defaults['code'] = item['admin3Code']
 
-            geonameid = int(item['geonameid'])
+            geonameid = item['geonameid']
 
             # Find city
             city = None
@@ -616,39 +1760,7 @@ class Command(BaseCommand):
                 city = city_index[self.hierarchy[geonameid]]
             except KeyError:
                 self.logger.debug("District: %d %s: Cannot find city in hierarchy, using nearest", geonameid, defaults['name'])
-                city_pop_min = 100000
-                # we are going to try to find closet city using native
-                # database .distance(...) query but if that fails then
-                # we fall back to degree search, MYSQL has no support
-                # and Spatialite with SRID 4236.
-                try:
-                    if django_version < (1, 9):
-                        city = City.objects.filter(population__gt=city_pop_min)\
-                                   .distance(defaults['location'])\
-                                   .order_by('distance')[0]
-                    else:
-                        city = City.objects.filter(
-                            location__distance_lte=(defaults['location'], D(km=1000))
-                        ).annotate(
-                            distance=Distance('location', defaults['location'])
-                        ).order_by('distance').first()
-                except City.DoesNotExist as e:
-                    self.logger.warning(
-                        "District: %s: DB backend does not support native '.distance(...)' query "
-                        "falling back to two degree search",
-                        defaults['name']
-                    )
-                    search_deg = 2
-                    min_dist = float('inf')
-                    bounds = Envelope(
-                        defaults['location'].x - search_deg, defaults['location'].y - search_deg,
-                        defaults['location'].x + search_deg, defaults['location'].y + search_deg)
-                    for e in City.objects.filter(population__gt=city_pop_min).filter(
-                            location__intersects=bounds.wkt):
-                        dist = geo_distance(defaults['location'], e.location)
-                        if dist < min_dist:
-                            min_dist = dist
-                            city = e
+                city = nearest_city_index.nearest(defaults['location'])
             else:
                 self.logger.debug("Found city in hierarchy: %s [%d]", city.name, geonameid)
 
@@ -658,51 +1770,255 @@ class Command(BaseCommand):
 
             defaults['city'] = city
 
-            try:
-                with transaction.atomic():
-                    district = District.objects.get(city=defaults['city'], name=defaults['name'])
-            except District.DoesNotExist:
-                # If the district doesn't exist, create it with the geonameid
-                # as its id
-                district, created = District.objects.update_or_create(id=item['geonameid'], defaults=defaults)
-            else:
-                # Since the district already exists, but doesn't have its
-                # geonameid as its id, we need to update all of its attributes
-                # *except* for its id
-                for key, value in defaults.items():
-                    setattr(district, key, value)
-                district.save()
-                created = False
-
-            if not self.call_hook('district_post', district, item):
-                continue
+            # If the district doesn't exist, create it with the geonameid as
+            # its id, otherwise update all of its attributes *except* its id
+            district_id = district_ids.setdefault((city.id, defaults['name']), geonameid)
+
+            upserter.add(District(id=district_id, **defaults), defaults.keys(), item)
 
-            self.logger.debug("%s district: %s", "Added" if created else "Updated", district)
+        upserter.flush()
 
-    def import_alt_name(self):
-        self.download('alt_name')
-        data = self.get_data('alt_name')
+    def get_incremental_days(self, key):
+        """Days whose daily files haven't been applied yet, oldest first."""
+        yesterday = datetime.datetime.now(datetime.timezone.utc).date() - datetime.timedelta(days=1)
 
-        total = sum(1 for _ in data)
+        if self.options.get('since'):
+            try:
+                day = datetime.datetime.strptime(self.options['since'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError("--since must be a date in YYYY-MM-DD format")
+        else:
+            try:
+                last_day = ImportState.objects.get(key=key).value
+            except ImportState.DoesNotExist:
+                self.logger.warning("No daily %s have been applied yet, starting with %s",
+                                    key, yesterday)
+                day = yesterday
+            else:
+                day = datetime.datetime.strptime(last_day, '%Y-%m-%d').date() + datetime.timedelta(days=1)
 
-        data = self.get_data('alt_name')
+        while day <= yesterday:
+            yield day
+            day += datetime.timedelta(days=1)
 
-        geo_index = {}
-        for type_ in (Country, Region, Subregion, City, District):
+    def download_daily_files(self, day, *filekeys):
+        """Download the files of ``filekeys`` for ``day``, or return None if any isn't published."""
+        filenames = []
+        for filekey in filekeys:
+            filename = settings.files[filekey]['filename'].format(date=day.isoformat())
+            try:
+                self.download(filekey, filenames=[filename])
+            except Exception as e:
+                self.logger.warning("Cannot get %s: %s -- stopping", filename, e)
+                return None
+            filenames.append(filename)
+        return filenames
+
+    def get_city_population_min(self):
+        """The population threshold of the configured cities file, e.g. 5000 for cities5000.zip."""
+        thresholds = [int(m.group(1)) for m in
+                      [re.match(r'cities(\d+)\.', filename) for filename in self.get_filenames('city')] if m]
+        if not thresholds:
+            return 0
+        return min(thresholds)
+
+    def import_incremental(self):
+        """
+        Apply GeoNames' daily update files for the selected import types.
+        Each day is applied in its own transaction, and the last applied day
+        of each kind of file is recorded in ImportState.
+        """
+        if set(self.imports) & set(['region', 'subregion', 'city', 'district']):
+            self.import_place_modifications()
+        if 'alt_name' in self.imports:
+            self.import_alt_name_modifications()
+
+    def import_place_modifications(self):
+        """
+        Apply modifications-YYYY-MM-DD.txt and deletes-YYYY-MM-DD.txt to
+        regions, subregions, cities and districts.
+        """
+        population_min = self.get_city_population_min()
+        imported_types = set(city_types) | set(district_types)
+
+        for day in self.get_incremental_days('modifications'):
+            filenames = self.download_daily_files(day, 'modifications', 'deletes')
+            if filenames is None:
+                break
+            modifications_file, deletes_file = filenames
+
+            with transaction.atomic():
+                regions, subregions, places = [], [], []
+                existing_ids = set(chain(City.objects.values_list('id', flat=True),
+                                         District.objects.values_list('id', flat=True)))
+                for item in self.get_data('modifications', filenames=[modifications_file],
+                                          desc="Reading modifications for {}".format(day),
+                                          fields=import_fields['modifications'],
+                                          whole_rows=bool(self.get_hooks('city') or
+                                                          self.get_hooks('district'))):
+                    feature_code = item['featureCode']
+                    if feature_code == 'ADM1':
+                        regions.append({
+                            'code': '{}.{}'.format(item['countryCode'], item['admin1Code']),
+                            'name': item['name'],
+                            'asciiName': item['asciiName'],
+                            'geonameid': item['geonameid'],
+                        })
+                    elif feature_code == 'ADM2':
+                        subregions.append({
+                            'code': '{}.{}.{}'.format(item['countryCode'], item['admin1Code'],
+                                                      item['admin2Code']),
+                            'name': item['name'],
+                            'asciiName': item['asciiName'],
+                            'geonameid': item['geonameid'],
+                        })
+                    elif feature_code in imported_types:
+                        # Places too small for the configured cities file are
+                        # only updated if they were imported some other way
+                        population = item['population'] if isinstance(item['population'], int) else 0
+                        if population >= population_min or item['geonameid'] in existing_ids:
+                            places.append(item)
+
+                if regions and 'region' in self.imports:
+                    self.import_region(data=regions)
+                if subregions and 'subregion' in self.imports:
+                    self.import_subregion(data=subregions)
+                if places and 'city' in self.imports:
+                    self.import_city(data=places)
+                if places and 'district' in self.imports:
+                    self.import_district(data=places)
+
+                deleted_ids = [item['geonameid'] for item in
+                               self.get_data('deletes', filenames=[deletes_file], fields=['geonameid'])]
+                for import_, model in (('district', District), ('city', City),
+                                       ('subregion', Subregion), ('region', Region)):
+                    if import_ not in self.imports:
+                        continue
+                    num_deleted, _ = model.objects.filter(id__in=deleted_ids).delete()
+                    if num_deleted:
+                        self.logger.info("Deleted %d rows for %s", num_deleted, model.__name__)
+
+                ImportState.objects.update_or_create(key='modifications',
+                                                     defaults={'value': day.isoformat()})
+
+            self.logger.info("Applied GeoNames modifications for %s", day)
+
+    def get_alt_name_links(self):
+        """The M2M through model and its AlternativeName column for each place type."""
+        for type_ in (Country, Region, Subregion, City, District, PostalCode):
+            field = type_._meta.get_field('alt_names')
+            yield field.remote_field.through, field.m2m_reverse_field_name()
+
+    def unlink_alt_names(self, alt_ids):
+        for through, alt_field in self.get_alt_name_links():
+            through.objects.filter(**{alt_field + '__in': alt_ids}).delete()
+
+    def import_alt_name_modifications(self):
+        """
+        Apply alternateNamesModifications-YYYY-MM-DD.txt and
+        alternateNamesDeletes-YYYY-MM-DD.txt to alternative names.
+        """
+        for day in self.get_incremental_days('alternateNamesModifications'):
+            filenames = self.download_daily_files(day, 'alt_name_modifications', 'alt_name_deletes')
+            if filenames is None:
+                break
+            modifications_file, deletes_file = filenames
+
+            with transaction.atomic():
+                items = list(self.get_data('alt_name_modifications', filenames=[modifications_file],
+                                           desc="Reading alternative name modifications for {}".format(day),
+                                           fields=import_fields['alt_name'],
+                                           whole_rows=bool(self.get_hooks('alt_name'))))
+
+                # A modified name may now belong to another place, so its old
+                # links are removed and import_alt_name links it again
+                modified_ids = [item['nameid'] for item in items]
+                self.unlink_alt_names(modified_ids)
+                self.import_alt_name(data=items)
+
+                # Names that are no longer linked didn't pass the locale and
+                # kind filters any more, or their place isn't imported
+                linked_ids = set()
+                for through, alt_field in self.get_alt_name_links():
+                    linked_ids.update(through.objects.filter(**{alt_field + '__in': modified_ids})
+                                                     .values_list(alt_field, flat=True))
+                deleted_ids = [item['nameid'] for item in
+                               self.get_data('alt_name_deletes', filenames=[deletes_file], fields=['nameid'])]
+                deleted_ids += [alt_id for alt_id in modified_ids if alt_id not in linked_ids]
+
+                # Deleting the names removes their links too
+                num_deleted, _ = AlternativeName._base_manager.filter(id__in=deleted_ids).delete()
+                if num_deleted:
+                    self.logger.info("Deleted %d alternative names", num_deleted)
+
+                ImportState.objects.update_or_create(key='alternateNamesModifications',
+                                                     defaults={'value': day.isoformat()})
+
+            self.logger.info("Applied GeoNames alternative name modifications for %s", day)
+
+    def import_alt_name(self, data=None):
+        if data is None:
+            self.download('alt_name')
+
+        # Only the ids of each type of place are kept in memory: the places
+        # themselves are fetched when they are needed. With a country filter,
+        # only the places of those countries get names
+        geo_index = []
+        for type_, country_lookup in ((Country, 'code__in'),
+                                      (Region, 'country__code__in'),
+                                      (Subregion, 'region__country__code__in'),
+                                      (City, 'country__code__in'),
+                                      (District, 'city__country__code__in')):
             plural_type_name = '{}s'.format(type_.__name__) if type_.__name__[-1] != 'y' else '{}ies'.format(type_.__name__[:-1])
-            for obj in tqdm(type_.objects.all(),
-                            disable=self.options.get('quiet'),
-                            total=type_.objects.all().count(),
-                            desc="Building geo index for {}".format(plural_type_name.lower())):
-                geo_index[obj.id] = {
-                    'type': type_,
-                    'object': obj,
-                }
-
-        for item in tqdm(data, disable=self.options.get('quiet'), total=total, desc="Importing data for alternative names"):
-            if not self.call_hook('alt_name_pre', item):
-                continue
+            ids = type_.objects.order_by('id').values_list('id', flat=True)
+            if self.countries is not None:
+                ids = ids.filter(**{country_lookup: self.countries})
+            geo_index.append((type_, IdSet(tqdm(ids.iterator(),
+                                                disable=self.options.get('quiet'),
+                                                total=ids.count(),
+                                                desc="Building geo index for {}".format(plural_type_name.lower())))))
+
+        def get_geo_type(geo_id):
+            for type_, ids in geo_index:
+                if geo_id in ids:
+                    return type_
+
+        if data is None:
+            # Names of places that aren't imported are skipped before their
+            # rows are parsed
+            geonameid_index = settings.files['alt_name']['fields'].index('geonameid')
+
+            def is_imported(line):
+                try:
+                    return get_geo_type(int(line.split(b'\t', geonameid_index + 1)[geonameid_index])) is not None
+                except (IndexError, ValueError):
+                    return False
 
+            data = self.get_data('alt_name', desc="Importing data for alternative names",
+                                 fields=import_fields['alt_name'], accept=is_imported,
+                                 whole_rows=bool(self.get_hooks('alt_name')))
+
+        # The place each alternative name in the current batch belongs to,
+        # linked through the M2M tables once the batch has been written
+        places = {}
+
+        def link_alt_names(alt_names):
+            links = {}
+            for alt in alt_names:
+                type_, geo_id = places.pop(alt.pk)
+                field = type_._meta.get_field('alt_names')
+                through = field.remote_field.through
+                links.setdefault(through, []).append(through(**{
+                    field.m2m_field_name() + '_id': geo_id,
+                    field.m2m_reverse_field_name() + '_id': alt.pk,
+                }))
+            for through, rows in links.items():
+                through.objects.bulk_create(rows, batch_size=upserter.batch_size,
+                                            ignore_conflicts=True)
+
+        upserter = self.get_upserter(AlternativeName, 'alt_name', on_flush=link_alt_names)
+
+        for item in self.apply_pre_hooks('alt_name', data):
             # Only get names for languages in use
             locale = item['language']
             if not locale:
@@ -715,30 +2031,24 @@ class Command(BaseCommand):
                 continue
 
             # Check if known geo id
-            geo_id = int(item['geonameid'])
-            try:
-                geo_info = geo_index[geo_id]
-            except KeyError:
+            geo_id = item['geonameid']
+            geo_type = get_geo_type(geo_id)
+            if geo_type is None:
                 continue
 
             try:
-                alt_id = int(item['nameid'])
+                alt_id = item['nameid']
             except KeyError:
                 self.logger.warning("Alternative name has no nameid: {} -- skipping".format(item))
                 continue
 
-            try:
-                alt = AlternativeName.objects.get(id=alt_id)
-            except AlternativeName.DoesNotExist:
-                alt = AlternativeName(id=alt_id)
+            alt = AlternativeName(id=alt_id)
+            fields = ['name', 'is_preferred', 'is_short', 'is_historic', 'language_code']
 
             alt.name = item['name']
             alt.is_preferred = bool(item['isPreferred'])
             alt.is_short = bool(item['isShort'])
-            try:
-                alt.language_code = locale
-            except AttributeError:
-                alt.language = locale
+            alt.language_code = locale
 
             try:
                 int(item['name'])
@@ -748,61 +2058,31 @@ class Command(BaseCommand):
                 if not INCLUDE_NUMERIC_ALTERNATIVE_NAMES:
                     self.logger.debug(
                         "Trying to add a numeric alternative name to {} ({}): {} -- skipping".format(
-                            geo_info['object'].name,
-                            geo_info['type'].__name__,
+                            geo_id,
+                            geo_type.__name__,
                             item['name']))
                     continue
             alt.is_historic = True if ((item['isHistoric'] and
                                         item['isHistoric'] != '\n') or
                                        locale == 'fr_1793') else False
 
+            # Postal codes come from the postal code files
             if locale == 'post':
-                try:
-                    if geo_index[item['geonameid']]['type'] == Region:
-                        region = geo_index[item['geonameid']]['object']
-                        PostalCode.objects.get_or_create(
-                            code=item['name'],
-                            country=region.country,
-                            region=region,
-                            region_name=region.name)
-                    elif geo_index[item['geonameid']]['type'] == Subregion:
-                        subregion = geo_index[item['geonameid']]['object']
-                        PostalCode.objects.get_or_create(
-                            code=item['name'],
-                            country=subregion.region.country,
-                            region=subregion.region,
-                            subregion=subregion,
-                            region_name=subregion.region.name,
-                            subregion_name=subregion.name)
-                    elif geo_index[item['geonameid']]['type'] == City:
-                        city = geo_index[item['geonameid']]['object']
-                        PostalCode.objects.get_or_create(
-                            code=item['name'],
-                            country=city.country,
-                            region=city.region,
-                            subregion=city.subregion,
-                            region_name=city.region.name,
-                            subregion_name=city.subregion.name)
-                except KeyError:
-                    pass
-
                 continue
 
             if hasattr(alt, 'kind'):
                 if locale in ('abbr', 'link', 'name') or \
                    INCLUDE_AIRPORT_CODES and locale in ('iana', 'icao', 'faac'):
                     alt.kind = locale
+                    fields.append('kind')
                 elif locale not in settings.locales and 'all' not in settings.locales:
                     self.logger.debug("Unknown alternative name type: {} -- skipping".format(locale))
                     continue
 
-            alt.save()
-            geo_info['object'].alt_names.add(alt)
-
-            if not self.call_hook('alt_name_post', alt, item):
-                continue
+            places[alt_id] = (geo_type, geo_id)
+            upserter.add(alt, fields, item)
 
-            self.logger.debug("Added alt name: %s, %s", locale, alt)
+        upserter.flush()
 
     def build_postal_code_regex_index(self):
         if hasattr(self, 'postal_code_regex_index') and self.postal_code_regex_index:
@@ -823,36 +2103,129 @@ class Command(BaseCommand):
 
     def import_postal_code(self):
         self.download('postal_code')
-        data = self.get_data('postal_code')
-
-        total = sum(1 for _ in data)
-
-        data = self.get_data('postal_code')
 
         self.build_country_index()
-        self.build_region_index()
         if VALIDATE_POSTAL_CODES:
             self.build_postal_code_regex_index()
 
-        districts_to_delete = []
+        if self.options.get('loader') == 'copy':
+            return self.copy_postal_code(self.get_data('postal_code', desc="Copying postal codes",
+                                                       fields=import_fields['postal_code'],
+                                                       whole_rows=bool(self.get_hooks('postal_code'))))
+
+        if 'postal_code' in self.parallel_imports():
+            stats = self.import_postal_code_parallel(
+                self.get_data('postal_code', desc="Sharding postal codes by country"))
+        else:
+            stats = self.load_postal_codes(self.get_data('postal_code', desc="Importing postal codes",
+                                                         fields=import_fields['postal_code'],
+                                                         whole_rows=bool(self.get_hooks('postal_code'))))
 
-        query_statistics = [0 for i in range(8)]
-        num_existing_postal_codes = PostalCode.objects.count()
-        if num_existing_postal_codes == 0:
+        if 'postal_code' in self.parallel_imports():
+            # The worker processes wrote the rows
+            self.count_rows(stats['created'], stats['updated'], stats['unchanged'])
+
+        self.logger.info("Imported postal codes: %d added, %d updated, %d unchanged, %d skipped",
+                         stats['created'], stats['updated'], stats['unchanged'], stats['skipped'])
+
+        # How many existing postal codes each matching tier found
+        query_statistics = stats['query_statistics']
+        if max(query_statistics) > 0:
+            width = int(math.log10(max(query_statistics))) + 1
+
+            stats_str = ""
+            for i, count in enumerate(query_statistics):
+                stats_str = "{{}}\n{{:>2}} [{{:>{}}}]: {{}}".format(width)\
+                    .format(stats_str, i, count,
+                            '=' * int(math.ceil(50.0 * count / max(query_statistics))))
+
+            self.logger.info("Postal code query statistics:\n{}".format(stats_str))
+
+        if stats['districts_to_delete']:
+            self.logger.debug('districts to delete:\n{}'.format(stats['districts_to_delete']))
+
+    def import_postal_code_parallel(self, data):
+        # Rows for different countries never touch each other, so the file is
+        # split into one shard per country and the shards are imported by a
+        # pool of worker processes
+        shard_dir = tempfile.mkdtemp(prefix='postal_codes_', dir=self.data_dir)
+        try:
+            shards = {}
+            fields = settings.files['postal_code']['fields']
+            for item in data:
+                country_code = item['countryCode']
+                if country_code not in shards:
+                    shards[country_code] = io.open(os.path.join(shard_dir, '{}.txt'.format(country_code)),
+                                                   'w', encoding='utf-8')
+                shards[country_code].write('\t'.join(item.get(field, '') for field in fields) + '\n')
+            for shard in shards.values():
+                shard.close()
+
+            # Worker processes must not share this process' connections, or
+            # be forked while a download thread holds a lock
+            connections.close_all()
+            self.wait_for_downloads()
+
+            stats = empty_postal_code_stats()
+            pool = Pool(self.options['workers'], init_postal_code_worker, (self.options,))
+            try:
+                for shard_stats in tqdm(pool.imap_unordered(import_postal_code_shard,
+                                                            [shard.name for shard in shards.values()]),
+                                        disable=self.options.get('quiet'),
+                                        total=len(shards),
+                                        desc="Importing postal codes by country"):
+                    merge_postal_code_stats(stats, shard_stats)
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+        finally:
+            shutil.rmtree(shard_dir, ignore_errors=True)
+
+        return stats
+
+    def get_shard_data(self, filekey, path):
+        parse = RecordParser(settings.files[filekey]['fields'], import_fields[filekey],
+                             keep_line=bool(self.get_hooks(filekey)))
+        with io.open(path, 'r', encoding='utf-8') as file_obj:
+            for row in file_obj:
+                yield parse(row.rstrip('\n'))
+
+    def load_postal_codes(self, data):
+        stats = empty_postal_code_stats()
+        districts_to_delete = stats['districts_to_delete']
+
+        # A resumed import goes on the way it started: the postal codes that
+        # an import without any existing ones committed are all new, and are
+        # not to be matched
+        checkpoint = getattr(self, 'checkpoint', None)
+        state = checkpoint['state'] if checkpoint is not None else {}
+        if 'create_only' not in state:
+            state['create_only'] = not PostalCode.objects.exists()
+        if state['create_only']:
             self.logger.debug("Zero postal codes found - using only-create "
                               "postal code optimization")
-        for item in tqdm(data, disable=self.options.get('quiet'), total=total, desc="Importing postal codes"):
-            if not self.call_hook('postal_code_pre', item):
-                continue
+        postal_code_index = None
+        admin_area_index = None
+        batch = []
+        batch_created = batch_unchanged = 0
+        batch_size = self.options.get('batch_size') or 1000
+        hooks = self.get_hooks('postal_code')
+
+        def on_skip(count):
+            stats['skipped'] += count
 
+        for item in self.apply_pre_hooks('postal_code', data, hooks=hooks, on_skip=on_skip):
             country_code = item['countryCode']
             if country_code not in settings.postal_codes and 'ALL' not in settings.postal_codes:
+                stats['skipped'] += 1
                 continue
 
             try:
                 code = item['postalCode']
             except KeyError:
                 self.logger.warning("Postal code has no code: {} -- skipping".format(item))
+                stats['skipped'] += 1
                 continue
 
             # Find country
@@ -860,120 +2233,36 @@ class Command(BaseCommand):
                 country = self.country_index[country_code]
             except KeyError:
                 self.logger.warning("Postal code '%s': Cannot find country: %s -- skipping", code, country_code)
+                stats['skipped'] += 1
                 continue
 
             # Validate postal code against the country
             code = item['postalCode']
             if VALIDATE_POSTAL_CODES and self.postal_code_regex_index[country_code].match(code) is None:
                 self.logger.warning("Postal code didn't validate: {} ({})".format(code, country_code))
+                stats['skipped'] += 1
                 continue
 
-            reg_name_q = Q(region_name__iexact=item['admin1Name'])
-            subreg_name_q = Q(subregion_name__iexact=item['admin2Name'])
-            dst_name_q = Q(district_name__iexact=item['admin3Name'])
-
-            if hasattr(PostalCode, 'region'):
-                reg_name_q |= Q(region__code=item['admin1Code'])
-
-            if hasattr(PostalCode, 'subregion'):
-                subreg_name_q |= Q(subregion__code=item['admin2Code'])
-
-            if hasattr(PostalCode, 'district') and hasattr(District, 'code'):
-                dst_name_q |= Q(district__code=item['admin3Code'])
-
             try:
-                location = Point(float(item['longitude']),
-                                 float(item['latitude']))
-            except ValueError:
+                location = Point(item['longitude'], item['latitude'])
+            except TypeError:
                 location = None
 
             if len(item['placeName']) >= 200:
                 self.logger.warning("Postal code name has more than 200 characters: {}".format(item))
 
-            if num_existing_postal_codes > 0:
-                postal_code_args = (
-                    {
-                        'args': (reg_name_q, subreg_name_q, dst_name_q),
-                        'country': country,
-                        'code': code,
-                        'location': location,
-                    }, {
-                        'args': (reg_name_q, subreg_name_q, dst_name_q),
-                        'country': country,
-                        'code': code,
-                    }, {
-                        'args': (reg_name_q, subreg_name_q, dst_name_q),
-                        'country': country,
-                        'code': code,
-                        'name__iexact': re.sub("'", '', item['placeName']),
-                    }, {
-                        'args': tuple(),
-                        'country': country,
-                        'region__code': item['admin1Code'],
-                    }, {
-                        'args': tuple(),
-                        'country': country,
-                        'code': code,
-                        'name': item['placeName'],
-                        'region__code': item['admin1Code'],
-                        'subregion__code': item['admin2Code'],
-                    }, {
-                        'args': tuple(),
-                        'country': country,
-                        'code': code,
-                        'name': item['placeName'],
-                        'region__code': item['admin1Code'],
-                        'subregion__code': item['admin2Code'],
-                        'district__code': item['admin3Code'],
-                    }, {
-                        'args': tuple(),
-                        'country': country,
-                        'code': code,
-                        'name': item['placeName'],
-                        'region_name': item['admin1Name'],
-                        'subregion_name': item['admin2Name'],
-                    }, {
-                        'args': tuple(),
-                        'country': country,
-                        'code': code,
-                        'name': item['placeName'],
-                        'region_name': item['admin1Name'],
-                        'subregion_name': item['admin2Name'],
-                        'district_name': item['admin3Name'],
-                    }
-                )
-
-                # We do this so we don't have to deal with exceptions being thrown
-                # in the middle of transactions
-                for args_dict in postal_code_args:
-                    num_pcs = PostalCode.objects.filter(
-                        *args_dict['args'],
-                        **{k: v for k, v in args_dict.items() if k != 'args'})\
-                        .count()
-                    if num_pcs == 1:
-                        pc = PostalCode.objects.get(
-                            *args_dict['args'],
-                            **{k: v for k, v in args_dict.items() if k != 'args'})
-                        break
-                    elif num_pcs > 1:
-                        pcs = PostalCode.objects.filter(
-                            *args_dict['args'],
-                            **{k: v for k, v in args_dict.items() if k != 'args'})
-                        self.logger.debug("item: {}\nresults: {}".format(item, pcs))
-                        # Raise a MultipleObjectsReturned exception
-                        PostalCode.objects.get(
-                            *args_dict['args'],
-                            **{k: v for k, v in args_dict.items() if k != 'args'})
-                else:
-                    self.logger.debug("Creating postal code: {}".format(item))
-                    pc = PostalCode(
-                        country=country,
-                        code=code,
-                        name=item['placeName'],
-                        region_name=item['admin1Name'],
-                        subregion_name=item['admin2Name'],
-                        district_name=item['admin3Name'])
-            else:
+            pc = None
+            if not state['create_only']:
+                # Existing postal codes are matched in memory, one country at
+                # a time: the file is sorted by country
+                if postal_code_index is None or postal_code_index.country != country:
+                    postal_code_index = PostalCodeIndex(country)
+                tier, pc = postal_code_index.match(item, code, location)
+                if pc is not None:
+                    stats['query_statistics'][tier] += 1
+                    stored = obj_fingerprint(pc, postal_code_value_fields)
+
+            if pc is None:
                 self.logger.debug("Creating postal code: {}".format(item))
                 pc = PostalCode(
                     country=country,
@@ -983,111 +2272,210 @@ class Command(BaseCommand):
                     subregion_name=item['admin2Name'],
                     district_name=item['admin3Name'])
 
-            if pc.region_name != '':
-                try:
-                    with transaction.atomic():
-                        pc.region = Region.objects.get(
-                            Q(name_std__iexact=pc.region_name) |
-                            Q(name__iexact=pc.region_name),
-                            country=pc.country)
-                except Region.DoesNotExist:
-                    pc.region = None
-            else:
-                pc.region = None
-
-            if pc.subregion_name != '':
-                try:
-                    with transaction.atomic():
-                        pc.subregion = Subregion.objects.get(
-                            Q(region__name_std__iexact=pc.region_name) |
-                            Q(region__name__iexact=pc.region_name),
-                            Q(name_std__iexact=pc.subregion_name) |
-                            Q(name__iexact=pc.subregion_name),
-                            region__country=pc.country)
-                except Subregion.DoesNotExist:
-                    pc.subregion = None
-            else:
-                pc.subregion = None
-
-            if pc.district_name != '':
-                try:
-                    with transaction.atomic():
-                        pc.district = District.objects.get(
-                            Q(city__region__name_std__iexact=pc.region_name) |
-                            Q(city__region__name__iexact=pc.region_name),
-                            Q(name_std__iexact=pc.district_name) |
-                            Q(name__iexact=pc.district_name),
-                            city__country=pc.country)
-                except District.MultipleObjectsReturned as e:
-                    self.logger.debug("item: {}\ndistricts: {}".format(
-                        item,
-                        District.objects.filter(
-                            Q(city__region__name_std__iexact=pc.region_name) |
-                            Q(city__region__name__iexact=pc.region_name),
-                            Q(name_std__iexact=pc.district_name) |
-                            Q(name__iexact=pc.district_name),
-                            city__country=pc.country).values_list('id', flat=True)))
-                    # If they're both part of the same city
-                    if District.objects.filter(Q(city__region__name_std__iexact=pc.region_name) |
-                                               Q(city__region__name__iexact=pc.region_name),
-                                               Q(name_std__iexact=pc.district_name) |
-                                               Q(name__iexact=pc.district_name),
-                                               city__country=pc.country)\
-                               .values_list('city').distinct().count() == 1:
-                        # Use the one with the lower ID
-                        pc.district = District.objects.filter(
-                            Q(city__region__name_std__iexact=pc.region_name) |
-                            Q(city__region__name__iexact=pc.region_name),
-                            Q(name_std__iexact=pc.district_name) |
-                            Q(name__iexact=pc.district_name),
-                            city__country=pc.country).order_by('city__id').first()
-
-                        districts_to_delete.append(District.objects.filter(
-                            Q(city__region__name_std__iexact=pc.region_name) |
-                            Q(city__region__name__iexact=pc.region_name),
-                            Q(name_std__iexact=pc.district_name) |
-                            Q(name__iexact=pc.district_name),
-                            city__country=pc.country).order_by('city__id').last().id)
-                    else:
-                        raise e
-                except District.DoesNotExist:
-                    pc.district = None
-            else:
-                pc.district = None
-
-            if pc.district is not None:
-                pc.city = pc.district.city
+            if admin_area_index is None or admin_area_index.country != country:
+                admin_area_index = AdminAreaIndex(country)
+
+            pc.region = admin_area_index.get_region(pc.region_name)
+            pc.subregion = admin_area_index.get_subregion(pc.region_name, pc.subregion_name)
+            pc.district, duplicate_district_ids = admin_area_index.get_district(
+                pc.region_name, pc.district_name)
+            if duplicate_district_ids:
+                self.logger.debug("item: {}\ndistricts: {}".format(
+                    item, [pc.district.id] + duplicate_district_ids))
+                districts_to_delete.extend(duplicate_district_ids)
+
+            pc.city_id = pc.district.city_id if pc.district is not None else None
+
+            pc.location = location
+            if location is None:
+                self.logger.warning("Postal code %s (%s) - invalid location ('%s', '%s')",
+                                    pc.code, pc.country, item['longitude'], item['latitude'])
+
+            if pc.pk is None:
+                stats['created'] += 1
+                batch_created += 1
+                changed = True
             else:
-                pc.city = None
-
-            try:
-                pc.location = Point(float(item['longitude']), float(item['latitude']))
-            except Exception as e:
-                self.logger.warning("Postal code %s (%s) - invalid location ('%s', '%s'): %s",
-                                    pc.code, pc.country, item['longitude'],
-                                    item['latitude'], str(e))
-                pc.location = None
-
-            pc.save()
-
-            if not self.call_hook('postal_code_post', pc, item):
-                continue
-
-            self.logger.debug("Added postal code: %s, %s", pc.country, pc)
+                changed = obj_fingerprint(pc, postal_code_value_fields) != stored
+                if changed:
+                    stats['updated'] += 1
+                else:
+                    stats['unchanged'] += 1
+                    batch_unchanged += 1
+            if changed:
+                # New postal codes only get their id from the database, so
+                # their slugs are written for the whole batch at once
+                pc.save(defer_slug=True)
+            if postal_code_index is not None:
+                postal_code_index.update(pc)
+
+            batch.append((pc, item))
+            if len(batch) >= batch_size:
+                self.flush_postal_code_batch(batch, hooks, batch_created, batch_unchanged)
+                batch = []
+                batch_created = batch_unchanged = 0
+
+        self.flush_postal_code_batch(batch, hooks, batch_created, batch_unchanged)
+
+        return stats
+
+    def flush_postal_code_batch(self, batch, hooks, created, unchanged=0):
+        unslugged = [pc for pc, _ in batch if pc.slug is None]
+        for pc in unslugged:
+            pc.slug = slugify_func(pc, pc.slugify())
+        if unslugged:
+            PostalCode.objects.bulk_update(unslugged, ['slug'], batch_size=len(unslugged))
+
+        post, post_batch = hooks.get('post', []), hooks.get('post_batch', [])
+        if post or self.logger.isEnabledFor(logging.DEBUG):
+            for pc, item in batch:
+                if self.run_hooks(post, pc, as_item(item)):
+                    self.logger.debug("Added postal code: %s, %s", pc.country, pc)
+        if post_batch and batch:
+            self.run_hooks(post_batch, [pc for pc, _ in batch], [as_item(item) for _, item in batch])
+
+        self.rows_written(len(batch), created, unchanged)
+
+    def copy_postal_code(self, data):
+        self.warn_post_hooks_skipped('postal_code')
+
+        def rows():
+            for row_id, item in enumerate(self.apply_pre_hooks('postal_code', data)):
+                country_code = item['countryCode']
+                if country_code not in settings.postal_codes and 'ALL' not in settings.postal_codes:
+                    continue
 
-        if num_existing_postal_codes > 0 and max(query_statistics) > 0:
-            width = int(math.log10(max(query_statistics)))
+                code = item['postalCode']
+                if country_code not in self.country_index:
+                    self.logger.warning("Postal code '%s': Cannot find country: %s -- skipping", code, country_code)
+                    continue
 
-            stats_str = ""
-            for i, count in enumerate(query_statistics):
-                stats_str = "{{}}\n{{:>2}} [{{:>{}}}]: {{}}".format(width)\
-                    .format(stats_str, i, count,
-                            ''.join(['=' for i in range(count)]))
+                if VALIDATE_POSTAL_CODES and self.postal_code_regex_index[country_code].match(code) is None:
+                    self.logger.warning("Postal code didn't validate: {} ({})".format(code, country_code))
+                    continue
 
-                self.logger.info("Postal code query statistics:\n{}".format(stats_str))
+                longitude, latitude = item['longitude'], item['latitude']
+                if not isinstance(longitude, float) or not isinstance(latitude, float):
+                    self.logger.warning("Postal code %s (%s) - invalid location ('%s', '%s') -- skipping",
+                                        code, country_code, item['longitude'], item['latitude'])
+                    continue
 
-        if districts_to_delete:
-            self.logger.debug('districts to delete:\n{}'.format(districts_to_delete))
+                if len(item['placeName']) >= 200:
+                    self.logger.warning("Postal code name has more than 200 characters: {}".format(item))
+
+                yield (row_id, country_code, code, item['placeName'][:200],
+                       item['admin1Name'], item['admin2Name'], item['admin3Name'],
+                       longitude, latitude)
+
+        columns = [
+            ('row_id', 'bigint'),
+            ('country_code', 'text'),
+            ('code', 'text'),
+            ('name', 'text'),
+            ('region_name', 'text'),
+            ('subregion_name', 'text'),
+            ('district_name', 'text'),
+            ('longitude', 'double precision'),
+            ('latitude', 'double precision'),
+        ]
+
+        pc_opts = PostalCode._meta
+        staging_table = '{}_staging'.format(pc_opts.db_table)
+
+        with CopyLoader(router.db_for_write(PostalCode)) as loader:
+            quote = loader.quote
+            loader.create_staging_table(staging_table, columns)
+            loader.copy(staging_table, [name for name, _ in columns], rows())
+
+            # Postal codes have no unique key in the data, so rows are matched
+            # on their full natural key; the last duplicate in the file wins
+            key_columns = ['country', 'code', 'name', 'region_name', 'subregion_name', 'district_name']
+            value_columns = postal_code_value_fields
+            result = loader.execute("""
+                WITH src AS (
+                    SELECT DISTINCT ON (c.{pk}, s.code, s.name, s.region_name, s.subregion_name, s.district_name)
+                           s.row_id, c.{pk} AS country, s.code, s.name, s.region_name,
+                           s.subregion_name, s.district_name, r.{pk} AS region,
+                           sr.{pk} AS subregion, d.{pk} AS district, d.city AS city,
+                           ST_SetSRID(ST_MakePoint(s.longitude, s.latitude), {srid}) AS location
+                    FROM {staging} s
+                    JOIN {country} c ON c.{country_code} = s.country_code
+                    LEFT JOIN LATERAL (
+                        SELECT x.{pk} FROM {region} x
+                        WHERE x.{region_country} = c.{pk} AND s.region_name <> ''
+                          AND (UPPER(x.{region_name_std}) = UPPER(s.region_name)
+                               OR UPPER(x.{region_name}) = UPPER(s.region_name))
+                        ORDER BY x.{pk} LIMIT 1
+                    ) r ON true
+                    LEFT JOIN LATERAL (
+                        SELECT x.{pk} FROM {subregion} x
+                        WHERE x.{subregion_region} = r.{pk} AND s.subregion_name <> ''
+                          AND (UPPER(x.{subregion_name_std}) = UPPER(s.subregion_name)
+                               OR UPPER(x.{subregion_name}) = UPPER(s.subregion_name))
+                        ORDER BY x.{pk} LIMIT 1
+                    ) sr ON true
+                    LEFT JOIN LATERAL (
+                        SELECT x.{pk}, x.{district_city} AS city FROM {district} x
+                        JOIN {city} y ON y.{pk} = x.{district_city}
+                        WHERE y.{city_region} = r.{pk} AND s.district_name <> ''
+                          AND (UPPER(x.{district_name_std}) = UPPER(s.district_name)
+                               OR UPPER(x.{district_name}) = UPPER(s.district_name))
+                        ORDER BY x.{district_city}, x.{pk} LIMIT 1
+                    ) d ON true
+                    ORDER BY c.{pk}, s.code, s.name, s.region_name, s.subregion_name,
+                             s.district_name, s.row_id DESC
+                ), updated AS (
+                    UPDATE {postal_code} p SET {updates}
+                    FROM src
+                    WHERE {key_match} AND {changed}
+                    RETURNING src.row_id
+                ), inserted AS (
+                    INSERT INTO {postal_code} ({insert_columns})
+                    SELECT {select_columns} FROM src
+                    WHERE NOT EXISTS (SELECT 1 FROM {postal_code} p WHERE {key_match})
+                    RETURNING 1
+                )
+                SELECT (SELECT count(*) FROM inserted), (SELECT count(DISTINCT row_id) FROM updated),
+                       (SELECT count(*) FROM src) - (SELECT count(*) FROM inserted)
+                       - (SELECT count(DISTINCT row_id) FROM updated)
+            """.format(
+                postal_code=quote(pc_opts.db_table),
+                staging=quote(staging_table),
+                country=quote(Country._meta.db_table),
+                region=quote(Region._meta.db_table),
+                subregion=quote(Subregion._meta.db_table),
+                district=quote(District._meta.db_table),
+                city=quote(City._meta.db_table),
+                pk=quote('id'),
+                srid=int(pc_opts.get_field('location').srid),
+                country_code=quote(column(Country, 'code')),
+                region_country=quote(column(Region, 'country')),
+                region_name=quote(column(Region, 'name')),
+                region_name_std=quote(column(Region, 'name_std')),
+                subregion_region=quote(column(Subregion, 'region')),
+                subregion_name=quote(column(Subregion, 'name')),
+                subregion_name_std=quote(column(Subregion, 'name_std')),
+                district_city=quote(column(District, 'city')),
+                district_name=quote(column(District, 'name')),
+                district_name_std=quote(column(District, 'name_std')),
+                city_region=quote(column(City, 'region')),
+                updates=', '.join('{} = src.{}'.format(quote(column(PostalCode, c)), c)
+                                  for c in value_columns),
+                key_match=' AND '.join('p.{} = src.{}'.format(quote(column(PostalCode, c)), c)
+                                       for c in key_columns),
+                changed='({}) IS DISTINCT FROM ({})'.format(
+                    ', '.join(('ST_AsEWKB(p.{})' if c == 'location' else 'p.{}').format(
+                        quote(column(PostalCode, c))) for c in value_columns),
+                    ', '.join(('ST_AsEWKB(src.{})' if c == 'location' else 'src.{}').format(c)
+                              for c in value_columns)),
+                insert_columns=', '.join(quote(column(PostalCode, c)) for c in key_columns + value_columns),
+                select_columns=', '.join('src.{}'.format(c) for c in key_columns + value_columns),
+            ))
+
+            loader.update_slugs(PostalCode, ['code'])
+
+        self.count_rows(*result[0])
+        self.logger.info("Copied postal codes: %d added, %d updated, %d unchanged", *result[0])
 
     def flush_country(self):
         self.logger.info("Flushing country data")
@@ -1123,3 +2511,206 @@ class Command(BaseCommand):
                             desc="Flushing alternative names for {}".format(
                                 plural_type_name)):
                 obj.alt_names.all().delete()
+
+
+class PostalCodeIndex(object):
+    """
+    The existing postal codes of a country, indexed by code and by region
+    code, to match postal code rows against without querying the database.
+
+    ``match()`` tries the same tiers of natural keys, in the same order, as
+    the queries it replaces did. The first tier that matches exactly one
+    postal code wins, and a tier that matches several is an error.
+    """
+
+    def __init__(self, country):
+        self.country = country
+        self.by_code = {}
+        self.by_region_code = {}
+        queryset = PostalCode.objects.filter(country=country).annotate(
+            region_code=F('region__code'),
+            subregion_code=F('subregion__code'),
+            district_code=F('district__code'))
+        for pc in queryset.iterator():
+            self.by_code.setdefault(pc.code, []).append(pc)
+            self.by_region_code.setdefault(pc.region_code, []).append(pc)
+
+    def update(self, pc):
+        """Index a postal code that has just been created or updated."""
+        region_code = getattr(pc.region, 'code', None)
+        if not hasattr(pc, 'region_code'):
+            self.by_code.setdefault(pc.code, []).append(pc)
+            self.by_region_code.setdefault(region_code, []).append(pc)
+        elif pc.region_code != region_code:
+            self.by_region_code[pc.region_code].remove(pc)
+            self.by_region_code.setdefault(region_code, []).append(pc)
+        pc.region_code = region_code
+        pc.subregion_code = getattr(pc.subregion, 'code', None)
+        pc.district_code = getattr(pc.district, 'code', None)
+
+    def match(self, item, code, location):
+        """Return the matching tier and postal code, or (None, None)."""
+        region_name = item['admin1Name'].upper()
+        subregion_name = item['admin2Name'].upper()
+        district_name = item['admin3Name'].upper()
+
+        def in_admin_areas(pc):
+            return (pc.region_name.upper() == region_name or pc.region_code == item['admin1Code']) and \
+                (pc.subregion_name.upper() == subregion_name or pc.subregion_code == item['admin2Code']) and \
+                (pc.district_name.upper() == district_name or pc.district_code == item['admin3Code'])
+
+        coords = location.coords if location is not None else None
+        stripped_name = re.sub("'", '', item['placeName']).upper()
+        same_code = self.by_code.get(code, [])
+
+        tiers = (
+            (same_code, lambda pc: (in_admin_areas(pc) and pc.location is not None and
+                                    pc.location.coords == coords)),
+            (same_code, in_admin_areas),
+            (same_code, lambda pc: in_admin_areas(pc) and pc.name.upper() == stripped_name),
+            (self.by_region_code.get(item['admin1Code'], []), lambda pc: True),
+            (same_code, lambda pc: (pc.name == item['placeName'] and
+                                    pc.region_code == item['admin1Code'] and
+                                    pc.subregion_code == item['admin2Code'])),
+            (same_code, lambda pc: (pc.name == item['placeName'] and
+                                    pc.region_code == item['admin1Code'] and
+                                    pc.subregion_code == item['admin2Code'] and
+                                    pc.district_code == item['admin3Code'])),
+            (same_code, lambda pc: (pc.name == item['placeName'] and
+                                    pc.region_name == item['admin1Name'] and
+                                    pc.subregion_name == item['admin2Name'])),
+            (same_code, lambda pc: (pc.name == item['placeName'] and
+                                    pc.region_name == item['admin1Name'] and
+                                    pc.subregion_name == item['admin2Name'] and
+                                    pc.district_name == item['admin3Name'])),
+        )
+        for tier, (candidates, matches) in enumerate(tiers):
+            found = [pc for pc in candidates if matches(pc)]
+            if len(found) == 1:
+                return tier, found[0]
+            elif len(found) > 1:
+                raise PostalCode.MultipleObjectsReturned(
+                    "Postal code {} matches {} postal codes: {}".format(
+                        item, len(found), [pc.pk for pc in found]))
+        return None, None
+
+
+class AdminAreaIndex(object):
+    """
+    The regions, subregions and districts of a country by casefolded name and
+    standard name, to resolve the admin areas that postal codes name.
+
+    Subregions and districts are looked up together with the name of their
+    region. A name that matches several regions or subregions is an error.
+    For districts the lowest id wins if the districts that match all belong
+    to the same city; the others are reported as duplicates.
+    """
+
+    def __init__(self, country):
+        self.country = country
+        self.regions = {}
+        self.subregions = {}
+        self.districts = {}
+
+        region_names = {}
+        for region in Region.objects.filter(country=country):
+            region_names[region.id] = self.names(region.name, region.name_std)
+            for name in region_names[region.id]:
+                self.regions.setdefault(name, []).append(region)
+
+        for subregion in Subregion.objects.filter(region__country=country):
+            for region_name in region_names.get(subregion.region_id, ()):
+                for name in self.names(subregion.name, subregion.name_std):
+                    self.subregions.setdefault((region_name, name), []).append(subregion)
+
+        districts = District.objects.filter(city__country=country).defer('location').annotate(
+            city_region_name=F('city__region__name'),
+            city_region_name_std=F('city__region__name_std'))
+        for district in districts.iterator():
+            for region_name in self.names(district.city_region_name, district.city_region_name_std):
+                for name in self.names(district.name, district.name_std):
+                    self.districts.setdefault((region_name, name), []).append(district)
+
+    @staticmethod
+    def names(*names):
+        return set(name.casefold() for name in names if name is not None)
+
+    def get_region(self, name):
+        if not name:
+            return None
+        found = self.regions.get(name.casefold(), [])
+        if len(found) > 1:
+            raise Region.MultipleObjectsReturned(
+                "{} regions of {} are named {}".format(len(found), self.country, name))
+        return found[0] if found else None
+
+    def get_subregion(self, region_name, name):
+        if not name:
+            return None
+        found = self.subregions.get((region_name.casefold(), name.casefold()), [])
+        if len(found) > 1:
+            raise Subregion.MultipleObjectsReturned(
+                "{} subregions of {}, {} are named {}".format(len(found), region_name, self.country, name))
+        return found[0] if found else None
+
+    def get_district(self, region_name, name):
+        """Return the district and the ids of any duplicates of it."""
+        if not name:
+            return None, []
+        found = sorted(self.districts.get((region_name.casefold(), name.casefold()), []),
+                       key=lambda district: district.id)
+        if len(set(district.city_id for district in found)) > 1:
+            raise District.MultipleObjectsReturned(
+                "Districts of different cities in {}, {} are named {}: {}".format(
+                    region_name, self.country, name, [district.id for district in found]))
+        if not found:
+            return None, []
+        return found[0], [district.id for district in found[1:]]
+
+
+def empty_postal_code_stats():
+    return {
+        'created': 0,
+        'updated': 0,
+        'unchanged': 0,
+        'skipped': 0,
+        'query_statistics': [0 for i in range(8)],
+        'districts_to_delete': [],
+    }
+
+
+def merge_postal_code_stats(stats, other):
+    for key in ('created', 'updated', 'unchanged', 'skipped'):
+        stats[key] += other[key]
+    stats['query_statistics'] = [a + b for a, b in zip(stats['query_statistics'],
+                                                       other['query_statistics'])]
+    stats['districts_to_delete'].extend(other['districts_to_delete'])
+
+
+# Postal code worker processes: each process keeps one Command instance, with
+# its own database connection and indexes, for all of the shards it imports
+_postal_code_worker = None
+
+
+def init_postal_code_worker(options):
+    global _postal_code_worker
+
+    import django
+    django.setup()
+    connections.close_all()
+
+    command = Command()
+    command.download_cache = {}
+    command.options = dict(options, quiet=True)
+    command.force = options['force']
+    command.limit_query_logs()
+    command.build_country_index()
+    if VALIDATE_POSTAL_CODES:
+        command.build_postal_code_regex_index()
+    _postal_code_worker = command
+
+
+def import_postal_code_shard(path):
+    with transaction.atomic():
+        return _postal_code_worker.load_postal_codes(
+            _postal_code_worker.get_shard_data('postal_code', path))
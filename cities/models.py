@@ -25,7 +25,7 @@ from .util import unicode_func
 
 __all__ = [
     'Point', 'Continent', 'Country', 'Region', 'Subregion', 'City', 'District',
-    'PostalCode', 'AlternativeName',
+    'PostalCode', 'AlternativeName', 'ImportState', 'ImportRun',
 ]
 
 
@@ -54,10 +54,13 @@ class SlugModel(models.Model):
         raise NotImplementedError("Subclasses of Place must implement slugify()")
 
     def save(self, *args, **kwargs):
+        # With defer_slug=True a new object whose slug contains its ID is
+        # saved once, without a slug: the caller fills the slug in later
+        defer_slug = kwargs.pop('defer_slug', False)
         self.slug = slugify_func(self, self.slugify())
         # If the slug contains the object's ID and we are creating a new object,
         # save it twice: once to get an ID, another to set the object's slug
-        if self.slug is None and getattr(self, 'slug_contains_id', False):
+        if self.slug is None and getattr(self, 'slug_contains_id', False) and not defer_slug:
             with transaction.atomic():
                 # We first give a randomized slug with a prefix just in case
                 # users need to find invalid slugs
@@ -376,3 +379,28 @@ class PostalCode(Place, SlugModel):
         if self.id:
             return '{}-{}'.format(self.id, unicode_func(self.code))
         return None
+
+
+class ImportState(models.Model):
+    """Bookkeeping that the import command keeps between runs."""
+    key = models.CharField(max_length=100, unique=True)
+    value = models.CharField(max_length=255)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "%s: %s" % (self.key, self.value)
+
+
+class ImportRun(models.Model):
+    """Statistics of an import, saved by the import command with --record-run."""
+    started = models.DateTimeField()
+    finished = models.DateTimeField()
+    status = models.CharField(max_length=20)
+    # The report that --stats-file writes, as JSON
+    stats = models.TextField()
+
+    class Meta:
+        ordering = ['-started']
+
+    def __str__(self):
+        return "%s: %s" % (self.started, self.status)
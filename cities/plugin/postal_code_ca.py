@@ -16,8 +16,7 @@ code_map = {
 
 
 class Plugin:
-    def postal_code_pre(self, parser, item):
-        country_code = item['countryCode']
-        if country_code != 'CA':
-            return
-        item['admin1Code'] = code_map[item['admin1Code']]
+    def postal_code_pre_batch(self, parser, items):
+        for item in items:
+            if item['countryCode'] == 'CA':
+                item['admin1Code'] = code_map[item['admin1Code']]
@@ -1,41 +1,21 @@
 # -*- coding: utf-8 -*-
 
-"""Call django.db.reset_queries randomly. Default chance is 0.000002 (0.0002%).
-
-This plugin may be useful when processing all geonames database.
-To process all geonames database and include cities that do not specify population
-or when their population is less than 1000 people use following settings:
-
-CITIES_FILES = {
-    'city': {
-       'filename': 'allCountries.zip',
-       'urls':     ['http://download.geonames.org/export/dump/'+'{filename}']
-    },
-}
-
-Settings variable CITIES_PLUGINS_RESET_QUERIES_CHANCE may be used to override
-default chance:
-
-CITIES_PLUGINS_RESET_QUERIES_CHANCE = 1.0 / 1000000
+"""Deprecated: this plugin used to call django.db.reset_queries randomly, to
+keep the query log from using up memory when DEBUG is on.
 
+The cities command now limits the query log of every database connection
+itself while it imports (see its --query-log option), and frees memory when
+it uses more than --max-memory, so this plugin does nothing any more. Remove
+it from CITIES_PLUGINS.
 """
 
-import random
-
-from django.db import reset_queries
-from django.conf import settings
-
-reset_chance = getattr(settings, 'CITIES_PLUGINS_RESET_QUERIES_CHANCE', 0.000002)
+import warnings
 
 
 class Plugin:
 
-    def random_reset(self):
-        if random.random() <= reset_chance:
-            reset_queries()
-
-    def city_post(self, parser, city, item):
-        self.random_reset()
-
-    def district_post(self, parser, district, item):
-        self.random_reset()
+    def __init__(self):
+        warnings.warn(
+            "cities.plugin.reset_queries.Plugin is deprecated and does nothing: the cities "
+            "command limits query logs itself. Remove it from CITIES_PLUGINS.",
+            DeprecationWarning)
@@ -0,0 +1,164 @@
+"""
+Light-weight records for the rows of GeoNames' tab-separated data files.
+"""
+
+import sys
+from operator import itemgetter
+
+
+# Columns that are converted once, when a row is parsed. Values that don't
+# convert are left as they are, for the import stages to report
+INT_FIELDS = {'geonameid', 'nameid', 'parent', 'child', 'population', 'elevation'}
+FLOAT_FIELDS = {'latitude', 'longitude'}
+
+# Columns with few distinct values, which are interned so that every row
+# shares the same string objects
+INTERNED_FIELDS = {
+    'featureClass', 'featureCode', 'countryCode', 'cc2', 'timezone', 'language',
+    'admin1Code', 'admin2Code', 'admin3Code', 'admin4Code',
+    'admin1Name', 'admin2Name', 'admin3Name',
+}
+
+_missing = object()
+
+
+class Record(object):
+    """
+    The values of some of the fields of a row, which can be read like the
+    dicts that ``Command.get_data()`` yields: ``record['name']``,
+    ``record.get('name')``, ``'name' in record``.
+
+    ``as_dict()`` returns the whole row as such a dict, with every field as
+    a string, for plugins. It is built from the line the record was parsed
+    from when it is first asked for, so only records that keep their line
+    have one; the others only have their own fields.
+    """
+
+    __slots__ = ('values', 'row')
+
+    # Set on the subclass that RecordParser creates for its fields
+    fields = ()
+    all_fields = ()
+    index = {}
+    conversions = ()
+
+    def __init__(self, values, row=None):
+        self.values = values
+        self.row = row
+
+    @classmethod
+    def convert(cls, values):
+        for i, convert in cls.conversions:
+            value = values[i]
+            if value is not _missing:
+                try:
+                    values[i] = convert(value)
+                except (TypeError, ValueError):
+                    pass
+
+    @classmethod
+    def from_dict(cls, row):
+        """
+        The record of a row that plugins got, and maybe changed, as a dict.
+        Its ``as_dict()`` is that dict.
+        """
+        values = [row.get(field, _missing) for field in cls.fields]
+        cls.convert(values)
+        return cls(values, row)
+
+    def __getitem__(self, key):
+        value = self.values[self.index[key]]
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self.index and self.values[self.index[key]] is not _missing
+
+    def keys(self):
+        return [field for field in self.fields if field in self]
+
+    def as_dict(self):
+        if self.row is None:
+            return dict((field, self[field]) for field in self.keys())
+        if not isinstance(self.row, dict):
+            self.row = dict(zip(self.all_fields, self.row.split('\t')))
+        return self.row
+
+    def __repr__(self):
+        return '<Record {!r}>'.format(dict((field, self[field]) for field in self.keys()))
+
+
+class RecordParser(object):
+    """
+    Parse lines of a data file with the columns ``all_fields`` into records
+    of only ``fields``. With ``keep_line`` the records keep the line too, for
+    ``as_dict()``.
+    """
+
+    def __init__(self, all_fields, fields, keep_line=False):
+        self.keep_line = keep_line
+        self.fields = tuple(fields)
+        self.indexes = [all_fields.index(field) for field in self.fields]
+        if len(self.indexes) == 1:
+            index = self.indexes[0]
+            self.project = lambda columns: [columns[index]]
+        else:
+            getter = itemgetter(*self.indexes)
+            self.project = lambda columns: list(getter(columns))
+
+        conversions = []
+        for i, field in enumerate(self.fields):
+            if field in INT_FIELDS:
+                conversions.append((i, int))
+            elif field in FLOAT_FIELDS:
+                conversions.append((i, float))
+            elif field in INTERNED_FIELDS:
+                conversions.append((i, sys.intern))
+
+        self.record_class = type('Record', (Record,), {
+            '__slots__': (),
+            'fields': self.fields,
+            'all_fields': tuple(all_fields),
+            'index': dict((field, i) for i, field in enumerate(self.fields)),
+            'conversions': tuple(conversions),
+        })
+
+    def __call__(self, line):
+        columns = line.split('\t')
+        try:
+            values = self.project(columns)
+        except IndexError:
+            # A short row: its last fields are missing, as they would be
+            # from a dict
+            values = [columns[i] if i < len(columns) else _missing for i in self.indexes]
+
+        self.record_class.convert(values)
+        return self.record_class(values, line if self.keep_line else None)
+
+
+def country_filter(all_fields, field, countries):
+    """
+    A test for raw lines of a data file with the columns ``all_fields``,
+    which accepts the lines whose ``field`` holds one of the country codes
+    ``countries``, or starts with one followed by a '.' (as region and
+    subregion codes do).
+
+    Lines are tested as bytes, before they are decoded or parsed.
+    """
+    index = all_fields.index(field)
+    codes = frozenset(code.encode('ascii') for code in countries)
+
+    def accept(line):
+        columns = line.split(b'\t', index + 1)
+        if len(columns) <= index:
+            return False
+        return columns[index].split(b'.', 1)[0].rstrip(b'\r\n') in codes
+
+    return accept
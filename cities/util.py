@@ -1,8 +1,12 @@
+import os
 import re
 import six
 import sys
 import unicodedata
-from math import radians, sin, cos, acos
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from math import radians, sin, cos, acos, floor
 from django import VERSION as DJANGO_VERSION
 
 if DJANGO_VERSION < (4, 0):
@@ -39,6 +43,136 @@ def geo_distance(a, b):
     return acos(cos_x) * earth_radius_km
 
 
+def unit_vector(p):
+    """Coordinates of a geo point on the unit sphere. (p.x = long, p.y = lat)"""
+    lat = radians(p.y)
+    lng = radians(p.x)
+    return (cos(lat) * cos(lng), cos(lat) * sin(lng), sin(lat))
+
+
+class NearestIndex(object):
+    """
+    Find the nearest of a set of geo points, up to ``max_distance`` km away.
+
+    Points are bucketed in a grid over their coordinates on the unit sphere,
+    with cells as wide as the straight-line distance that corresponds to
+    ``max_distance``, so only the 27 cells around a point need searching.
+    Straight-line distances order points the same way great-circle distances
+    do, and are much cheaper to compute.
+    """
+
+    def __init__(self, max_distance):
+        self.cell_size = 2 * sin(min(max_distance / (2 * earth_radius_km), 1.5))
+        self.cells = defaultdict(list)
+
+    def __len__(self):
+        return sum(len(cell) for cell in self.cells.values())
+
+    def cell(self, v):
+        return tuple(int(floor(c / self.cell_size)) for c in v)
+
+    def add(self, point, value):
+        v = unit_vector(point)
+        self.cells[self.cell(v)].append((v, value))
+
+    def nearest(self, point):
+        """The value added with the point nearest to ``point``, or None."""
+        v = unit_vector(point)
+        x, y, z = self.cell(v)
+        nearest = None
+        min_dist = self.cell_size ** 2
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for dz in (-1, 0, 1):
+                    for w, value in self.cells.get((x + dx, y + dy, z + dz), ()):
+                        dist = (v[0] - w[0]) ** 2 + (v[1] - w[1]) ** 2 + (v[2] - w[2]) ** 2
+                        if dist < min_dist or (nearest is None and dist == min_dist):
+                            nearest = value
+                            min_dist = dist
+        return nearest
+
+
+class IdSet(object):
+    """
+    A set of integer ids kept in a sorted array of 64-bit integers, which
+    takes a fraction of the memory of a Python set. Lookups use bisection.
+    """
+
+    def __init__(self, ids=()):
+        self.ids = array('q', ids)
+        if any(self.ids[i] > self.ids[i + 1] for i in range(len(self.ids) - 1)):
+            self.ids = array('q', sorted(self.ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id_):
+        i = bisect_left(self.ids, id_)
+        return i < len(self.ids) and self.ids[i] == id_
+
+
+class IdMap(object):
+    """
+    A mapping of integer ids to integer ids kept in two parallel arrays of
+    64-bit integers, sorted by key, which takes a fraction of the memory of
+    a dict. Lookups use bisection. As with a dict, the last value given for
+    a key wins.
+    """
+
+    def __init__(self, items=()):
+        keys = array('q')
+        values = array('q')
+        for key, value in items:
+            keys.append(key)
+            values.append(value)
+        # A stable sort, so the values of a key stay in the order they came in
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.keys = array('q', (keys[i] for i in order))
+        self.values = array('q', (values[i] for i in order))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        i = bisect_right(self.keys, key)
+        return i > 0 and self.keys[i - 1] == key
+
+    def __getitem__(self, key):
+        i = bisect_right(self.keys, key)
+        if i > 0 and self.keys[i - 1] == key:
+            return self.values[i - 1]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+# MEMORY USE
+
+def get_rss():
+    """
+    The resident set size of this process in bytes. Where the current size
+    is unknown this is the peak size so far, and None if that isn't known
+    either.
+    """
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes, except on macOS
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
 # ADD CONTINENTS FUNCTION
 
 def add_continents(continent_model):
@@ -20,7 +20,7 @@ setup(
     author='Ben Dowling',
     author_email='ben.m.dowling@gmail.com',
     url='https://github.com/coderholic/django-cities',
-    packages=find_packages(exclude=['example']),
+    packages=find_packages(exclude=['example', 'benchmarks', 'benchmarks.*']),
     install_requires=[
         'django-model-utils',
         'six',
@@ -194,7 +194,19 @@ CITIES_FILES = {
     'postal_code': {
         'filename': 'allCountries.txt',
         'urls': [url_base + '{filename}', ],
-    }
+    },
+    'modifications': {
+        'urls': [url_base + '{filename}', ],
+    },
+    'deletes': {
+        'urls': [url_base + '{filename}', ],
+    },
+    'alt_name_modifications': {
+        'urls': [url_base + '{filename}', ],
+    },
+    'alt_name_deletes': {
+        'urls': [url_base + '{filename}', ],
+    },
 }
 
 CITIES_LOCALES = ['en', 'und', 'link']
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import os
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from cities.management.commands.cities import Command
+from cities.models import AlternativeName, City, Country, District, Region, Subregion
+
+
+class AltNameLinksTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super(AltNameLinksTestCase, cls).setUpTestData()
+        call_command('cities', force=True, **{
+            'import': 'country,region,subregion,city,district,alt_name',
+        })
+
+    def get_links(self):
+        """The (place id, alternative name id) rows of every M2M table."""
+        links = []
+        for model in (Country, Region, Subregion, City, District):
+            field = model._meta.get_field('alt_names')
+            links.extend(field.remote_field.through.objects.values_list(
+                field.m2m_field_name() + '_id', field.m2m_reverse_field_name() + '_id'))
+        return sorted(links)
+
+    def get_expected_links(self):
+        # Adding every imported name to the place of its row, one at a time
+        alt_ids = set(AlternativeName._base_manager.values_list('id', flat=True))
+        links = set()
+        with io.open(os.path.join(Command.data_dir, 'alternateNames.txt'), encoding='utf-8') as fp:
+            for line in fp:
+                nameid, geonameid = line.split('\t')[:2]
+                if int(nameid) in alt_ids:
+                    links.add((int(geonameid), int(nameid)))
+        return sorted(links)
+
+    def test_links(self):
+        links = self.get_links()
+
+        self.assertGreater(len(links), 0)
+        self.assertEqual(links, self.get_expected_links())
+
+    def test_links_on_reimport(self):
+        links = self.get_links()
+
+        call_command('cities', force=True, **{
+            'import': 'alt_name',
+        })
+
+        # Existing links are kept, and not added again
+        self.assertEqual(self.get_links(), links)
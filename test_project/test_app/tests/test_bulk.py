@@ -0,0 +1,141 @@
+from django.contrib.gis.geos import Point
+from django.test import SimpleTestCase
+
+from cities.bulk import BulkUpserter, fingerprint, obj_fingerprint
+from cities.models import PostalCode, slugify_func
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+FIELDS = ['code', 'name', 'region', 'location']
+
+
+class FingerprintTestCase(SimpleTestCase):
+    def get_postal_code(self, **kwargs):
+        return PostalCode(**dict({
+            'code': 'AD500',
+            'name': 'Andorra la Vella',
+            'region_id': 3041565,
+            'location': Point(1.52109, 42.50779),
+        }, **kwargs))
+
+    def test_same_values(self):
+        pc = self.get_postal_code()
+        stored = self.get_postal_code(location=Point(1.52109, 42.50779, srid=4326))
+
+        self.assertEqual(len(obj_fingerprint(pc, FIELDS)), 8)
+        self.assertEqual(obj_fingerprint(pc, FIELDS), obj_fingerprint(stored, FIELDS))
+
+    def test_changed_values(self):
+        pc = self.get_postal_code()
+
+        for changes in ({'name': 'Andorra'}, {'region_id': None},
+                        {'location': Point(1.52109, 42.5078)}):
+            self.assertNotEqual(obj_fingerprint(pc, FIELDS),
+                                obj_fingerprint(self.get_postal_code(**changes), FIELDS))
+
+    def test_only_named_fields(self):
+        pc = self.get_postal_code()
+
+        self.assertEqual(obj_fingerprint(pc, ['code', 'location']),
+                         obj_fingerprint(self.get_postal_code(name='Andorra'), ['code', 'location']))
+
+    def test_values_are_normalized(self):
+        region = PostalCode._meta.get_field('region')
+
+        self.assertEqual(fingerprint([region], ['3041565']), fingerprint([region], [3041565]))
+
+
+class BulkUpserterTestCase(SimpleTestCase):
+    def test_unchanged_rows_are_not_written(self):
+        done, written = [], []
+        upserter = BulkUpserter(PostalCode, on_done=lambda *args: done.append(args))
+        for pk in (1, 2, 3):
+            upserter.add(PostalCode(id=pk, code=str(pk), name='Place', location=Point(1, 2)),
+                         ['code', 'name', 'location'])
+
+        stored = PostalCode(id=1, code='1', name='Place', location=Point(1, 2, srid=4326))
+        stored.slug = slugify_func(stored, stored.slugify())
+        existing = {
+            1: obj_fingerprint(stored, ['code', 'name', 'location', 'slug']),
+            2: obj_fingerprint(stored, ['code']),
+        }
+        with mock.patch.object(BulkUpserter, 'existing_rows', return_value=existing), \
+                mock.patch.object(BulkUpserter, 'write',
+                                  side_effect=lambda objs, fields, existing: written.extend(objs)):
+            upserter.flush()
+
+        self.assertEqual([obj.pk for obj in written], [2, 3])
+        self.assertEqual(done, [(3, 1, 1)])
+
+
+class BulkUpserterWriteTestCase(SimpleTestCase):
+    def setUp(self):
+        self.manager = mock.Mock()
+        patcher = mock.patch.object(BulkUpserter, 'manager', new_callable=mock.PropertyMock,
+                                    return_value=self.manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_upserter(self, supports_upsert, **kwargs):
+        patcher = mock.patch.object(BulkUpserter, 'supports_upsert', new_callable=mock.PropertyMock,
+                                    return_value=supports_upsert)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return BulkUpserter(PostalCode, batch_size=10, **kwargs)
+
+    def get_postal_code(self, pk):
+        return PostalCode(id=pk, code=str(pk), name='Place', location=Point(1, 2))
+
+    def test_new_and_existing_rows_without_upsert(self):
+        saved = []
+        upserter = self.get_upserter(False, on_save=lambda obj, item, created: saved.append((obj.pk, created)))
+        objs = [self.get_postal_code(pk) for pk in (1, 2, 3)]
+        for obj in objs:
+            upserter.add(obj, ['code', 'name', 'location'])
+
+        # The stored row of 2 has other values
+        with mock.patch.object(BulkUpserter, 'existing_rows', return_value={2: b'changed!'}):
+            upserter.flush()
+
+        self.manager.bulk_create.assert_called_once_with([objs[0], objs[2]], batch_size=10)
+        self.manager.bulk_update.assert_called_once_with([objs[1]], ['code', 'name', 'location', 'slug'],
+                                                         batch_size=10)
+        self.assertFalse(objs[1]._state.adding)
+        self.assertEqual(objs[1]._state.db, 'default')
+        self.assertEqual(saved, [(1, True), (2, False), (3, True)])
+
+    def test_existing_rows_by_fields_without_upsert(self):
+        upserter = self.get_upserter(False)
+        objs = [self.get_postal_code(pk) for pk in (1, 2)]
+        upserter.add(objs[0], ['code'])
+        upserter.add(objs[1], ['code', 'name'])
+
+        with mock.patch.object(BulkUpserter, 'existing_rows', return_value={1: b'changed!', 2: b'changed!'}):
+            upserter.flush()
+
+        self.manager.bulk_create.assert_not_called()
+        self.assertEqual(self.manager.bulk_update.call_args_list, [
+            mock.call([objs[0]], ['code', 'slug'], batch_size=10),
+            mock.call([objs[1]], ['code', 'name', 'slug'], batch_size=10),
+        ])
+
+    def test_upsert(self):
+        upserter = self.get_upserter(True)
+        objs = [self.get_postal_code(pk) for pk in (1, 2)]
+        for obj in objs:
+            upserter.add(obj, ['code', 'name'])
+
+        features = mock.Mock(supports_update_conflicts_with_target=True)
+        with mock.patch.object(BulkUpserter, 'existing_rows', return_value={2: b'changed!'}), \
+                mock.patch.object(BulkUpserter, 'connection', new_callable=mock.PropertyMock,
+                                  return_value=mock.Mock(features=features)):
+            upserter.flush()
+
+        self.manager.bulk_create.assert_called_once_with(
+            objs, batch_size=10, update_conflicts=True, update_fields=['code', 'name', 'slug'],
+            unique_fields=['id'])
+        self.manager.bulk_update.assert_not_called()
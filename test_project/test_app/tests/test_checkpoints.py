@@ -0,0 +1,91 @@
+import io
+import os
+import shutil
+import tempfile
+from collections import defaultdict
+
+from django.test import SimpleTestCase
+
+from cities.management.commands import cities as cities_command
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class DropParisPlugin(object):
+    def city_pre_batch(self, parser, items):
+        return [item for item in items if item['name'] != 'Paris']
+
+
+class CheckpointTestCase(SimpleTestCase):
+    names = ['Andorra la Vella', 'Paris', 'New York City', 'Kyiv', 'Lviv', 'Odesa', 'Kharkiv']
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        with io.open(os.path.join(self.data_dir, 'cities.txt'), 'w', encoding='utf-8') as fp:
+            fp.write('# comment\n')
+            for geonameid, name in enumerate(self.names, 1):
+                fp.write(u'{}\t{}\n'.format(geonameid, name))
+
+        # Look up the settings and command class at test time, as the command
+        # module is reloaded when some settings change
+        plugins = defaultdict(list, city_pre_batch=[DropParisPlugin()])
+        for patcher in (mock.patch.object(cities_command.settings, 'plugins', plugins, create=True),
+                        mock.patch.object(cities_command.Command, 'get_filenames', return_value=['cities.txt'])):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_command(self, saved=None):
+        command = cities_command.Command()
+        command.data_dir = self.data_dir
+        command.options = {'quiet': True, 'batch_size': 4, 'commit_every': 2}
+        command.checkpoint = {'import': 'city', 'filekey': 'city', 'source': 'test',
+                              'rows': 0, 'skip': 0, 'batch': None, 'skip_items': 0, 'state': {}}
+        if saved is not None:
+            command.checkpoint.update(rows=saved['rows'], skip=saved['rows'], skip_items=saved['items'])
+        command.chunk_transaction = mock.Mock()
+        command.rows_since_commit = 0
+        command.end_chunk = command.begin_chunk = mock.Mock()
+        command.save_checkpoint = mock.Mock()
+        return command
+
+    def import_cities(self, command, interrupt_after=None):
+        imported = []
+        for item in command.apply_pre_hooks('city', command.get_data('city')):
+            imported.append(item['name'])
+            command.rows_written(1)
+            if command.save_checkpoint.call_count == interrupt_after:
+                break
+        return imported
+
+    def test_resume_with_batch_hooks(self):
+        command = self.get_command()
+        # The first commit is in the middle of the first batch, which was
+        # read ahead
+        imported = self.import_cities(command, interrupt_after=1)
+        (import_, saved), _ = command.save_checkpoint.call_args
+
+        self.assertEqual(imported, ['Andorra la Vella', 'New York City'])
+        self.assertEqual(saved, {'rows': 0, 'items': 2, 'source': 'test', 'state': {}})
+
+        # The second commit is in the second batch, after all of the first
+        command = self.get_command(saved)
+        imported = self.import_cities(command, interrupt_after=1)
+        (import_, saved), _ = command.save_checkpoint.call_args
+
+        self.assertEqual(imported, ['Kyiv', 'Lviv'])
+        self.assertEqual(saved, {'rows': 4, 'items': 1, 'source': 'test', 'state': {}})
+
+        self.assertEqual(self.import_cities(self.get_command(saved)), ['Odesa', 'Kharkiv'])
+
+    def test_checkpoint_without_read_ahead(self):
+        command = self.get_command()
+        with mock.patch.object(cities_command.settings, 'plugins', defaultdict(list), create=True):
+            imported = self.import_cities(command, interrupt_after=1)
+        (import_, saved), _ = command.save_checkpoint.call_args
+
+        self.assertEqual(imported, ['Andorra la Vella', 'Paris'])
+        self.assertEqual(saved, {'rows': 2, 'items': 0, 'source': 'test', 'state': {}})
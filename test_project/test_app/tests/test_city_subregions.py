@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from cities.management.commands.cities import Command, import_fields
+from cities.models import City
+
+
+class CitySubregionTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super(CitySubregionTestCase, cls).setUpTestData()
+        call_command('cities', force=True, **{
+            'import': 'country,region,subregion',
+        })
+
+    def import_cities(self, admin2_codes):
+        """Import a copy of Almería for every admin2 code, with ids from 90000001 on."""
+        data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_dir)
+        with io.open(os.path.join(data_dir, 'cities.txt'), 'w', encoding='utf-8') as fp:
+            for city_id, admin2_code in enumerate(admin2_codes, 90000001):
+                fp.write('\t'.join([
+                    str(city_id), 'Almería', 'Almeria', '', '36.83814', '-2.45974', 'P', 'PPLA2', 'ES', '',
+                    '51', admin2_code, '04013', '', '188810', '21', '21', 'Europe/Madrid', '2013-03-02',
+                ]) + '\n')
+
+        command = Command()
+        command.data_dir = data_dir
+        command.options = {'quiet': True}
+        command.import_city(command.get_data('city', filenames=['cities.txt'], fields=import_fields['city']))
+        return dict(City.objects.filter(id__gte=90000001).values_list('id', 'subregion_id'))
+
+    def test_subregion_by_code(self):
+        self.assertEqual(self.import_cities(['AL']), {90000001: 2521883})
+
+    def test_subregion_by_name(self):
+        subregions = self.import_cities(['Almería', 'Almeria', 'Almería (undefined)', 'Almeria (undefined)'])
+
+        # By name, by standard name, and either without ' (undefined)'
+        self.assertEqual(subregions, {90000001: 2521883, 90000002: 2521883,
+                                      90000003: 2521883, 90000004: 2521883})
+
+    def test_subregion_not_found(self):
+        self.assertEqual(self.import_cities(['XX', 'Nowhere', '']),
+                         {90000001: None, 90000002: None, 90000003: None})
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+
+from cities.models import City, PostalCode
+
+
+@skipUnless(connection.vendor == 'postgresql', "--loader=copy is only supported on PostgreSQL")
+class CopyLoaderTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super(CopyLoaderTestCase, cls).setUpTestData()
+        call_command('cities', force=True, **{
+            'import': 'country,region,subregion',
+        })
+
+    def import_cities_and_postal_codes(self, loader):
+        """Import cities and postal codes and return the statistics of their stages."""
+        stats_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, stats_dir)
+        stats_file = os.path.join(stats_dir, 'stats.json')
+        call_command('cities', force=True, loader=loader, stats_file=stats_file, **{
+            'import': 'city,postal_code',
+        })
+        with io.open(stats_file, encoding='utf-8') as fp:
+            return {stage['stage']: stage for stage in json.load(fp)['stages']}
+
+    def get_cities(self):
+        return [(city.id, city.name, city.name_std, city.kind, city.country_id, city.region_id,
+                 city.subregion_id, city.location.coords, city.population, city.elevation,
+                 city.timezone, city.slug)
+                for city in City.objects.order_by('id')]
+
+    def get_postal_codes(self):
+        # Postal code ids are assigned by the database, so they are compared
+        # on everything else
+        return set((pc.country_id, pc.code, pc.name, pc.region_name, pc.subregion_name,
+                    pc.district_name, pc.region_id, pc.subregion_id, pc.district_id, pc.city_id,
+                    pc.location.coords)
+                   for pc in PostalCode.objects.all())
+
+    def test_same_as_orm_loader(self):
+        self.import_cities_and_postal_codes('orm')
+        cities, postal_codes = self.get_cities(), self.get_postal_codes()
+        self.assertGreater(len(cities), 0)
+        self.assertGreater(len(postal_codes), 0)
+
+        PostalCode.objects.all().delete()
+        City.objects.all().delete()
+        self.import_cities_and_postal_codes('copy')
+
+        self.assertEqual(self.get_cities(), cities)
+        self.assertEqual(self.get_postal_codes(), postal_codes)
+        self.assertFalse(PostalCode.objects.filter(slug__isnull=True).exists())
+
+    def test_unchanged_rows(self):
+        self.import_cities_and_postal_codes('copy')
+        pks = set(PostalCode.objects.values_list('pk', flat=True))
+
+        stats = self.import_cities_and_postal_codes('copy')
+
+        for stage, model in (('import_city', City), ('import_postal_code', PostalCode)):
+            self.assertEqual(stats[stage]['rows_created'], 0)
+            self.assertEqual(stats[stage]['rows_updated'], 0)
+            self.assertEqual(stats[stage]['rows_unchanged'], model.objects.count())
+        self.assertEqual(set(PostalCode.objects.values_list('pk', flat=True)), pks)
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from django.test import SimpleTestCase
+
+from cities.management.commands import cities as cities_command
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class GeoNamesHandler(BaseHTTPRequestHandler):
+    """Serves ``server.files`` the way download.geonames.org does."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        content = self.server.files.get(self.path.lstrip('/'))
+        if content is None:
+            self.send_error(404)
+            return
+
+        etag = '"{}"'.format(hashlib.md5(content).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        status, start = 200, 0
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range') == etag:
+            start = int(range_header.split('=')[1].rstrip('-'))
+            status = 206
+        body = content[start:]
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        if status == 206:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(content) - 1, len(content)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class DownloadTestCase(SimpleTestCase):
+    filename = 'countryInfo.txt'
+    content = b''.join(b'AD\tAND\t020\tAN\tAndorra\tAndorra la Vella\n' for _ in range(1000))
+
+    @classmethod
+    def setUpClass(cls):
+        super(DownloadTestCase, cls).setUpClass()
+        cls.server = HTTPServer(('127.0.0.1', 0), GeoNamesHandler)
+        cls.server.files = {}
+        cls.server.requests = []
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever)
+        cls.server_thread.daemon = True
+        cls.server_thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super(DownloadTestCase, cls).tearDownClass()
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+
+        self.server.files = {self.filename: self.content}
+        self.server.requests = []
+
+        # The command module is reloaded when some settings change, so patch
+        # the settings it currently reads
+        files = cities_command.settings.files
+        url = 'http://127.0.0.1:{}/{{filename}}'.format(self.server.server_port)
+        patcher = mock.patch.dict(files, {
+            'country': dict(files['country'], urls=[url], filename=self.filename),
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_command(self, force=False):
+        command = cities_command.Command()
+        command.data_dir = self.data_dir
+        command.force = force
+        command.download_chunk_size = 1024
+        command.download_cache = {}
+        self.addCleanup(command.stop_downloads)
+        return command
+
+    @property
+    def filepath(self):
+        return os.path.join(self.data_dir, self.filename)
+
+    def read_file(self):
+        with open(self.filepath, 'rb') as fp:
+            return fp.read()
+
+    def read_manifest(self):
+        with open(os.path.join(self.data_dir, 'manifest.json')) as fp:
+            return json.load(fp)
+
+    def test_download(self):
+        self.get_command().download('country')
+
+        self.assertEqual(self.read_file(), self.content)
+        self.assertFalse(os.path.exists(self.filepath + '.part'))
+
+        entry = self.read_manifest()[self.filename]
+        self.assertEqual(entry['size'], len(self.content))
+        self.assertEqual(entry['sha256'], hashlib.sha256(self.content).hexdigest())
+        self.assertTrue(entry['etag'])
+
+    def test_not_modified(self):
+        self.get_command().download('country')
+        self.get_command().download('country')
+
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertIn('If-None-Match', self.server.requests[1])
+        self.assertEqual(self.read_file(), self.content)
+
+    def test_force(self):
+        self.get_command().download('country')
+        self.get_command(force=True).download('country')
+
+        self.assertNotIn('If-None-Match', self.server.requests[1])
+        self.assertEqual(self.read_file(), self.content)
+
+    def test_changed_upstream(self):
+        self.get_command().download('country')
+        self.server.files[self.filename] = self.content + b'AE\tARE\t784\tAE\tUnited Arab Emirates\tAbu Dhabi\n'
+        self.get_command().download('country')
+
+        self.assertEqual(self.read_file(), self.server.files[self.filename])
+
+    def test_resume(self):
+        # Simulate a download that was interrupted half way
+        self.get_command().download('country')
+        etag = self.read_manifest()[self.filename]['etag']
+        half = len(self.content) // 2
+        with open(self.filepath + '.part', 'wb') as fp:
+            fp.write(self.content[:half])
+        os.remove(self.filepath)
+        with open(os.path.join(self.data_dir, 'manifest.json'), 'w') as fp:
+            json.dump({self.filename: {'partial': {
+                'url': 'http://127.0.0.1:{}/{}'.format(self.server.server_port, self.filename),
+                'etag': etag,
+                'last_modified': None,
+            }}}, fp)
+
+        self.get_command().download('country')
+
+        self.assertEqual(self.server.requests[-1]['Range'], 'bytes={}-'.format(half))
+        self.assertEqual(self.read_file(), self.content)
+        entry = self.read_manifest()[self.filename]
+        self.assertEqual(entry['sha256'], hashlib.sha256(self.content).hexdigest())
+        self.assertNotIn('partial', entry)
+
+    def test_local_file_corrupted(self):
+        self.get_command().download('country')
+        with open(self.filepath, 'wb') as fp:
+            fp.write(b'X' * len(self.content))
+
+        self.get_command().download('country')
+
+        self.assertNotIn('If-None-Match', self.server.requests[-1])
+        self.assertEqual(self.read_file(), self.content)
+
+    def test_download_failed(self):
+        self.server.files = {}
+
+        with self.assertRaises(Exception):
+            self.get_command().download('country')
+        self.assertFalse(os.path.exists(self.filepath))
+
+    def test_download_failed_keeps_local_file(self):
+        self.get_command().download('country')
+        self.server.files = {}
+
+        self.get_command(force=True).download('country')
+
+        self.assertEqual(self.read_file(), self.content)
+
+    def test_prefetch(self):
+        url = 'http://127.0.0.1:{}/{{filename}}'.format(self.server.server_port)
+        self.server.files.update({'cities.txt': self.content, 'hierarchy.txt': self.content})
+        files = cities_command.settings.files
+        patcher = mock.patch.dict(files, {
+            'city': dict(files['city'], urls=[url], filename='cities.txt'),
+            'hierarchy': dict(files['hierarchy'], urls=[url], filename='hierarchy.txt'),
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        command = self.get_command()
+        command.prefetch(['city', 'district'])
+        command.download('city')
+        command.download('hierarchy')
+        command.download('city')
+
+        # The city file is used by both stages but only downloaded once
+        self.assertEqual(len(self.server.requests), 2)
+        for filename in ('cities.txt', 'hierarchy.txt'):
+            with open(os.path.join(self.data_dir, filename), 'rb') as fp:
+                self.assertEqual(fp.read(), self.content)
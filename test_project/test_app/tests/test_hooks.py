@@ -0,0 +1,77 @@
+from collections import defaultdict
+
+from django.test import SimpleTestCase
+
+from cities.management.commands import cities as cities_command
+from cities.records import RecordParser
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+FIELDS = ['geonameid', 'name', 'countryCode']
+
+
+class UpperCasePlugin(object):
+    def city_pre_batch(self, parser, items):
+        self.batches = getattr(self, 'batches', 0) + 1
+        for item in items:
+            item['name'] = item['name'].upper()
+
+
+class SkipPlugin(object):
+    def city_pre(self, parser, item):
+        if item['countryCode'] == 'US':
+            # The command module is reloaded when some settings change, so
+            # raise the exception class it currently catches
+            raise cities_command.HookException()
+
+
+class FilterBatchPlugin(object):
+    def city_pre_batch(self, parser, items):
+        return [item for item in items if item['geonameid'] != '2']
+
+
+class HooksTestCase(SimpleTestCase):
+    def get_command(self, *plugins):
+        plugins_by_hook = defaultdict(list)
+        for plugin in plugins:
+            for hook in ('city_pre', 'city_pre_batch'):
+                if hasattr(plugin, hook):
+                    plugins_by_hook[hook].append(plugin)
+        patcher = mock.patch.object(cities_command.settings, 'plugins', plugins_by_hook, create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        command = cities_command.Command()
+        command.options = {'batch_size': 2}
+        return command
+
+    def get_records(self):
+        parse = RecordParser(FIELDS, ['geonameid', 'name'], keep_line=True)
+        return [parse('1\tAndorra la Vella\tAD'), parse('2\tParis\tFR'), parse('3\tNew York City\tUS')]
+
+    def test_no_hooks(self):
+        data = iter(self.get_records())
+
+        self.assertIs(self.get_command().apply_pre_hooks('city', data), data)
+
+    def test_batch_hooks(self):
+        plugin = UpperCasePlugin()
+        items = list(self.get_command(plugin).apply_pre_hooks('city', iter(self.get_records())))
+
+        self.assertEqual([item['name'] for item in items], ['ANDORRA LA VELLA', 'PARIS', 'NEW YORK CITY'])
+        # Stages get typed records, and plugins the whole row as a dict
+        self.assertEqual(items[0]['geonameid'], 1)
+        self.assertEqual(items[0].as_dict()['countryCode'], 'AD')
+        self.assertEqual(plugin.batches, 2)
+
+    def test_skipped(self):
+        skipped = []
+        command = self.get_command(FilterBatchPlugin(), SkipPlugin())
+        items = list(command.apply_pre_hooks('city', iter(self.get_records()), on_skip=skipped.append))
+
+        self.assertEqual([item['geonameid'] for item in items], [1])
+        self.assertEqual(sum(skipped), 2)
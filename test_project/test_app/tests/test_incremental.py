@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from cities.models import AlternativeName, City, ImportState, Region
+
+
+# The daily files in test_project/data are for this day
+DAY = '2020-01-01'
+
+
+class PlaceModificationsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super(PlaceModificationsTestCase, cls).setUpTestData()
+        call_command('cities', force=True, **{
+            'import': 'country,region,subregion,city',
+        })
+        cls.num_cities = City.objects.count()
+        call_command('cities', incremental=True, since=DAY, **{
+            'import': 'region,subregion,city',
+        })
+
+    def test_modified_city(self):
+        self.assertEqual(City.objects.get(id=3041563).population, 22256)
+
+    def test_new_city(self):
+        city = City.objects.get(id=3041565)
+        self.assertEqual(city.name, 'Santa Coloma')
+        self.assertEqual(city.region.code, '07')
+
+    def test_small_places(self):
+        # Places under the population of cities1000.txt are only updated if
+        # they were imported before
+        self.assertEqual(City.objects.get(id=3041519).population, 950)
+        self.assertFalse(City.objects.filter(id=3039183).exists())
+
+    def test_modified_region(self):
+        self.assertEqual(Region.objects.get(id=3041566).name, "Parròquia d'Andorra la Vella")
+
+    def test_deleted_city(self):
+        self.assertFalse(City.objects.filter(id=3039154).exists())
+        self.assertEqual(City.objects.count(), self.num_cities)
+
+    def test_last_applied_day(self):
+        self.assertEqual(ImportState.objects.get(key='modifications').value, DAY)
+
+
+class AltNameModificationsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super(AltNameModificationsTestCase, cls).setUpTestData()
+        call_command('cities', force=True, **{
+            'import': 'country,region,subregion,city,alt_name',
+        })
+        call_command('cities', incremental=True, since=DAY, **{
+            'import': 'alt_name',
+        })
+
+    def test_modified_name(self):
+        alt = AlternativeName.objects.get(id=1596135)
+        self.assertEqual(alt.name, 'Andorra-la-Vella')
+        self.assertTrue(alt.is_preferred)
+        self.assertTrue(City.objects.get(id=3041563).alt_names.filter(id=1596135).exists())
+
+    def test_relinked_name(self):
+        self.assertTrue(City.objects.get(id=3040686).alt_names.filter(id=1904148).exists())
+        self.assertFalse(City.objects.get(id=3040051).alt_names.filter(id=1904148).exists())
+
+    def test_name_no_longer_imported(self):
+        # Its language isn't in CITIES_LOCALES any more
+        self.assertFalse(AlternativeName.objects.filter(id=1616221).exists())
+        self.assertFalse(City.objects.get(id=3039678).alt_names.filter(id=1616221).exists())
+
+    def test_new_names(self):
+        self.assertTrue(City.objects.get(id=3041204).alt_names.filter(id=9000001, name='Canillo Parish').exists())
+        # Names of places that aren't imported are skipped
+        self.assertFalse(AlternativeName.objects.filter(id=9000002).exists())
+
+    def test_deleted_name(self):
+        self.assertFalse(AlternativeName.objects.filter(id=4307264).exists())
+        self.assertTrue(City.objects.get(id=3041204).alt_names.filter(id=1904038).exists())
+
+    def test_last_applied_day(self):
+        self.assertEqual(ImportState.objects.get(key='alternateNamesModifications').value, DAY)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+from collections import defaultdict
 from unittest import skipIf
 
 from django import VERSION as django_version
@@ -9,13 +10,18 @@ from django.test import TestCase, override_settings
 from django.test.signals import setting_changed
 
 from cities.models import (Country, Region, Subregion, City, District,
-                           PostalCode, AlternativeName)
+                           PostalCode, AlternativeName, ImportState)
 
 from ..mixins import (
     NoInvalidSlugsMixin, CountriesMixin, RegionsMixin, SubregionsMixin,
     CitiesMixin, DistrictsMixin, AlternativeNamesMixin, PostalCodesMixin)
 from ..utils import reload_cities_settings
 
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
 
 setting_changed.connect(reload_cities_settings, dispatch_uid='reload_cities_settings')
 
@@ -101,6 +107,84 @@ class ManageCommandTestCase(
         self.assertEqual(PostalCode.objects.count(), self.counts['postal_codes'])
 
 
+class InterruptPlugin(object):
+    """Fails the import in the post batch hooks of the ``batch``th batch."""
+
+    def __init__(self, batch=2):
+        self.batch = batch
+        self.batches = 0
+
+    def post_batch(self, parser, objs, items):
+        self.batches += 1
+        if self.batches == self.batch:
+            raise RuntimeError("Interrupted")
+
+    city_post_batch = postal_code_post_batch = post_batch
+
+
+class CommitEveryManageCommandTestCase(TestCase):
+    def import_cities(self, **options):
+        plugins = defaultdict(list, city_post_batch=[InterruptPlugin(batch=3)])
+        with mock.patch('cities.management.commands.cities.settings.plugins', plugins, create=True):
+            with self.assertRaises(RuntimeError):
+                call_command('cities', force=True, batch_size=10, **dict({
+                    'import': 'country,region,subregion,city',
+                }, **options))
+
+    def test_commit_every(self):
+        self.import_cities(commit_every=15)
+        # The stages before the city stage were committed when they finished,
+        # and the cities after the first whole batches of at least 15 rows
+        self.assertEqual(Country.objects.count(), 250)
+        self.assertEqual(Region.objects.count(), 171)
+        self.assertEqual(Subregion.objects.count(), 4928)
+        self.assertEqual(City.objects.count(), 20)
+
+    def test_single_transaction(self):
+        self.import_cities()
+        self.assertEqual(Country.objects.count(), 0)
+        self.assertEqual(City.objects.count(), 0)
+
+
+class ResumeManageCommandTestCase(TestCase):
+    num_postal_codes = 13
+
+    @classmethod
+    def setUpTestData(cls):
+        super(ResumeManageCommandTestCase, cls).setUpTestData()
+        call_command('cities', force=True, **{
+            'import': 'country,region,subregion,city',
+        })
+
+    def import_postal_codes(self, **options):
+        call_command('cities', force=True, commit_every=4, batch_size=4, **dict({
+            'import': 'postal_code',
+        }, **options))
+
+    def test_resume_first_postal_code_import(self):
+        plugins = defaultdict(list, postal_code_post_batch=[InterruptPlugin()])
+        with mock.patch('cities.management.commands.cities.settings.plugins', plugins, create=True):
+            with self.assertRaises(RuntimeError):
+                self.import_postal_codes()
+        self.assertEqual(PostalCode.objects.count(), 4)
+
+        # The postal codes of the resumed import are created, not matched
+        # against the ones the interrupted import committed
+        self.import_postal_codes(resume=True)
+        self.assertEqual(PostalCode.objects.count(), self.num_postal_codes)
+        self.assertEqual(PostalCode.objects.values('code').distinct().count(), self.num_postal_codes)
+        self.assertFalse(ImportState.objects.filter(key__startswith='checkpoint.').exists())
+
+    def test_resume_after_finished_import(self):
+        self.import_postal_codes()
+        self.assertFalse(ImportState.objects.filter(key__startswith='checkpoint.').exists())
+
+        # Nothing is left to resume, so everything is imported again
+        PostalCode.objects.all().delete()
+        self.import_postal_codes(resume=True)
+        self.assertEqual(PostalCode.objects.count(), self.num_postal_codes)
+
+
 # This was tested manually
 @skipIf(django_version < (1, 8), "Django < 1.8, skipping test with CITIES_LOCALES=['all']")
 @override_settings(CITIES_LOCALES=['all'])
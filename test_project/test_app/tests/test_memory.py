@@ -0,0 +1,62 @@
+from django.db import connection
+from django.test import SimpleTestCase
+
+from cities.management.commands.cities import Command
+from cities.util import get_rss
+
+
+class MemoryTestCase(SimpleTestCase):
+    def get_command(self, **options):
+        command = Command()
+        command.options = options
+        return command
+
+    def test_get_rss(self):
+        self.assertGreater(get_rss(), 0)
+
+    def test_query_log(self):
+        queries_log = connection.queries_log
+        command = self.get_command(query_log=2)
+
+        command.limit_query_logs()
+        self.assertIsNot(connection.queries_log, queries_log)
+        self.assertEqual(connection.queries_log.maxlen, 2)
+
+        command.restore_query_logs()
+        self.assertIs(connection.queries_log, queries_log)
+
+    def test_free_memory(self):
+        command = self.get_command()
+        command.current_import = 'alt_name'
+        command.country_index = {}
+        command.hierarchy = {}
+
+        self.assertEqual(command.free_memory(), ['country_index', 'hierarchy'])
+        self.assertFalse(hasattr(command, 'country_index'))
+
+    def test_free_memory_subregion_names(self):
+        command = self.get_command()
+        command.current_import = 'postal_code'
+        command.region_index = {}
+        command.subregion_name_index = {}
+        command.subregion_name_std_index = {}
+
+        self.assertEqual(command.free_memory(),
+                         ['region_index', 'subregion_name_index', 'subregion_name_std_index'])
+        self.assertFalse(hasattr(command, 'subregion_name_index'))
+        self.assertFalse(hasattr(command, 'subregion_name_std_index'))
+
+    def test_free_memory_keeps_caches_in_use(self):
+        command = self.get_command()
+        command.current_import = 'district'
+        command.country_index = {}
+        command.hierarchy = {}
+
+        self.assertEqual(command.free_memory(), [])
+        self.assertTrue(hasattr(command, 'hierarchy'))
+
+    def test_peak(self):
+        command = self.get_command(max_memory=0)
+        command.check_memory()
+
+        self.assertGreater(command.memory_peak, 0)
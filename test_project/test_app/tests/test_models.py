@@ -26,6 +26,18 @@ class SlugModelTest(object):
         instance = self.instantiate()
         instance.save(force_insert=True)
 
+    def test_save_defer_slug(self):
+        """
+        save() with defer_slug=True should write a new object once, leaving a
+        slug that needs its ID empty.
+        """
+        instance = self.instantiate()
+        needs_id = instance.slugify() is None and getattr(instance, 'slug_contains_id', False)
+        instance.save(defer_slug=True)
+        instance.refresh_from_db()
+        if needs_id:
+            self.assertIsNone(instance.slug)
+
 
 class ContinentTestCase(SlugModelTest, TestCase):
 
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from cities.management.commands.cities import Command, import_fields
+from cities.models import City, District, PostalCode
+
+
+class PostalCodeFileMixin(object):
+    def load_postal_codes(self, rows):
+        """Import postal code rows, given as lists of columns, from a file of their own."""
+        data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_dir)
+        with io.open(os.path.join(data_dir, 'postal_codes.txt'), 'w', encoding='utf-8') as fp:
+            for row in rows:
+                fp.write('\t'.join(row) + '\n')
+
+        command = Command()
+        command.data_dir = data_dir
+        command.options = {'quiet': True}
+        command.build_country_index()
+        return command.load_postal_codes(command.get_data('postal_code', filenames=['postal_codes.txt'],
+                                                          fields=import_fields['postal_code']))
+
+
+class PostalCodeMatchingTestCase(PostalCodeFileMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super(PostalCodeMatchingTestCase, cls).setUpTestData()
+        call_command('cities', force=True, **{
+            'import': 'country,region,subregion,city,postal_code',
+        })
+
+    def test_matched_and_new_postal_codes(self):
+        pks = dict(PostalCode.objects.filter(code__in=['04001', '04002']).values_list('code', 'pk'))
+        num_postal_codes = PostalCode.objects.count()
+
+        stats = self.load_postal_codes([
+            # As it is
+            ['ES', '04001', 'Almeria', 'Andalucia', 'AN', 'Almería', 'AL', '', '', '36.8381', '-2.4597', '4'],
+            # Moved
+            ['ES', '04002', 'Almeria', 'Andalucia', 'AN', 'Almería', 'AL', '', '', '36.84', '-2.46', '4'],
+            ['ES', '04999', 'Almeria', 'Andalucia', 'AN', 'Almería', 'AL', '', '', '36.8381', '-2.4597', '4'],
+        ])
+
+        self.assertEqual((stats['created'], stats['updated'], stats['unchanged']), (1, 1, 1))
+        # 04001 matched on its location, 04002 on its admin areas
+        self.assertEqual(stats['query_statistics'][:2], [1, 1])
+        self.assertEqual(PostalCode.objects.count(), num_postal_codes + 1)
+
+        self.assertEqual(PostalCode.objects.get(code='04001').pk, pks['04001'])
+        moved = PostalCode.objects.get(code='04002')
+        self.assertEqual(moved.pk, pks['04002'])
+        self.assertEqual(moved.location.coords, (-2.46, 36.84))
+
+        new = PostalCode.objects.get(code='04999')
+        self.assertNotIn(new.pk, pks.values())
+        self.assertEqual(new.name, 'Almeria')
+        self.assertEqual(new.slug, '{}-04999'.format(new.pk))
+
+
+class AdminAreaTestCase(PostalCodeFileMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super(AdminAreaTestCase, cls).setUpTestData()
+        call_command('cities', force=True, **{
+            'import': 'country,region,subregion,city',
+        })
+        almeria = City.objects.get(id=2521886)
+        # Two districts of the same city whose names only differ in case
+        cls.districts = [District.objects.create(id=district_id, name=name, name_std=name, city=almeria,
+                                                 location=almeria.location, population=0)
+                         for district_id, name in ((90000001, 'Centro'), (90000002, 'CENTRO'))]
+
+    def test_names_are_casefolded(self):
+        stats = self.load_postal_codes([
+            ['ES', '04998', 'Centro', 'ANDALUSIA', '51', 'almeria', 'AL', 'centro', '', '36.84', '-2.46', '4'],
+        ])
+
+        pc = PostalCode.objects.get(code='04998')
+        self.assertEqual(pc.region_id, 2593109)
+        # By standard name
+        self.assertEqual(pc.subregion_id, 2521883)
+        # The district with the lowest id wins, and the other is reported
+        self.assertEqual(pc.district_id, self.districts[0].id)
+        self.assertEqual(pc.city_id, 2521886)
+        self.assertEqual(stats['districts_to_delete'], [self.districts[1].id])
+
+    def test_unknown_names(self):
+        self.load_postal_codes([
+            ['ES', '04997', 'Nowhere', 'Andalucia', 'AN', 'Almería', 'AL', 'Nowhere', '', '36.84', '-2.46', '4'],
+        ])
+
+        pc = PostalCode.objects.get(code='04997')
+        self.assertIsNone(pc.region)
+        self.assertIsNone(pc.subregion)
+        self.assertIsNone(pc.district)
+        self.assertIsNone(pc.city)
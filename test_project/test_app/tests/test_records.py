@@ -0,0 +1,84 @@
+from django.test import SimpleTestCase
+
+from cities.records import RecordParser, country_filter
+
+
+FIELDS = ['geonameid', 'name', 'latitude', 'longitude', 'featureCode', 'population', 'timezone']
+
+
+class RecordParserTestCase(SimpleTestCase):
+    def test_projection_and_types(self):
+        parse = RecordParser(FIELDS, ['geonameid', 'latitude', 'featureCode', 'population'])
+        record = parse('3039163\tSant Julià de Lòria\t42.46372\t1.49129\tPPLA\t8022\tEurope/Andorra')
+
+        self.assertEqual(record['geonameid'], 3039163)
+        self.assertEqual(record['latitude'], 42.46372)
+        self.assertEqual(record['featureCode'], 'PPLA')
+        self.assertEqual(record['population'], 8022)
+        self.assertEqual(record.get('population'), 8022)
+        self.assertNotIn('name', record)
+        with self.assertRaises(KeyError):
+            record['name']
+
+    def test_interned(self):
+        parse = RecordParser(FIELDS, ['featureCode'])
+        a = parse('1\ta\t0\t0\t' + ''.join(['PP', 'L']) + '\t0\tUTC')
+        b = parse('2\tb\t0\t0\t' + ''.join(['P', 'PL']) + '\t0\tUTC')
+        self.assertIs(a['featureCode'], b['featureCode'])
+
+    def test_invalid_numbers_are_kept(self):
+        record = RecordParser(FIELDS, ['geonameid', 'population'])('abc\tx\t0\t0\tPPL\t\tUTC')
+
+        self.assertEqual(record['geonameid'], 'abc')
+        self.assertEqual(record['population'], '')
+
+    def test_short_row(self):
+        record = RecordParser(FIELDS, ['geonameid', 'timezone'])('1\tname')
+
+        self.assertEqual(record['geonameid'], 1)
+        self.assertNotIn('timezone', record)
+        self.assertIsNone(record.get('timezone'))
+
+    def test_as_dict(self):
+        line = '3039163\tSant Julià de Lòria\t42.46372\t1.49129\tPPLA\t8022\tEurope/Andorra'
+        record = RecordParser(FIELDS, ['geonameid'], keep_line=True)(line)
+
+        self.assertEqual(record.as_dict(), dict(zip(FIELDS, line.split('\t'))))
+        self.assertIs(record.as_dict(), record.as_dict())
+
+    def test_line_not_kept(self):
+        line = '3039163\tSant Julià de Lòria\t42.46372\t1.49129\tPPLA\t8022\tEurope/Andorra'
+        record = RecordParser(FIELDS, ['geonameid', 'population'])(line)
+
+        self.assertIsNone(record.row)
+        self.assertEqual(record.as_dict(), {'geonameid': 3039163, 'population': 8022})
+
+    def test_from_dict(self):
+        parse = RecordParser(FIELDS, ['geonameid', 'latitude', 'timezone'], keep_line=True)
+        row = parse('3039163\tSant Julià de Lòria\t42.46372\t1.49129\tPPLA\t8022\tEurope/Andorra').as_dict()
+        row['latitude'] = '42.5'
+        del row['timezone']
+        record = parse.record_class.from_dict(row)
+
+        self.assertEqual(record['geonameid'], 3039163)
+        self.assertEqual(record['latitude'], 42.5)
+        self.assertNotIn('timezone', record)
+        self.assertIs(record.as_dict(), row)
+
+
+class CountryFilterTestCase(SimpleTestCase):
+    def test_country_column(self):
+        accept = country_filter(['geonameid', 'name', 'countryCode'], 'countryCode', ['AD', 'FR'])
+
+        self.assertTrue(accept(b'3039163\tSant Juli\xc3\xa0 de L\xc3\xb2ria\tAD'))
+        self.assertTrue(accept(b'2988507\tParis\tFR\r\n'))
+        self.assertFalse(accept(b'5128581\tNew York City\tUS'))
+        self.assertFalse(accept(b'1\tshort'))
+
+    def test_code_prefix(self):
+        accept = country_filter(['code', 'name'], 'code', ['US'])
+
+        self.assertTrue(accept(b'US.CA\tCalifornia'))
+        self.assertTrue(accept(b'US.CA.037\tLos Angeles County'))
+        self.assertFalse(accept(b'USX.CA\tNowhere'))
+        self.assertFalse(accept(b'CA.01\tAlberta'))
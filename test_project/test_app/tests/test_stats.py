@@ -0,0 +1,130 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+from django.utils import timezone
+
+from cities.management.commands.cities import Command
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class StatsTestCase(SimpleTestCase):
+    content = b'# comment\n1\tAndorra la Vella\n2\tParis\n3\tNew York City\n'
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        with io.open(os.path.join(self.data_dir, 'cities.txt'), 'wb') as fp:
+            fp.write(self.content)
+
+    def get_command(self, **options):
+        command = Command()
+        command.data_dir = self.data_dir
+        command.options = dict({'quiet': True}, **options)
+        command.stats = {'started': timezone.now(), 'stages': []}
+        return command
+
+    def test_stage_stats(self):
+        command = self.get_command()
+
+        def import_test():
+            for item in command.get_data('city', filenames=['cities.txt']):
+                pass
+            command.rows_written(3, created=1, unchanged=1)
+        command.import_test = import_test
+        command.run_stage('import_test')
+
+        stats, = command.stats['stages']
+        self.assertEqual(stats['stage'], 'import_test')
+        self.assertEqual(stats['rows_read'], 3)
+        self.assertEqual(stats['rows_created'], 1)
+        self.assertEqual(stats['rows_updated'], 1)
+        self.assertEqual(stats['rows_unchanged'], 1)
+        self.assertEqual(stats['rows_skipped'], 0)
+        self.assertEqual(stats['files'], {'cities.txt': len(self.content)})
+        self.assertGreater(stats['peak_rss'], 0)
+        self.assertIn('wall_time', stats)
+        self.assertIn('queries', stats)
+
+    def test_failed_stage(self):
+        command = self.get_command()
+
+        def import_test():
+            raise ValueError()
+        command.import_test = import_test
+        with self.assertRaises(ValueError):
+            command.run_stage('import_test')
+
+        self.assertEqual(len(command.stats['stages']), 1)
+
+    def test_stats_file(self):
+        path = os.path.join(self.data_dir, 'stats.json')
+        command = self.get_command(stats_file=path)
+        command.save_stats('finished')
+
+        with io.open(path) as fp:
+            stats = json.load(fp)
+        self.assertEqual(stats['status'], 'finished')
+        self.assertEqual(stats['stages'], [])
+        self.assertIn('finished', stats)
+
+
+class RowCountTestCase(SimpleTestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        self.write_file(StatsTestCase.content)
+
+    def write_file(self, content):
+        with io.open(os.path.join(self.data_dir, 'cities.txt'), 'wb') as fp:
+            fp.write(content)
+
+    def get_command(self):
+        command = Command()
+        command.data_dir = self.data_dir
+        command.options = {'quiet': True}
+        return command
+
+    def read_cities(self, command):
+        return list(command.get_data('city', filenames=['cities.txt']))
+
+    def test_row_count_recorded(self):
+        self.read_cities(self.get_command())
+
+        with io.open(os.path.join(self.data_dir, 'manifest.json'), encoding='utf-8') as fp:
+            self.assertEqual(json.load(fp)['cities.txt']['rows'], 3)
+        self.assertEqual(self.get_command().get_row_count('cities.txt'), 3)
+
+    def test_row_count_not_recorded_for_partial_read(self):
+        data = self.get_command().get_data('city', filenames=['cities.txt'])
+        next(data)
+        data.close()
+
+        self.assertIsNone(self.get_command().get_row_count('cities.txt'))
+
+    def test_row_count_of_changed_file(self):
+        self.read_cities(self.get_command())
+        self.write_file(StatsTestCase.content + b'4\tKyiv\n')
+
+        command = self.get_command()
+        self.assertIsNone(command.get_row_count('cities.txt'))
+        self.read_cities(command)
+        self.assertEqual(self.get_command().get_row_count('cities.txt'), 4)
+
+    def test_progress_by_rows(self):
+        with mock.patch('cities.management.commands.cities.tqdm') as tqdm:
+            self.read_cities(self.get_command())
+        # The size of the file is only known in bytes the first time
+        self.assertEqual(tqdm.call_args[1]['unit'], 'B')
+
+        with mock.patch('cities.management.commands.cities.tqdm') as tqdm:
+            self.read_cities(self.get_command())
+        self.assertEqual(tqdm.call_args, mock.call(disable=True, total=3, desc=None))
+        self.assertEqual(tqdm.return_value.update.call_args_list, [mock.call(1)] * 3)
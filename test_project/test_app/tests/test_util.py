@@ -0,0 +1,61 @@
+import random
+
+from django.contrib.gis.geos import Point
+from django.test import SimpleTestCase
+
+from cities.util import IdMap, IdSet, NearestIndex, geo_distance
+
+
+class NearestIndexTestCase(SimpleTestCase):
+    def test_nearest(self):
+        rand = random.Random(0)
+        points = [Point(rand.uniform(-180, 180), rand.uniform(-90, 90)) for _ in range(500)]
+        index = NearestIndex(max_distance=1000)
+        for i, point in enumerate(points):
+            index.add(point, i)
+
+        for _ in range(200):
+            target = Point(rand.uniform(-180, 180), rand.uniform(-90, 90))
+            distances = [(geo_distance(target, point), i) for i, point in enumerate(points)]
+            dist, expected = min(distances)
+            if dist > 1000:
+                expected = None
+            self.assertEqual(index.nearest(target), expected)
+
+    def test_antimeridian_and_poles(self):
+        index = NearestIndex(max_distance=1000)
+        index.add(Point(179.9, 0), 'east')
+        index.add(Point(0, 89.9), 'north')
+
+        self.assertEqual(index.nearest(Point(-179.9, 0)), 'east')
+        self.assertEqual(index.nearest(Point(180, 89.8)), 'north')
+        self.assertIsNone(index.nearest(Point(90, 0)))
+
+
+class IdSetTestCase(SimpleTestCase):
+    def test_contains(self):
+        ids = IdSet([5, 1, 3, 2 ** 40])
+
+        self.assertEqual(len(ids), 4)
+        for id_ in (1, 3, 5, 2 ** 40):
+            self.assertIn(id_, ids)
+        for id_ in (0, 2, 4, 6, 2 ** 41):
+            self.assertNotIn(id_, ids)
+        self.assertNotIn(1, IdSet())
+
+
+class IdMapTestCase(SimpleTestCase):
+    def test_lookup(self):
+        ids = IdMap([(5, 50), (1, 10), (3, 30), (5, 55), (2 ** 40, 1)])
+
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(ids[1], 10)
+        self.assertEqual(ids[3], 30)
+        # The last value for a key wins
+        self.assertEqual(ids[5], 55)
+        self.assertEqual(ids[2 ** 40], 1)
+        self.assertIn(5, ids)
+        self.assertNotIn(4, ids)
+        self.assertIsNone(ids.get(4))
+        with self.assertRaises(KeyError):
+            ids[0]
@@ -0,0 +1,16 @@
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class WorkersTestCase(SimpleTestCase):
+    def test_rejected_on_sqlite(self):
+        connections = {'default': mock.Mock(vendor='sqlite')}
+        with mock.patch('cities.management.commands.cities.connections', connections):
+            with self.assertRaises(CommandError):
+                call_command('cities', workers=2, **{'import': 'postal_code'})